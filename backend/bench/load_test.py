@@ -0,0 +1,120 @@
+"""
+Load-test the API: throughput and tail latency of a frontend-like request mix at increasing concurrency.
+
+Compare two builds by serving each on its own port and passing both, e.g. the sync build checked out
+in a worktree on :8001 and the async build on :8000 (run both with RESPONSE_CACHE=0 to measure the
+database path rather than the response cache):
+
+    python backend/bench/load_test.py sync=http://localhost:8001 async=http://localhost:8000 \
+        --concurrency 16 64 256 --duration 20 --json load_test.json
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+DEFAULT_CONCURRENCY = (16, 64, 256)
+
+# Short prefixes like the frontend's autocomplete sends on each keystroke
+SEARCH_TERMS = ["le", "lev", "level", "car", "card", "visit", "knee", "mri", "heart", "sep"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+async def build_workload(client, base_url, seed=0):
+    """Request mix drawn from the server's own hospitals/payers, weighted like the frontend's traffic."""
+    rng = random.Random(seed)
+    hospitals = (await client.get(f"{base_url}/hospitals")).json() or [None]
+    payers = (await client.get(f"{base_url}/payers")).json() or [None]
+
+    requests = []
+    for _ in range(500):
+        hospital, payer, search = rng.choice(hospitals), rng.choice(payers), rng.choice(SEARCH_TERMS)
+        requests += [
+            ("/procedures", {"search": search, "hospital": hospital}),
+            ("/procedures", {"search": search}),
+            ("/rates", {"search": search, "hospital": hospital, "payer": payer}),
+            ("/rates", {"search": search}),
+            ("/plans", {"payer": payer}),
+        ]
+    requests += [("/hospitals", {}), ("/payers", {})] * 50
+    rng.shuffle(requests)
+    return [(path, {k: v for k, v in params.items() if v is not None}) for path, params in requests]
+
+
+async def run_level(client, base_url, workload, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(offset):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            path, params = workload[i % len(workload)]
+            i += concurrency
+            started = time.perf_counter()
+            try:
+                response = await client.get(f"{base_url}{path}", params=params)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": (latencies[-1] if latencies else float("nan")) * 1000,
+    }
+
+
+async def run(targets, concurrency_levels, duration, warmup):
+    results = []
+    limits = httpx.Limits(max_connections=max(concurrency_levels), max_keepalive_connections=max(concurrency_levels))
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        for label, base_url in targets:
+            workload = await build_workload(client, base_url)
+            await run_level(client, base_url, workload, min(concurrency_levels), warmup)
+            for concurrency in concurrency_levels:
+                result = dict(target=label, url=base_url, **await run_level(client, base_url, workload, concurrency, duration))
+                results.append(result)
+                print(f"{label:>10} c={concurrency:<5} {result['rps']:>9,.0f} req/s  p50 {result['p50_ms']:7.1f} ms"
+                      f"  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  errors {result['errors']}")
+    return results
+
+
+def parse_target(value):
+    label, sep, url = value.partition("=")
+    return (label, url.rstrip("/")) if sep else (value, value.rstrip("/"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", type=parse_target, help="[label=]base URL of a running API")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of traffic before measuring each target")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.targets, args.concurrency, args.duration, args.warmup))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
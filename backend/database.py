@@ -1,13 +1,50 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/honest_healthcare")
 
-engine = create_engine(DATABASE_URL)
+# Pool sizing, per engine (API requests use the async engine; index reloads and version polls use the sync one)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# Server-side statement_timeout in milliseconds; 0 disables it
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+POOL_OPTIONS = {
+    "pool_size": POOL_SIZE,
+    "max_overflow": MAX_OVERFLOW,
+    "pool_timeout": POOL_TIMEOUT,
+    "pool_recycle": POOL_RECYCLE,
+    "pool_pre_ping": POOL_PRE_PING,
+}
+
+
+def driver_url(url, driver):
+    """Pins the DBAPI driver, e.g. postgresql://... -> postgresql+asyncpg://..."""
+    scheme, rest = url.split("://", 1)
+    return f"{scheme.split('+')[0]}+{driver}://{rest}"
+
+
+engine = create_engine(
+    driver_url(DATABASE_URL, "psycopg2"),
+    connect_args={"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"},
+    **POOL_OPTIONS,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    driver_url(DATABASE_URL, "asyncpg"),
+    connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}},
+    **POOL_OPTIONS,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -16,3 +53,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
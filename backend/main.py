@@ -1,11 +1,51 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+import io
+import csv
+import base64
+import itertools
+from urllib.parse import urlencode
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from sqlalchemy import select, func, text, table, column, tuple_, union_all, literal
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from . import models, database
-from pydantic import BaseModel
+from . import models, database, rate_index, response_cache, request_metrics
+from pydantic import BaseModel, Field
+import orjson
 
-app = FastAPI(title="Honest Healthcare API")
+# Max rows returned by /rates and /procedures
+RATES_LIMIT = 400
+PROCEDURES_LIMIT = 10
+
+# Largest page a client may ask /rates for
+RATES_MAX_LIMIT = 5000
+
+# Most filter sets one /rates/batch request may carry (after expanding the cross product)
+RATES_BATCH_MAX_SETS = 500
+
+# Rows fetched from the server-side cursor (or the index) per chunk of a streamed export
+EXPORT_BATCH_ROWS = 1000
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    request_metrics.start()
+    rate_index.start()
+    response_cache.start()
+    yield
+    response_cache.stop()
+    request_metrics.stop()
+    rate_index.stop()
+    await database.async_engine.dispose()
+
+app = FastAPI(title="Honest Healthcare API", lifespan=lifespan)
+
+# Registered before CORS so cached responses still get CORS headers
+app.middleware("http")(response_cache.middleware)
+# Outside the cache, so hits are timed too
+app.middleware("http")(request_metrics.middleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,9 +53,28 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+# /rates/compare groupings: `by` -> (column compared across, rollup precomputing it)
+COMPARE_GROUPS = {
+    "hospital": ("hospital_name", models.RateCompareByHospital),
+    "payer": ("payer", models.RateCompareByPayer),
+}
+
+# Tables holding Gold's rollup cube, one per grouping set; their text columns are the keys
+ROLLUP_TABLE_PREFIX = "emory_rollup_"
+
 # Pydantic schemas
+class CompareResponse(BaseModel):
+    group: Optional[str]
+    min_median_rate: float
+    max_median_rate: float
+    median_rate: float
+    spread: float
+    rate_count: int
+    rank: int
+
 class RateResponse(BaseModel):
     hospital_name: str
     billing_code: str
@@ -24,84 +83,400 @@ class RateResponse(BaseModel):
     setting: str
     payer: str
     plan: str
-    min_rate: float
-    max_rate: float
-    median_rate: float
+    min_rate: Optional[float]
+    max_rate: Optional[float]
+    median_rate: Optional[float]
     record_count: int
 
     class Config:
         from_attributes = True
 
+class RateFilter(BaseModel):
+    key: Optional[str] = None
+    code: Optional[str] = None
+    hospital: Optional[str] = None
+    setting: Optional[str] = None
+    payer: Optional[str] = None
+    plan: Optional[str] = None
+
+class RateBatchRequest(BaseModel):
+    # Explicit filter sets, plus the cross product of whichever of the lists below are non-empty
+    filters: List[RateFilter] = []
+    codes: List[str] = []
+    hospitals: List[str] = []
+    settings: List[str] = []
+    payers: List[str] = []
+    plans: List[str] = []
+    limit: int = Field(RATES_LIMIT, ge=1, le=RATES_MAX_LIMIT)
+
+class RateBatchResult(BaseModel):
+    key: str
+    filters: dict
+    rates: List[RateResponse]
+    has_more: bool
+
+# /rates selects just these columns, in response field order
+RATE_FIELDS = list(RateResponse.model_fields)
+RATE_COLUMNS = [getattr(models.NegotiatedRate, field) for field in RATE_FIELDS]
+
+def json_rows(rows, next_after=None, version=None):
+    """Encodes RateResponse-shaped dicts straight to JSON bytes, skipping per-row model validation."""
+    headers = {"X-Next-Cursor": encode_cursor(version, next_after)} if next_after is not None else None
+    with request_metrics.phase("serialize"):
+        content = orjson.dumps(rows)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+def encode_cursor(version, last_id):
+    # Ids are reassigned by every load, so a cursor is only good for the data version it was issued on
+    return base64.urlsafe_b64encode(f"{version}:{last_id}".encode("ascii")).decode("ascii")
+
+def decode_cursor(cursor):
+    """(data version, last id) of a cursor."""
+    try:
+        version, last_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii").split(":")
+        return int(version), int(last_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_data_version(db):
+    """Latest etl_data_version, as rate_index.fetch_version reads it for the sync engine."""
+    try:
+        return (await db.execute(select(func.max(models.DataVersion.version)))).scalar() or 0
+    except Exception:
+        # Loaded by an older loader that doesn't publish versions yet
+        await db.rollback()
+        return 0
+
+def filter_rates(query, search=None, code=None, hospital=None, setting=None, payer=None, plan=None):
+    """Applies the /rates filters to a query over emory_negotiated_rates."""
+    if code:
+        query = query.where(models.NegotiatedRate.billing_code == code)
+    if search:
+        query = query.where(models.NegotiatedRate.procedure_type.ilike(f"%{search}%"))
+    if hospital:
+        query = query.where(models.NegotiatedRate.hospital_name == hospital)
+    if setting:
+        query = query.where(models.NegotiatedRate.setting == setting.lower())
+    if payer:
+        query = query.where(models.NegotiatedRate.payer == payer)
+    if plan:
+        query = query.where(models.NegotiatedRate.plan == plan)
+    return query
+
+def rates_query(search=None, after=None, **filters):
+    """(id, *RATE_COLUMNS) for rates matching the filters, in id order, starting after id `after`."""
+    # Plain column tuples: no ORM instances, identity map or RateResponse validation
+    query = filter_rates(select(models.NegotiatedRate.id, *RATE_COLUMNS), search, **filters)
+    if after is not None:
+        query = query.where(models.NegotiatedRate.id > after)
+
+    return query.order_by(models.NegotiatedRate.id)
+
+def batch_filter_sets(batch):
+    """The request's filter sets as (key, {filter: value}) pairs, explicit ones first, then the cross product."""
+    sets = [(item.key, item.model_dump(exclude={"key"}, exclude_none=True)) for item in batch.filters]
+    dimensions = {name: values for name, values in zip(rate_index.FILTER_COLUMNS, (batch.codes, batch.hospitals, batch.settings, batch.payers, batch.plans)) if values}
+    if dimensions:
+        sets += [(None, dict(zip(dimensions, values))) for values in itertools.product(*dimensions.values())]
+    if len(sets) > RATES_BATCH_MAX_SETS:
+        raise HTTPException(status_code=400, detail=f"At most {RATES_BATCH_MAX_SETS} filter sets per batch")
+    if any(not filters for _, filters in sets):
+        raise HTTPException(status_code=400, detail=f"Each filter set needs at least one of {', '.join(rate_index.FILTER_COLUMNS)}")
+    for _, filters in sets:
+        if "setting" in filters:
+            filters["setting"] = filters["setting"].lower()
+    # Keys default to the set's /rates query string, e.g. code=871&payer=Aetna
+    return [(key or urlencode(filters), filters) for key, filters in sets]
+
+def batch_rates_query(shapes, limit):
+    """
+    One statement for every filter set: per shape (the filters a set uses), rates whose shape columns are
+    IN the sets' value tuples, numbered per tuple in id order so each key keeps its first `limit` + 1.
+    """
+    selects = []
+    for position, (shape, values) in enumerate(shapes.items()):
+        columns = [getattr(models.NegotiatedRate, rate_index.FILTER_COLUMNS[name]) for name in shape]
+        keys = tuple_(*columns).in_(values) if len(columns) > 1 else columns[0].in_([value for value, in values])
+        number = func.row_number().over(partition_by=columns, order_by=models.NegotiatedRate.id).label("number")
+        ranked = select(literal(position).label("shape"), models.NegotiatedRate.id, *RATE_COLUMNS, number).where(keys).subquery()
+        selects.append(select(ranked).where(ranked.c.number <= limit + 1))
+    return union_all(*selects).order_by("id")
+
+async def stream_rates(query):
+    """Yields batches of rate dicts from a server-side cursor, so memory stays flat however many rows match."""
+    # Own session: the request's session is closed once the endpoint returns, before the body is streamed
+    async with database.AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        async for records in result.partitions():
+            yield [dict(zip(RATE_FIELDS, record[1:])) for record in records]
+
+async def encode_export(batches, format):
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, RATE_FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue().encode("utf-8")
+    async for rows in batches:
+        if format == "ndjson":
+            yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
+        else:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+
+def rank_groups(stats):
+    """Orders (group, min, max, median, count) rows cheapest median first; equal medians share a rank."""
+    ranked = []
+    for position, (group, low, high, median, count) in enumerate(sorted(stats, key=lambda row: (row[3], row[0] or ""))):
+        rank = ranked[-1]["rank"] if ranked and ranked[-1]["median_rate"] == median else position + 1
+        ranked.append({
+            "group": group, "min_median_rate": low, "max_median_rate": high, "median_rate": median,
+            "spread": high - low, "rate_count": count, "rank": rank,
+        })
+    return ranked
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to Honest Healthcare API"}
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    return response_cache.snapshot()
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=request_metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/rates", response_model=List[RateResponse])
-def get_rates(
+async def get_rates(
     code: Optional[str] = None, 
     search: Optional[str] = None,
     hospital: Optional[str] = None, 
     setting: Optional[str] = None,
     payer: Optional[str] = None,
     plan: Optional[str] = None,
-    db: Session = Depends(database.get_db)
+    limit: Optional[int] = Query(None, ge=1, le=RATES_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    query = db.query(models.NegotiatedRate)
-    
-    if code:
-        query = query.filter(models.NegotiatedRate.billing_code == code)
-    if search:
-        query = query.filter(models.NegotiatedRate.procedure_type.ilike(f"%{search}%"))
-    if hospital:
-        query = query.filter(models.NegotiatedRate.hospital_name == hospital)
-    if setting:
-        query = query.filter(models.NegotiatedRate.setting == setting.lower())
-    if payer:
-        query = query.filter(models.NegotiatedRate.payer == payer)
-    if plan:
-        query = query.filter(models.NegotiatedRate.plan == plan)
-        
-    return query.limit(400).all() # Increased limit for better comparisons
+    """
+    Rates in id order. JSON responses are one page (`limit`, default RATES_LIMIT); when more rows match,
+    the X-Next-Cursor header holds the `cursor` for the next page. `format=ndjson|csv` streams every
+    matching row (up to `limit`, if given) for bulk export. A cursor issued before the data was
+    reloaded gets 410, since row ids change with every load; start again from the first page.
+    """
+    cursor_version, after = decode_cursor(cursor) if cursor else (None, None)
+    filters = dict(code=code, hospital=hospital, setting=setting, payer=payer, plan=plan)
+
+    index = rate_index.current()
+    version = None
+    if index is not None:
+        version = index.version
+    elif format == "json" or cursor:
+        # The version and the page come from one snapshot, so a cursor's ids always belong to its version
+        await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        version = await fetch_data_version(db)
+    if cursor_version is not None and cursor_version != version:
+        raise HTTPException(status_code=410, detail="The data was reloaded since this cursor was issued; start again from the first page")
+
+    if format != "json":
+        if index is not None:
+            batches = iterate_in_threadpool(index.iter_rates(EXPORT_BATCH_ROWS, search, after, limit, **filters))
+        else:
+            batches = stream_rates(rates_query(search, after, **filters).limit(limit))
+        return StreamingResponse(
+            encode_export(batches, format), media_type=EXPORT_MEDIA_TYPES[format],
+            # Exports are unbounded; keep them out of the response cache
+            headers={"Cache-Control": "no-store"},
+        )
+
+    limit = limit or RATES_LIMIT
+    if index is not None:
+        rows, next_after = index.get_rates(limit, search, after, **filters)
+    else:
+        # One extra row tells us whether there is a next page
+        result = await db.execute(rates_query(search, after, **filters).limit(limit + 1))
+        records = result.all()
+        next_after = records[limit - 1][0] if len(records) > limit else None
+        rows = [dict(zip(RATE_FIELDS, record[1:])) for record in records[:limit]]
+    return json_rows(rows, next_after, version)
+
+@app.get("/rates/compare", response_model=List[CompareResponse])
+async def compare_rates(
+    by: str = Query("hospital", pattern="^(hospital|payer)$"),
+    code: Optional[str] = None,
+    search: Optional[str] = None,
+    hospital: Optional[str] = None,
+    setting: Optional[str] = None,
+    payer: Optional[str] = None,
+    plan: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    Compares median_rate across hospitals or payers for the matching rates: min/max/median per group,
+    spread (max - min) and rank (1 = cheapest median). Uses the loader's rollups when the filters line
+    up with their grain, otherwise aggregates the table in one pass.
+    """
+    group_column, rollup = COMPARE_GROUPS[by]
+    filters = dict(code=code, hospital=hospital, setting=setting, payer=payer, plan=plan)
+
+    index = rate_index.current()
+    if index is not None:
+        return rank_groups(index.compare(group_column, search, **filters))
+
+    # Rollups are per (billing_code, setting, group), so they answer exactly when those are the only filters
+    finer_filters = [name for name, value in filters.items() if value and name not in ("code", "setting", by)]
+    if code and setting and not search and not finer_filters:
+        query = select(rollup.group_value, rollup.min_median_rate, rollup.max_median_rate, rollup.median_rate, rollup.rate_count).where(
+            rollup.billing_code == code, rollup.setting == setting.lower())
+        if filters[by]:
+            query = query.where(rollup.group_value == filters[by])
+    else:
+        group = getattr(models.NegotiatedRate, group_column)
+        median = models.NegotiatedRate.median_rate
+        query = select(group, func.min(median), func.max(median), func.percentile_cont(0.5).within_group(median), func.count())
+        query = filter_rates(query.where(median.isnot(None)), search, **filters).group_by(group)
+
+    results = await db.execute(query)
+    return rank_groups(results.all())
+
+@app.post("/rates/batch", response_model=List[RateBatchResult])
+async def get_rates_batch(batch: RateBatchRequest, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Rates for many filter sets in one round trip, e.g. several codes times several payers. Returns one
+    entry per set, in request order: its key, filters, the first `limit` matching rates in id order and
+    whether more match. Filters match exactly, as on /rates; `search` isn't supported here.
+    """
+    sets = batch_filter_sets(batch)
+
+    index = rate_index.current()
+    if not sets:
+        results = {}
+    elif index is not None:
+        results = {}
+        for _, filters in sets:
+            values = tuple(filters.items())
+            if values not in results:
+                rows, next_after = index.get_rates(batch.limit, **filters)
+                results[values] = (rows, next_after is not None)
+    else:
+        # Sets sharing a shape share one IN list, and the shapes are UNIONed into a single statement
+        shapes = {}
+        for _, filters in sets:
+            values = shapes.setdefault(tuple(filters), [])
+            if tuple(filters.values()) not in values:
+                values.append(tuple(filters.values()))
+        shape_names = list(shapes)
+        results = {}
+        for record in (await db.execute(batch_rates_query(shapes, batch.limit))).all():
+            row = dict(zip(RATE_FIELDS, record[2:-1]))
+            shape = shape_names[record[0]]
+            rows, _ = results.setdefault(tuple((name, row[rate_index.FILTER_COLUMNS[name]]) for name in shape), ([], False))
+            rows.append(row)
+        for values, (rows, _) in results.items():
+            results[values] = (rows[:batch.limit], len(rows) > batch.limit)
+
+    return json_rows([
+        {"key": key, "filters": filters, "rates": rows, "has_more": has_more}
+        for key, filters in sets
+        for rows, has_more in [results.get(tuple(filters.items()), ([], False))]
+    ])
+
+async def rollup_tables(db):
+    """{rollup name: (key columns, stat columns)} for every rollup table the loader has published."""
+    results = await db.execute(text(
+        "SELECT table_name, column_name, data_type = 'text' FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name LIKE :prefix "
+        "ORDER BY table_name, ordinal_position"
+    ), {"prefix": ROLLUP_TABLE_PREFIX.replace("_", "\\_") + "%"})
+    rollups = {}
+    for table_name, column_name, is_key in results.all():
+        if not table_name.endswith("_staging"):
+            keys, stats = rollups.setdefault(table_name[len(ROLLUP_TABLE_PREFIX):], ([], []))
+            (keys if is_key else stats).append(column_name)
+    return rollups
+
+@app.get("/rollups")
+async def list_rollups(db: AsyncSession = Depends(database.get_async_db)):
+    return {name: keys for name, (keys, stats) in (await rollup_tables(db)).items()}
+
+@app.get("/rollups/{name}")
+async def get_rollup(name: str, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    Pre-aggregated stats for one grouping set of the rollup cube. Query parameters named after its key
+    columns filter it; giving every key is a single unique-index lookup.
+    """
+    rollups = await rollup_tables(db)
+    if name not in rollups:
+        raise HTTPException(status_code=404, detail=f"Unknown rollup {name}; available: {', '.join(rollups)}")
+
+    keys, stats = rollups[name]
+    rollup = table(ROLLUP_TABLE_PREFIX + name, *(column(col) for col in keys + stats))
+    query = select(rollup)
+    for key in keys:
+        value = request.query_params.get(key)
+        if value:
+            query = query.where(rollup.c[key] == (value.lower() if key == "setting" else value))
+    results = await db.execute(query.order_by(*(rollup.c[key] for key in keys)).limit(RATES_MAX_LIMIT))
+    return [dict(row) for row in results.mappings().all()]
 
 @app.get("/hospitals")
-def get_hospitals(db: Session = Depends(database.get_db)):
-    results = db.query(models.NegotiatedRate.hospital_name).distinct().order_by(models.NegotiatedRate.hospital_name).all()
-    return [r[0] for r in results]
+async def get_hospitals(db: AsyncSession = Depends(database.get_async_db)):
+    index = rate_index.current()
+    if index is not None:
+        return index.get_hospitals()
+    # The loader's facet views hold each distinct value once; no DISTINCT over the rates table
+    results = await db.execute(select(models.HospitalFacet.hospital_name).order_by(models.HospitalFacet.hospital_name))
+    return results.scalars().all()
 
 @app.get("/payers")
-def get_payers(db: Session = Depends(database.get_db)):
-    results = db.query(models.NegotiatedRate.payer).distinct().order_by(models.NegotiatedRate.payer).all()
-    return [r[0] for r in results]
+async def get_payers(db: AsyncSession = Depends(database.get_async_db)):
+    index = rate_index.current()
+    if index is not None:
+        return index.get_payers()
+    results = await db.execute(select(models.PayerFacet.payer).order_by(models.PayerFacet.payer))
+    return results.scalars().all()
 
 @app.get("/plans")
-def get_plans(payer: Optional[str] = None, db: Session = Depends(database.get_db)):
-    query = db.query(models.NegotiatedRate.plan).distinct()
+async def get_plans(payer: Optional[str] = None, db: AsyncSession = Depends(database.get_async_db)):
+    index = rate_index.current()
+    if index is not None:
+        return index.get_plans(payer)
+    query = select(models.PlanFacet.plan).distinct()
     if payer:
-        query = query.filter(models.NegotiatedRate.payer == payer)
-    results = query.order_by(models.NegotiatedRate.plan).all()
-    return [r[0] for r in results]
+        query = query.where(models.PlanFacet.payer == payer)
+    results = await db.execute(query.order_by(models.PlanFacet.plan))
+    return results.scalars().all()
 
 @app.get("/procedures")
-def get_procedures(
+async def get_procedures(
     search: Optional[str] = None,
     hospital: Optional[str] = None,
     setting: Optional[str] = None,
     payer: Optional[str] = None,
     plan: Optional[str] = None,
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    query = db.query(models.NegotiatedRate.procedure_type).distinct()
+    index = rate_index.current()
+    if index is not None:
+        return index.get_procedures(PROCEDURES_LIMIT, search, hospital=hospital, setting=setting, payer=payer, plan=plan)
+
+    # One row per (procedure, hospital, setting, payer, plan) rather than per rate
+    facet = models.ProcedureFacet
+    query = select(facet.procedure_type).distinct()
     
     if search:
-        query = query.filter(models.NegotiatedRate.procedure_type.ilike(f"%{search}%"))
+        query = query.where(facet.procedure_type.ilike(f"%{search}%"))
     if hospital:
-        query = query.filter(models.NegotiatedRate.hospital_name == hospital)
+        query = query.where(facet.hospital_name == hospital)
     if setting:
-        query = query.filter(models.NegotiatedRate.setting == setting.lower())
+        query = query.where(facet.setting == setting.lower())
     if payer:
-        query = query.filter(models.NegotiatedRate.payer == payer)
+        query = query.where(facet.payer == payer)
     if plan:
-        query = query.filter(models.NegotiatedRate.plan == plan)
+        query = query.where(facet.plan == plan)
         
-    results = query.order_by(models.NegotiatedRate.procedure_type).limit(10).all()
-    return [r[0] for r in results]
+    results = await db.execute(query.order_by(facet.procedure_type).limit(PROCEDURES_LIMIT))
+    return results.scalars().all()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime
 from .database import Base
 
 class NegotiatedRate(Base):
@@ -17,3 +17,56 @@ class NegotiatedRate(Base):
     max_rate = Column(Float)
     median_rate = Column(Float)
     record_count = Column(Integer)
+
+class DataVersion(Base):
+    __tablename__ = "etl_data_version"
+
+    # Bumped by the DB loader in the same transaction that swaps in new data
+    version = Column(BigInteger, primary_key=True)
+    table_name = Column(String)
+    row_count = Column(BigInteger)
+    loaded_at = Column(DateTime(timezone=True))
+
+class RateCompareRollup:
+    """Columns of the loader's rate_compare_* materialized views: median_rate stats per (billing_code, setting, group)."""
+    billing_code = Column(String, primary_key=True)
+    setting = Column(String, primary_key=True)
+    group_value = Column(String, primary_key=True)
+    min_median_rate = Column(Float)
+    max_median_rate = Column(Float)
+    median_rate = Column(Float)
+    rate_count = Column(BigInteger)
+
+class RateCompareByHospital(RateCompareRollup, Base):
+    __tablename__ = "rate_compare_by_hospital"
+
+class RateCompareByPayer(RateCompareRollup, Base):
+    __tablename__ = "rate_compare_by_payer"
+
+# The loader's facet_* materialized views: distinct keys of emory_negotiated_rates, for the lookup endpoints
+class ProcedureFacet(Base):
+    __tablename__ = "facet_procedures"
+    procedure_type = Column(String, primary_key=True)
+    hospital_name = Column(String, primary_key=True)
+    setting = Column(String, primary_key=True)
+    payer = Column(String, primary_key=True)
+    plan = Column(String, primary_key=True)
+    min_rate = Column(Float)
+    max_rate = Column(Float)
+    record_count = Column(BigInteger)
+
+class HospitalFacet(Base):
+    __tablename__ = "facet_hospitals"
+    hospital_name = Column(String, primary_key=True)
+    rate_count = Column(BigInteger)
+
+class PayerFacet(Base):
+    __tablename__ = "facet_payers"
+    payer = Column(String, primary_key=True)
+    rate_count = Column(BigInteger)
+
+class PlanFacet(Base):
+    __tablename__ = "facet_plans"
+    payer = Column(String, primary_key=True)
+    plan = Column(String, primary_key=True)
+    rate_count = Column(BigInteger)
@@ -0,0 +1,154 @@
+import bisect
+import numpy as np
+
+# Ranking tiers, best first: the name starts with the query, a word in it does, or it's just a substring
+PREFIX, WORD_PREFIX, SUBSTRING = 0, 1, 2
+
+# Longest gram indexed; longer queries intersect their grams' postings and verify the survivors
+GRAM = 3
+
+# Candidates filtered per step when walking a posting list in rank order
+CHUNK = 1024
+
+
+def _build_postings(symbols, ranks, positions, base):
+    """
+    Posting lists for every 1..GRAM character gram starting at `positions`.
+    Returns (sorted gram keys, start offsets, concatenated postings); each posting is sorted, unique ranks.
+    """
+    keys, owners = [], []
+    value = np.zeros(len(positions), dtype=np.int64)
+    valid = np.ones(len(positions), dtype=bool)
+    for length in range(1, GRAM + 1):
+        symbol = symbols[positions + length - 1]
+        # Grams stop at the separator between names
+        valid &= symbol != 0
+        value = value * base + symbol
+        keys.append(length * base ** GRAM + value[valid])
+        owners.append(ranks[positions[valid]])
+    keys = np.concatenate(keys)
+    owners = np.concatenate(owners)
+
+    order = np.lexsort((owners, keys))
+    keys, owners = keys[order], owners[order]
+    distinct = np.ones(len(keys), dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (owners[1:] != owners[:-1])
+    keys, owners = keys[distinct], owners[distinct]
+
+    gram_keys, starts = np.unique(keys, return_index=True)
+    return gram_keys, np.append(starts, len(keys)), owners
+
+
+def _has_word_prefix(folded, query):
+    i = folded.find(query)
+    while i > 0 and folded[i - 1].isalnum():
+        i = folded.find(query, i + 1)
+    return i >= 0
+
+
+class ProcedureSearch:
+    """
+    Ranked, case-insensitive substring search over the distinct procedure names, for autocomplete.
+
+    Names are lower-cased and sorted; a name's position in that order is its rank. PREFIX matches are a
+    contiguous run of ranks found by binary search. WORD_PREFIX and SUBSTRING matches come from n-gram
+    posting lists, which are walked in rank order and stop as soon as `limit` names are found.
+    """
+
+    def __init__(self, names):
+        # names: the procedure_type dictionary (position = dictionary code); NULL is not searchable
+        entries = sorted((name.lower(), name, code) for code, name in enumerate(names) if name is not None)
+        self.folded = [folded for folded, _, _ in entries]
+        self.names = [name for _, name, _ in entries]
+        self.rank_of = np.full(len(names), -1, dtype=np.int32)
+        self.rank_of[[code for _, _, code in entries]] = np.arange(len(entries), dtype=np.int32)
+
+        # Every name, NUL-terminated, as one array of alphabet symbols; NUL sorts first so it is symbol 0
+        text = "".join(folded + "\0" for folded in self.folded)
+        chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        self.alphabet, symbols = np.unique(chars, return_inverse=True)
+        symbols = np.concatenate((symbols.astype(np.int64), np.zeros(GRAM, dtype=np.int64)))
+        lengths = np.fromiter((len(folded) + 1 for folded in self.folded), dtype=np.int64, count=len(self.folded))
+        ranks = np.repeat(np.arange(len(self.folded), dtype=np.int32), lengths)
+
+        alnum = np.array([chr(c).isalnum() for c in self.alphabet.tolist()], dtype=bool)
+        starts = np.flatnonzero(symbols[:len(chars)] != 0)
+        word_starts = starts[~alnum[symbols[starts - 1]]] if len(starts) else starts
+        self.base = len(self.alphabet)
+        self.substrings = _build_postings(symbols, ranks, starts, self.base)
+        self.word_prefixes = _build_postings(symbols, ranks, word_starts, self.base)
+
+    def mask(self, codes):
+        """Boolean mask over ranks for the given procedure_type dictionary codes."""
+        ranks = self.rank_of[codes]
+        mask = np.zeros(len(self.names), dtype=bool)
+        mask[ranks[ranks >= 0]] = True
+        return mask
+
+    def _posting(self, postings, gram):
+        gram_keys, starts, owners = postings
+        chars = np.frombuffer(gram.encode("utf-32-le"), dtype=np.uint32)
+        symbols = np.searchsorted(self.alphabet, chars)
+        if (symbols >= self.base).any() or (self.alphabet[np.minimum(symbols, self.base - 1)] != chars).any():
+            return owners[:0]
+        key = len(gram) * self.base ** GRAM
+        for i, symbol in enumerate(symbols.tolist()):
+            key += symbol * self.base ** (len(gram) - 1 - i)
+        i = np.searchsorted(gram_keys, key)
+        if i == len(gram_keys) or gram_keys[i] != key:
+            return owners[:0]
+        return owners[starts[i]:starts[i + 1]]
+
+    def _candidates(self, query):
+        """(candidate ranks in order, verifier or None when every candidate matches) for WORD_PREFIX then SUBSTRING."""
+        if len(query) <= GRAM:
+            yield self._posting(self.word_prefixes, query), None
+            yield self._posting(self.substrings, query), None
+            return
+
+        # Names containing every gram of the query, rarest gram first; stop once few enough to just verify
+        postings = sorted((self._posting(self.substrings, query[i:i + GRAM]) for i in range(len(query) - GRAM + 1)), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if len(candidates) <= CHUNK:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+
+        word_candidates = np.intersect1d(candidates, self._posting(self.word_prefixes, query[:GRAM]), assume_unique=True)
+        yield word_candidates, lambda folded: _has_word_prefix(folded, query)
+        yield candidates, lambda folded: query in folded
+
+    def search(self, query, limit, allowed=None):
+        """
+        Top `limit` names containing `query` (no wildcards). `allowed` is an optional mask from mask();
+        names outside it are skipped.
+        """
+        query = query.lower()
+        width = len(query)
+
+        # PREFIX matches are a contiguous run of ranks
+        start = bisect.bisect_left(self.folded, query)
+        end = bisect.bisect_right(self.folded, query, lo=start, key=lambda folded: folded[:width])
+        prefix = np.arange(start, end, dtype=np.int32)
+        if allowed is not None:
+            prefix = prefix[allowed[start:end]]
+        results = prefix[:limit].tolist()
+        if len(results) >= limit:
+            return [self.names[rank] for rank in results]
+
+        seen = np.zeros(len(self.names), dtype=bool)
+        seen[prefix] = True
+        for candidates, verify in self._candidates(query):
+            for offset in range(0, len(candidates), CHUNK):
+                chunk = candidates[offset:offset + CHUNK]
+                keep = ~seen[chunk]
+                if allowed is not None:
+                    keep &= allowed[chunk]
+                for rank in chunk[keep].tolist():
+                    if verify is not None and not verify(self.folded[rank]):
+                        continue
+                    results.append(rank)
+                    seen[rank] = True
+                    if len(results) >= limit:
+                        return [self.names[rank] for rank in results]
+        return [self.names[rank] for rank in results]
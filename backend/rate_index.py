@@ -0,0 +1,277 @@
+import os
+import re
+import threading
+import numpy as np
+from sqlalchemy import func, text
+from . import models, database
+from .procedure_search import ProcedureSearch
+
+# "memory" serves the lookup endpoints from an in-process copy of the Gold table
+ENABLED = os.getenv("RATES_ENGINE", "sql") == "memory"
+
+# How often to check etl_data_version for a newer load
+POLL_SECONDS = float(os.getenv("RATE_INDEX_POLL_SECONDS", "30"))
+
+TEXT_COLUMNS = ["hospital_name", "billing_code", "billing_code_type", "procedure_type", "setting", "payer", "plan"]
+RATE_COLUMNS = ["min_rate", "max_rate", "median_rate"]
+
+# Columns /rates and /procedures can filter on by equality
+FILTER_COLUMNS = {"code": "billing_code", "hospital": "hospital_name", "setting": "setting", "payer": "payer", "plan": "plan"}
+
+# Facet combinations whose allowed-procedure mask is kept for autocomplete
+PROCEDURE_MASK_CACHE_SIZE = 256
+
+
+def _null_last(value):
+    # Postgres puts NULLs after every value; code point order otherwise, which only matches a C collation
+    return (value is None, value or "")
+
+
+def ilike_regex(search):
+    """Compiles ILIKE '%search%' semantics (% and _ wildcards, case-insensitive) to a regex."""
+    pattern = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in search)
+    return re.compile(pattern, re.IGNORECASE | re.DOTALL)
+
+
+class RateIndex:
+    """
+    Immutable, columnar copy of emory_negotiated_rates.
+    Text columns are dictionary-encoded (dictionary kept in the database's ORDER BY order, collation
+    included, so code order is ORDER BY order), and each filterable column has a posting list of row ids per value.
+    """
+
+    def __init__(self, rows, version, dictionaries=None):
+        # rows: (id, *TEXT_COLUMNS, *RATE_COLUMNS, record_count) tuples in id order
+        # dictionaries: {column: distinct values in ORDER BY order}, as load_index reads them; sorted here if not given
+        self.version = version
+        self.size = len(rows)
+        ids, *columns = list(zip(*rows)) if rows else [()] * (len(TEXT_COLUMNS) + len(RATE_COLUMNS) + 2)
+        self.ids = np.array(ids, dtype=np.int64)
+
+        self.dictionaries = {}
+        self.lookups = {}
+        self.codes = {}
+        self.postings = {}
+        for name, values in zip(TEXT_COLUMNS, columns):
+            dictionary = dictionaries[name] if dictionaries else sorted(set(values), key=_null_last)
+            lookup = {value: code for code, value in enumerate(dictionary)}
+            codes = np.fromiter((lookup[v] for v in values), dtype=np.int32, count=self.size)
+
+            # Posting list per value: row ids in ascending (id) order
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+            bounds = np.searchsorted(codes[order], np.arange(len(dictionary) + 1))
+            self.dictionaries[name] = dictionary
+            self.lookups[name] = lookup
+            self.codes[name] = codes
+            self.postings[name] = [order[bounds[i]:bounds[i + 1]] for i in range(len(dictionary))]
+
+        offset = len(TEXT_COLUMNS)
+        self.rates = {
+            name: np.array([np.nan if v is None else v for v in columns[offset + i]], dtype=np.float64)
+            for i, name in enumerate(RATE_COLUMNS)
+        }
+        self.record_count = np.array([0 if v is None else v for v in columns[-1]], dtype=np.int64)
+
+        # Plans per payer, in dictionary order; payer-major pair codes sort payer by payer, plan by plan
+        plans = self.dictionaries["plan"]
+        pairs = np.unique(self.codes["payer"].astype(np.int64) * len(plans) + self.codes["plan"])
+        self._plans_by_payer = {}
+        for pair in pairs.tolist():
+            self._plans_by_payer.setdefault(self.dictionaries["payer"][pair // len(plans)], []).append(plans[pair % len(plans)])
+        self.procedure_search = ProcedureSearch(self.dictionaries["procedure_type"])
+        self._procedure_masks = {}
+
+    def match(self, search=None, **filters):
+        """Row ids matching every given filter, ascending. Filters use FILTER_COLUMNS names."""
+        candidates = []
+        for param, value in filters.items():
+            if value is None or value == "":
+                continue
+            column = FILTER_COLUMNS[param]
+            code = self.lookups[column].get(value.lower() if param == "setting" else value)
+            if code is None:
+                return np.empty(0, dtype=np.int32)
+            candidates.append(self.postings[column][code])
+
+        if search:
+            regex = ilike_regex(search)
+            dictionary = self.dictionaries["procedure_type"]
+            mask = np.fromiter((v is not None and regex.search(v) is not None for v in dictionary), dtype=bool, count=len(dictionary))
+            candidates.append(np.flatnonzero(mask[self.codes["procedure_type"]]).astype(np.int32))
+
+        if not candidates:
+            return np.arange(self.size, dtype=np.int32)
+
+        candidates.sort(key=len)
+        rows = candidates[0]
+        for other in candidates[1:]:
+            if not len(rows):
+                break
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+    def rows(self, row_ids):
+        """Materializes row ids as RateResponse-shaped dicts."""
+        out = []
+        text = [(name, self.dictionaries[name], self.codes[name]) for name in TEXT_COLUMNS]
+        for i in row_ids.tolist():
+            row = {name: dictionary[codes[i]] for name, dictionary, codes in text}
+            for name in RATE_COLUMNS:
+                value = self.rates[name][i]
+                row[name] = None if np.isnan(value) else float(value)
+            row["record_count"] = int(self.record_count[i])
+            out.append(row)
+        return out
+
+    def after(self, row_ids, after):
+        """The tail of ascending `row_ids` whose table id is greater than `after` (keyset pagination)."""
+        if after is None:
+            return row_ids
+        return row_ids[np.searchsorted(self.ids[row_ids], after, side="right"):]
+
+    def get_rates(self, limit, search=None, after=None, **filters):
+        """One page of rates in id order. Returns (rows, id to continue after, or None on the last page)."""
+        row_ids = self.after(self.match(search, **filters), after)
+        page = row_ids[:limit]
+        return self.rows(page), int(self.ids[page[-1]]) if len(row_ids) > limit else None
+
+    def iter_rates(self, batch_rows, search=None, after=None, limit=None, **filters):
+        """Every matching rate in id order, materialized `batch_rows` at a time."""
+        row_ids = self.after(self.match(search, **filters), after)[:limit]
+        for start in range(0, len(row_ids), batch_rows):
+            yield self.rows(row_ids[start:start + batch_rows])
+
+    def compare(self, group_column, search=None, **filters):
+        """
+        median_rate statistics per value of `group_column` over matching rows (NULL medians skipped).
+        Returns (group, min, max, median, count) tuples; the median interpolates like percentile_cont(0.5).
+        """
+        rows = self.match(search, **filters)
+        medians = self.rates["median_rate"][rows]
+        present = ~np.isnan(medians)
+        groups = self.codes[group_column][rows[present]]
+        medians = medians[present]
+
+        order = np.lexsort((medians, groups))
+        groups, medians = groups[order], medians[order]
+        bounds = np.flatnonzero(np.diff(groups)) + 1
+        starts = np.concatenate(([0], bounds)).astype(np.int64)
+        ends = np.concatenate((bounds, [len(groups)])).astype(np.int64)
+        dictionary = self.dictionaries[group_column]
+        return [
+            (dictionary[groups[start]], float(medians[start]), float(medians[end - 1]),
+             float(np.median(medians[start:end])), int(end - start))
+            for start, end in zip(starts.tolist(), ends.tolist()) if end > start
+        ]
+
+    def get_hospitals(self):
+        return self.dictionaries["hospital_name"]
+
+    def get_payers(self):
+        return self.dictionaries["payer"]
+
+    def get_plans(self, payer=None):
+        if not payer:
+            return self.dictionaries["plan"]
+        return self._plans_by_payer.get(payer, [])
+
+    def procedure_mask(self, **filters):
+        """ProcedureSearch mask of procedures with at least one row matching the facet filters, or None for no filters."""
+        key = tuple((param, value) for param, value in sorted(filters.items()) if value)
+        if not key:
+            return None
+        mask = self._procedure_masks.get(key)
+        if mask is None:
+            # Facets rarely change between keystrokes, so this is computed once per combination
+            if len(self._procedure_masks) >= PROCEDURE_MASK_CACHE_SIZE:
+                self._procedure_masks.pop(next(iter(self._procedure_masks)))
+            codes = np.unique(self.codes["procedure_type"][self.match(**filters)])
+            mask = self._procedure_masks[key] = self.procedure_search.mask(codes)
+        return mask
+
+    def get_procedures(self, limit, search=None, **filters):
+        if search and "%" not in search and "_" not in search:
+            # Autocomplete: ranked completions from the suffix array
+            return self.procedure_search.search(search, limit, self.procedure_mask(**filters))
+        rows = self.match(search, **filters)
+        procedure_codes = np.unique(self.codes["procedure_type"][rows])[:limit]
+        return [self.dictionaries["procedure_type"][c] for c in procedure_codes]
+
+
+_index = None
+_stop = threading.Event()
+
+
+def current():
+    """The live index, or None when the memory engine is off or hasn't loaded yet."""
+    return _index
+
+
+def fetch_version(db):
+    try:
+        return db.query(func.max(models.DataVersion.version)).scalar() or 0
+    except Exception:
+        # Loaded by an older loader that doesn't publish versions yet
+        db.rollback()
+        return 0
+
+
+def load_index():
+    """Reads the table and its version from one snapshot so they always agree."""
+    db = database.SessionLocal()
+    try:
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        version = fetch_version(db)
+        # A full-table read; DB_STATEMENT_TIMEOUT_MS is sized for API requests, not this
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+        columns = [getattr(models.NegotiatedRate, name) for name in ["id"] + TEXT_COLUMNS + RATE_COLUMNS + ["record_count"]]
+        rows = db.query(*columns).order_by(models.NegotiatedRate.id).all()
+        # Sorted by Postgres, so the index lists values in the same (collation) order as the SQL engine
+        dictionaries = {
+            name: [value for value, in db.query(column).distinct().order_by(column)]
+            for name, column in zip(TEXT_COLUMNS, columns[1:])
+        }
+        return RateIndex(rows, version, dictionaries)
+    finally:
+        db.close()
+
+
+def refresh():
+    """Swaps in a freshly built index if the loader has published a newer version. Returns True on reload."""
+    global _index
+    db = database.SessionLocal()
+    try:
+        version = fetch_version(db)
+    finally:
+        db.close()
+    if _index is not None and version == _index.version:
+        return False
+    index = load_index()
+    _index = index
+    print(f">>> [RateIndex] Loaded {index.size} rates (data version {index.version})")
+    return True
+
+
+def _poll():
+    while not _stop.wait(POLL_SECONDS):
+        try:
+            refresh()
+        except Exception as e:
+            print(f"!!! [RateIndex] Reload failed, still serving version {_index.version if _index else None}: {e}")
+
+
+def start():
+    """Loads the index and starts watching for new versions. No-op unless RATES_ENGINE=memory."""
+    if not ENABLED:
+        return
+    _stop.clear()
+    try:
+        refresh()
+    except Exception as e:
+        # Keep serving from Postgres until the poller manages to load
+        print(f"!!! [RateIndex] Initial load failed, falling back to SQL: {e}")
+    threading.Thread(target=_poll, name="rate-index-reload", daemon=True).start()
+
+
+def stop():
+    _stop.set()
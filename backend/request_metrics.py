@@ -0,0 +1,240 @@
+import os
+import time
+import queue
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from sqlalchemy import event
+from starlette.routing import Match
+from . import database
+
+# Set REQUEST_METRICS=0 to turn off timing, /metrics and Server-Timing
+ENABLED = os.getenv("REQUEST_METRICS", "1") == "1"
+
+# Statements slower than this are logged with their EXPLAIN plan; 0 turns that off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+# A statement that keeps being slow is explained at most once per this many seconds
+EXPLAIN_COOLDOWN_SECONDS = float(os.getenv("SLOW_QUERY_EXPLAIN_COOLDOWN", "300"))
+
+# Distinct statements remembered for the cooldown (IN lists make one statement per list length)
+EXPLAINED_MAX_STATEMENTS = 1024
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": "Request latency, from the first middleware to the response headers",
+    "http_request_db_seconds": "Time spent executing SQL per request",
+    "http_request_serialize_seconds": "Time spent encoding response bodies per request",
+}
+COUNTERS = {
+    "http_request_db_queries_total": "SQL statements executed",
+    "http_request_db_rows_total": "Rows returned by SQL statements",
+    "db_slow_queries_total": "SQL statements slower than SLOW_QUERY_MS",
+}
+
+# Per-request accumulators; the SQLAlchemy hooks and phase() add to whichever request is current
+_current = ContextVar("request_metrics", default=None)
+
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+_slow_queries = queue.Queue(maxsize=100)
+_explained = {}
+_stop = threading.Event()
+
+
+def observe(name, labels, value):
+    with _lock:
+        histogram = _histograms.get((name, labels))
+        if histogram is None:
+            histogram = _histograms[(name, labels)] = [[0] * len(BUCKETS), 0.0, 0]
+        counts = histogram[0]
+        position = bisect.bisect_left(BUCKETS, value)
+        if position < len(BUCKETS):
+            counts[position] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def increment(name, labels, value=1):
+    with _lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + value
+
+
+@contextmanager
+def phase(name):
+    """Times a block as part of the current request's `name` phase (e.g. "serialize")."""
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats[name] = stats.get(name, 0.0) + time.perf_counter() - start
+
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}" if labels else ""
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        histograms = {key: (list(counts), total, count) for key, (counts, total, count) in _histograms.items()}
+        counters = dict(_counters)
+    for name, description in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    for name, description in COUNTERS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_format_labels(labels)} {value}" for (metric, labels), value in sorted(counters.items()) if metric == name]
+    return "\n".join(lines) + "\n"
+
+
+def endpoint_label(request):
+    """The matched route's path template (/rollups/{name}), so labels stay bounded whatever the URL."""
+    for route in request.app.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+def server_timing(stats, total):
+    """Server-Timing header value: db (with the statement count), serialize, the rest of the app, and the total."""
+    db, serialize = stats.get("db", 0.0), stats.get("serialize", 0.0)
+    return ", ".join([
+        f'db;dur={db * 1000:.1f};desc="{stats["queries"]} queries, {stats["rows"]} rows"',
+        f"serialize;dur={serialize * 1000:.1f}",
+        f"app;dur={max(total - db - serialize, 0) * 1000:.1f}",
+        f"total;dur={total * 1000:.1f}",
+    ])
+
+
+async def middleware(request: Request, call_next):
+    """Times each request into the histograms and adds a Server-Timing header (cache hits included)."""
+    if not ENABLED:
+        return await call_next(request)
+
+    stats = {"queries": 0, "rows": 0}
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    total = time.perf_counter() - start
+
+    labels = (("endpoint", endpoint_label(request)), ("method", request.method))
+    observe("http_request_duration_seconds", labels + (("status", str(response.status_code)),), total)
+    observe("http_request_db_seconds", labels, stats.get("db", 0.0))
+    observe("http_request_serialize_seconds", labels, stats.get("serialize", 0.0))
+    increment("http_request_db_queries_total", labels, stats["queries"])
+    increment("http_request_db_rows_total", labels, stats["rows"])
+    response.headers["Server-Timing"] = server_timing(stats, total)
+    return response
+
+
+# SQLAlchemy hooks, on both engines (the async engine's events fire on its sync core)
+
+# The start time lives on the execution context: a statement that fails (e.g. cancelled by
+# statement_timeout) never reaches after_cursor_execute, so nothing per-connection may be left behind
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats = _current.get()
+    if stats is not None:
+        stats["db"] = stats.get("db", 0.0) + elapsed
+        stats["queries"] += 1
+        # -1 for server-side cursors, whose rows arrive after this
+        stats["rows"] += max(cursor.rowcount, 0)
+    if SLOW_QUERY_MS and elapsed * 1000 > SLOW_QUERY_MS:
+        increment("db_slow_queries_total", ())
+        try:
+            _slow_queries.put_nowait((statement, parameters, conn.dialect.paramstyle, elapsed))
+        except queue.Full:
+            pass
+
+
+def explain(statement, parameters, paramstyle):
+    """EXPLAIN plan of a statement as the API ran it, on a connection of its own."""
+    conn = database.engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            if paramstyle in ("numeric_dollar", "numeric"):
+                # asyncpg statements use $1 placeholders, which psycopg2 can't bind; let Postgres do it
+                cursor.execute(f"PREPARE slow_query AS {statement}")
+                placeholders = ", ".join(["%s"] * len(parameters))
+                cursor.execute(f"EXPLAIN EXECUTE slow_query({placeholders})" if parameters else "EXPLAIN EXECUTE slow_query", tuple(parameters))
+            else:
+                cursor.execute(f"EXPLAIN {statement}", parameters)
+            return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        # Prepared statements outlive the transaction, and the connection goes back to the pool
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("DEALLOCATE ALL")
+        conn.close()
+
+
+def _explain_slow_queries():
+    while not _stop.is_set():
+        try:
+            statement, parameters, paramstyle, elapsed = _slow_queries.get(timeout=1)
+        except queue.Empty:
+            continue
+        message = f"!!! [SlowQuery] {elapsed * 1000:.0f} ms: {statement} {parameters}"
+        now = time.monotonic()
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")) and now - _explained.get(statement, -EXPLAIN_COOLDOWN_SECONDS) >= EXPLAIN_COOLDOWN_SECONDS:
+            # Oldest first: drop entries past their cooldown, then the oldest beyond the cap
+            for explained, at in list(_explained.items()):
+                if now - at < EXPLAIN_COOLDOWN_SECONDS and len(_explained) < EXPLAINED_MAX_STATEMENTS:
+                    break
+                del _explained[explained]
+            _explained.pop(statement, None)
+            _explained[statement] = now
+            try:
+                message += f"\n{explain(statement, parameters, paramstyle)}"
+            except Exception as e:
+                message += f"\nEXPLAIN failed: {e}"
+        print(message)
+
+
+def start():
+    """Hooks the engines and starts the slow-query explainer. No-op when REQUEST_METRICS=0."""
+    if not ENABLED:
+        return
+    for engine in (database.engine, database.async_engine.sync_engine):
+        if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if SLOW_QUERY_MS:
+        _stop.clear()
+        threading.Thread(target=_explain_slow_queries, name="slow-query-explain", daemon=True).start()
+
+
+def stop():
+    _stop.set()
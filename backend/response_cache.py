@@ -0,0 +1,164 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from fastapi import Request
+from fastapi.responses import Response
+from . import database, rate_index
+
+# Set RESPONSE_CACHE=0 to serve every request from the engine
+ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+
+# Bounded LRU: entries kept, and seconds an entry may be served before it is recomputed
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# Total body bytes kept (least recently used evicted first), and the largest body worth keeping at all
+MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 2**20)))
+MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", str(4 * 2**20)))
+
+# How often to check etl_data_version for a newer load
+POLL_SECONDS = float(os.getenv("RESPONSE_CACHE_POLL_SECONDS", "5"))
+
+# Clients may reuse a response this long before revalidating with If-None-Match
+CACHE_CONTROL = f"public, max-age={int(os.getenv('RESPONSE_CACHE_MAX_AGE', '0'))}, must-revalidate"
+
+# GET endpoints whose response depends only on the query string and the loaded data
+CACHED_PATHS = {"/rates", "/rates/compare", "/rollups", "/hospitals", "/payers", "/plans", "/procedures"}
+CACHED_PREFIXES = ("/rollups/",)
+
+# Endpoint response headers replayed on cache hits
+KEPT_HEADERS = ("x-next-cursor",)
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_bytes = 0
+_version = 0
+_stop = threading.Event()
+stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "not_modified": 0, "oversized": 0}
+
+
+def data_version():
+    """Version of the data being served: the in-memory index's when it's live, else the last polled one."""
+    index = rate_index.current()
+    return index.version if index is not None else _version
+
+
+def cache_key(request):
+    """Path plus query parameters, sorted, with empty values dropped (the endpoints ignore them too)."""
+    params = sorted((name, value) for name, value in request.query_params.multi_items() if value != "")
+    return request.url.path + "?" + "&".join(f"{name}={value}" for name, value in params)
+
+
+def etag_for(version, key):
+    # Responses are a pure function of (data version, key), so the tag needs no body hash
+    return '"' + hashlib.sha1(f"{version}:{key}".encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def lookup(key, version):
+    global _bytes
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] != version:
+            stats["misses"] += 1
+            return None
+        if time.monotonic() - entry[1] > TTL_SECONDS:
+            _bytes -= len(_entries.pop(key)[2])
+            stats["expirations"] += 1
+            stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        stats["hits"] += 1
+        return entry
+
+
+def store(key, version, body, media_type, kept_headers):
+    global _bytes
+    with _lock:
+        if len(body) > MAX_ENTRY_BYTES:
+            stats["oversized"] += 1
+            return
+        previous = _entries.pop(key, None)
+        if previous is not None:
+            _bytes -= len(previous[2])
+        _entries[key] = (version, time.monotonic(), body, media_type, kept_headers)
+        _bytes += len(body)
+        while len(_entries) > MAX_ENTRIES or _bytes > MAX_BYTES:
+            _bytes -= len(_entries.popitem(last=False)[1][2])
+            stats["evictions"] += 1
+
+
+def invalidate(version):
+    """Drops every entry when a new data version appears."""
+    global _version, _bytes
+    with _lock:
+        if version == _version:
+            return
+        _version = version
+        if _entries:
+            _entries.clear()
+            _bytes = 0
+            stats["invalidations"] += 1
+
+
+def snapshot():
+    with _lock:
+        return dict(stats, entries=len(_entries), max_entries=MAX_ENTRIES, bytes=_bytes, max_bytes=MAX_BYTES, data_version=data_version())
+
+
+async def middleware(request: Request, call_next):
+    """Serves CACHED_PATHS from the cache, with ETag/Cache-Control so clients can revalidate with a 304."""
+    path = request.url.path
+    if not ENABLED or request.method != "GET" or not (path in CACHED_PATHS or path.startswith(CACHED_PREFIXES)):
+        return await call_next(request)
+
+    version = data_version()
+    key = cache_key(request)
+    etag = etag_for(version, key) if version else None
+    headers = {"Cache-Control": CACHE_CONTROL}
+    if etag:
+        headers["ETag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            with _lock:
+                stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+
+    entry = lookup(key, version)
+    if entry is not None:
+        return Response(content=entry[2], media_type=entry[3], headers={**entry[4], **headers})
+
+    response = await call_next(request)
+    # Streamed exports opt out with no-store; buffering them here would defeat the streaming
+    if response.status_code != 200 or "no-store" in response.headers.get("cache-control", ""):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    media_type = response.headers.get("content-type")
+    kept_headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+    store(key, version, body, media_type, kept_headers)
+    return Response(content=body, media_type=media_type, headers={**kept_headers, **headers})
+
+
+def _poll():
+    while True:
+        db = database.SessionLocal()
+        try:
+            invalidate(rate_index.fetch_version(db))
+        except Exception as e:
+            print(f"!!! [ResponseCache] Version check failed: {e}")
+        finally:
+            db.close()
+        if _stop.wait(POLL_SECONDS):
+            return
+
+
+def start():
+    """Starts watching etl_data_version. No-op when RESPONSE_CACHE=0."""
+    if not ENABLED:
+        return
+    _stop.clear()
+    threading.Thread(target=_poll, name="response-cache-version", daemon=True).start()
+
+
+def stop():
+    _stop.set()
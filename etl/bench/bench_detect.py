@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.synthetic_mrf import write_mrf
+from silver.readers import ENCODINGS, HEADER_KEYWORDS, READERS, SNIFF_BYTES, read_prefix, sniff_reader
+from silver.silver_emory import process_hospital
+
+# Only codes whose descriptions are plain ASCII, so single stray bytes decide the encoding
+ASCII_MIX = {"MS-DRG": 0.5, "HCPCS": 0.5}
+
+FOOTER = b"Prices are estimates \x96 see the hospital's website,,,\n"
+
+
+def detect_by_readlines(filepath):
+    """The original detection: decode the whole file per encoding until one works, then scan 50 lines."""
+    for encoding in ENCODINGS:
+        try:
+            with open(filepath, 'r', encoding=encoding) as f:
+                lines = f.readlines()
+            break
+        except UnicodeDecodeError:
+            continue
+    for i, line in enumerate(lines[:50]):
+        lower_line = line.lower()
+        if lower_line.startswith("hospital_name") or lower_line.startswith("license_number"):
+            continue
+        if sum(1 for k in HEADER_KEYWORDS if k in lower_line) >= 2:
+            return encoding, i
+    return encoding, 0
+
+
+def ascii_mrf(path, n_rows):
+    write_mrf(path, n_rows, code_mix=ASCII_MIX)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def silver_rows(path, work_dir):
+    """Silver output for a file, read back as a DataFrame."""
+    part_path = os.path.join(work_dir, "part.parquet")
+    process_hospital(path, "Synthetic Hospital", part_path)
+    return pd.read_parquet(part_path)
+
+
+def check_encodings(work_dir):
+    """Files bigger than prefix + suffix, with the only non-ASCII bytes in different places."""
+    base = ascii_mrf(os.path.join(work_dir, "base.csv"), 60_000)
+    assert len(base) > 2 * SNIFF_BYTES
+    lines = base.split(b"\n")
+    middle = len(lines) // 2
+    expected = silver_rows(os.path.join(work_dir, "base.csv"), work_dir)
+
+    cases = {
+        # name: (bytes, sniffed encoding)
+        "ascii": (base, "utf-8"),
+        "utf-8 BOM": (b"\xef\xbb\xbf" + base, "utf-8"),
+        "cp1252 byte in the footer": (base + FOOTER, "cp1252"),
+        # Not valid cp1252 either (0x81), and 0x85 in the preamble is a line break to str.splitlines in latin1
+        "latin1 byte in the footer": (lines[0] + b"\n" + lines[1].replace(b"Atlanta", b"Atlanta\x85") + b"\n"
+                                      + b"\n".join(lines[2:]) + b"\x81\n", "latin1"),
+        # Invisible to the prefix and suffix: found by validating the whole file once Silver hits it
+        "cp1252 byte mid-file": (b"\n".join(lines[:middle] + [lines[middle].replace(b",", b" \xe9,", 1)] + lines[middle + 1:]), "utf-8"),
+    }
+    for name, (data, sniffed) in cases.items():
+        path = write_bytes(os.path.join(work_dir, "case.csv"), data)
+        reader, encoding, header_index = sniff_reader(path)
+        if (reader, encoding, header_index) != ("tall_csv", sniffed, 2):
+            raise AssertionError(f"{name}: sniffed {reader} {encoding} header {header_index}, expected tall_csv {sniffed} header 2")
+        actual = silver_rows(path, work_dir)
+        if len(actual) != len(expected) or not actual["billing_code"].equals(expected["billing_code"]):
+            raise AssertionError(f"{name}: Silver produced {len(actual)} rows, expected {len(expected)}")
+        if name == "cp1252 byte mid-file" and actual["description"].str.contains(" é").sum() != 1:
+            raise AssertionError(f"{name}: the mid-file byte wasn't read as cp1252")
+
+
+def check_prefix_boundary(work_dir):
+    """A multi-byte character cut by the prefix boundary, with and without a newline before it."""
+    for data in (b'{"hospital_name": "' + b"x" * 4090 + "é".encode() + b'", "standard_charge_information": []}',
+                 b"description,code|1,payer_name\n" + b"x" * 4060 + "é".encode() + b",1,A\n" * 10):
+        path = write_bytes(os.path.join(work_dir, "boundary.csv"), data)
+        for sniff_bytes in range(4090, 4110):
+            encoding, _ = read_prefix(path, sniff_bytes=sniff_bytes)
+            if encoding != "utf-8":
+                raise AssertionError(f"prefix of {sniff_bytes} bytes sniffed as {encoding}")
+
+
+def check_suffix_boundary(work_dir):
+    """Minified JSON (no newline to align the suffix to) with 2-4 byte characters wherever the suffix may start."""
+    body = '"' + "é€😀x" * 2000 + '"'
+    data = ('{"hospital_name": ' + body + ', "standard_charge_information": [' + body + "]}").encode()
+    path = write_bytes(os.path.join(work_dir, "minified.json"), data)
+    for sniff_bytes in range(4096, 4106):
+        encoding, _ = read_prefix(path, sniff_bytes=sniff_bytes)
+        if encoding != "utf-8":
+            raise AssertionError(f"suffix of {sniff_bytes} bytes sniffed as {encoding}")
+    # A genuine cp1252 byte in the suffix is still caught
+    path = write_bytes(os.path.join(work_dir, "minified.json"), data[:-2] + b"\x96]}")
+    encoding, _ = read_prefix(path, sniff_bytes=4096)
+    if encoding != "cp1252":
+        raise AssertionError(f"cp1252 byte in the suffix sniffed as {encoding}")
+
+
+PREAMBLES = {
+    # name: (lines before the header, line ending)
+    "no preamble": ([], "\n"),
+    "CMS v2 preamble": (["hospital_name,last_updated_on,version", "Synthetic Hospital,2025-10-01,2.0.0"], "\n"),
+    "license row and blank lines, CRLF": (["hospital_name,last_updated_on", "Synthetic Hospital,2025-10-01", "",
+                                           "license_number|GA,description of license", "12345,acute care", ""], "\r\n"),
+    "disclaimer row": (['"To the best of its knowledge, the hospital has included all standard charges"'], "\n"),
+}
+
+
+def check_preambles(work_dir):
+    header = "description,code|1,code|1|type,setting,payer_name,plan_name,standard_charge|min,standard_charge|max,estimated_amount"
+    row = "Sepsis with MCC,871,MS-DRG,inpatient,Aetna,PPO,100.5,200.25,150"
+    for name, (preamble, newline) in PREAMBLES.items():
+        path = write_bytes(os.path.join(work_dir, "preamble.csv"), newline.join(preamble + [header] + [row] * 5 + [""]).encode())
+        reader, encoding, header_index = sniff_reader(path)
+        chunk = next(READERS[reader]["read"](path, encoding, header_index, 0))
+        if header_index != len(preamble) or list(chunk.columns) != header.split(",") or len(chunk) != 5:
+            raise AssertionError(f"{name}: header at {header_index}, read {len(chunk)} rows with columns {list(chunk.columns)}")
+
+
+def time_detection(path):
+    start = time.perf_counter()
+    old = detect_by_readlines(path)
+    readlines = time.perf_counter() - start
+    start = time.perf_counter()
+    _, encoding, header_index = sniff_reader(path)
+    sniffed = time.perf_counter() - start
+    assert old == (encoding, header_index), (old, encoding, header_index)
+    return readlines, sniffed
+
+
+DEFAULT_SIZES = (100_000, 500_000, 2_000_000)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES):
+    work_dir = tempfile.mkdtemp(prefix="bench-detect-")
+    try:
+        print(">>> [Bench] Checking encoding, prefix/suffix boundary and preamble detection...")
+        check_encodings(work_dir)
+        check_prefix_boundary(work_dir)
+        check_suffix_boundary(work_dir)
+        check_preambles(work_dir)
+        print(">>> [Bench] Detection OK.")
+
+        # Worst case for the original detection: one cp1252 byte in the footer of an otherwise ASCII file
+        print(f"{'rows':>10} {'MB':>8} {'readlines ms':>13} {'sniff ms':>9} {'speedup':>8}")
+        for n_rows in sizes:
+            path = write_bytes(os.path.join(work_dir, "timed.csv"), ascii_mrf(os.path.join(work_dir, "timed.csv"), n_rows) + FOOTER)
+            readlines, sniffed = time_detection(path)
+            print(f"{n_rows:>10} {os.path.getsize(path) / 2**20:>8,.0f} {readlines * 1000:>13,.0f} {sniffed * 1000:>9,.1f} {readlines / sniffed:>7.0f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Optional row counts on the command line, e.g. `bench_detect.py 1000000 10000000`
+    run_benchmark([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.datasets import to_table, partition_path
+from silver.silver_emory import SILVER_SCHEMA
+from gold.gold_emory import DEFAULT_ROLLUPS, GOLD_SCHEMA, aggregate_partition, merge_rollup
+
+# Rows generated per Silver row group
+CHUNK_ROWS = 1_000_000
+
+# Above this the in-memory baseline is skipped (it would need more RAM than the budgeted run is meant to)
+IN_MEMORY_MAX_ROWS = 10_000_000
+
+
+def write_silver(path, n_rows, seed=0):
+    """Synthetic single-hospital Silver partition with a realistic number of distinct Gold groups."""
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"{i:05d}" for i in range(20_000)], dtype=object)
+    procedures = np.array([f"Procedure {i}" for i in range(20_000)], dtype=object)
+    payers = np.array([f"Payer {i}" for i in range(40)] + [None], dtype=object)
+    plans = np.array([f"Plan {i}" for i in range(12)] + [None], dtype=object)
+    settings = np.array(["inpatient", "outpatient", "both"], dtype=object)
+
+    with pq.ParquetWriter(path, SILVER_SCHEMA, compression="zstd") as writer:
+        for start in range(0, n_rows, CHUNK_ROWS):
+            n = min(CHUNK_ROWS, n_rows - start)
+            code = rng.zipf(1.3, size=n) % len(codes)
+            rate = rng.lognormal(7, 1.2, size=n)
+            df = pd.DataFrame({column: None for column in SILVER_SCHEMA.names}, index=range(n))
+            df["hospital_name"] = "Synthetic Hospital"
+            df["billing_code"] = codes[code]
+            df["billing_code_type"] = np.where(code % 7 == 0, None, "CPT")
+            df["procedure_type"] = procedures[code]
+            df["description"] = procedures[code]
+            df["setting"] = settings[rng.integers(0, len(settings), size=n)]
+            df["payer"] = payers[rng.integers(0, len(payers), size=n)]
+            df["plan"] = plans[rng.integers(0, len(plans), size=n)]
+            df["min_negotiated_rate"] = rate * 0.8
+            df["max_negotiated_rate"] = rate * 1.2
+            df["estimated_amount"] = np.where(rng.random(n) < 0.05, np.nan, rate)
+            df["effective_date"] = pd.NaT
+            writer.write_table(to_table(df, SILVER_SCHEMA))
+
+
+def aggregate(silver_path, output_dir, memory_budget_mb, spill_dir):
+    """Aggregates the synthetic partition into output_dir (Gold part plus partial rollups)."""
+    shutil.rmtree(output_dir, ignore_errors=True)
+    partial_paths = {name: partition_path(os.path.join(output_dir, name), "synthetic") for name in DEFAULT_ROLLUPS}
+    return aggregate_partition(silver_path, os.path.join(output_dir, "gold.parquet"), partial_paths, DEFAULT_ROLLUPS,
+                               GOLD_SCHEMA, False, memory_budget_mb, spill_dir)
+
+
+def _measure(queue, silver_path, output_dir, memory_budget_mb, spill_dir):
+    start = time.perf_counter()
+    rows, summary_rows, _ = aggregate(silver_path, output_dir, memory_budget_mb, spill_dir)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux
+    queue.put((rows, summary_rows, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def measure(silver_path, output_dir, memory_budget_mb, spill_dir):
+    """(rows, groups, seconds, peak RSS MB) of one aggregation, in a fresh process so peaks don't carry over."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(queue, silver_path, output_dir, memory_budget_mb, spill_dir))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def check_parity(silver_path, work_dir):
+    in_memory, spilled = os.path.join(work_dir, "in_memory"), os.path.join(work_dir, "spilled")
+    aggregate(silver_path, in_memory, 0, work_dir)
+    aggregate(silver_path, spilled, 1, work_dir)
+    pd.testing.assert_frame_equal(pd.read_parquet(os.path.join(in_memory, "gold.parquet")),
+                                  pd.read_parquet(os.path.join(spilled, "gold.parquet")))
+    for name, keys in DEFAULT_ROLLUPS.items():
+        pd.testing.assert_frame_equal(merge_rollup(os.path.join(in_memory, name), keys),
+                                      merge_rollup(os.path.join(spilled, name), keys))
+
+
+DEFAULT_SIZES = (1_000_000, 10_000_000, 100_000_000)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, memory_budget_mb=512):
+    work_dir = tempfile.mkdtemp(prefix="bench-gold-")
+    try:
+        silver_path = os.path.join(work_dir, "silver.parquet")
+        print(">>> [Bench] Checking spilled aggregation matches in-memory...")
+        write_silver(silver_path, 200_000)
+        check_parity(silver_path, work_dir)
+        print(">>> [Bench] Parity OK.")
+
+        print(f"{'rows':>12} {'groups':>10} {'mode':>16} {'rows/s':>12} {'peak RSS MB':>12}")
+        for n_rows in sizes:
+            write_silver(silver_path, n_rows)
+            modes = [("in-memory", 0)] if n_rows <= IN_MEMORY_MAX_ROWS else []
+            modes.append((f"budget {memory_budget_mb} MB", memory_budget_mb))
+            for label, budget in modes:
+                rows, groups, elapsed, peak_mb = measure(silver_path, os.path.join(work_dir, "output"), budget, work_dir)
+                print(f"{rows:>12} {groups:>10} {label:>16} {rows / elapsed:>12,.0f} {peak_mb:>12,.0f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Optional row counts on the command line, e.g. `bench_gold_out_of_core.py 1000000 100000000`;
+    # GOLD_MEMORY_BUDGET_MB sets the budgeted run's budget
+    run_benchmark([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES, int(os.getenv("GOLD_MEMORY_BUDGET_MB", "512")))
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import random
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from silver.silver_emory import parse_description, parse_descriptions
+
+# Shapes seen in real Emory descriptions, plus edge cases for the separator/level regexes
+SAMPLE_DESCRIPTIONS = [
+    "Heart Failure and Shock with MCC",
+    "Level 3 Cardiac Rehabilitation",
+    "Clinic Visit - Level 2",
+    "level 4: Imaging without Contrast",
+    "  Endoscopy LEVEL  5 ,",
+    "| Level 1 |",
+    "Level 2 - Level 3 Combined",
+    "Drug Administration Level ٣",
+    "Café Visit – Level 1",
+    "Level",
+    "",
+]
+
+
+def make_descriptions(n_rows, n_unique, seed=0):
+    rng = random.Random(seed)
+    pool = SAMPLE_DESCRIPTIONS + [
+        f"{rng.choice(['Procedure', 'Visit', 'Therapy'])} {i} " + (f"Level {rng.randint(1, 9)}" if i % 3 else "")
+        for i in range(max(n_unique - len(SAMPLE_DESCRIPTIONS), 0))
+    ]
+    return pd.Series([rng.choice(pool) for _ in range(n_rows)], dtype=object)
+
+
+def check_parity(descriptions):
+    expected = descriptions.apply(parse_description)
+    level, procedure_type = parse_descriptions(descriptions)
+    mismatches = (expected[0] != level) | (expected[1] != procedure_type)
+    if mismatches.any():
+        sample = pd.DataFrame({"description": descriptions, "expected": expected[1], "actual": procedure_type})[mismatches]
+        raise AssertionError(f"parse_descriptions differs from parse_description on {mismatches.sum()} rows:\n{sample.head()}")
+
+
+def time_rows_per_sec(fn, descriptions):
+    start = time.perf_counter()
+    fn(descriptions)
+    return len(descriptions) / (time.perf_counter() - start)
+
+
+DEFAULT_SIZES = (10_000, 100_000, 250_000)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, n_unique=2_000):
+    print(">>> [Bench] Checking parse_descriptions parity against parse_description...")
+    check_parity(pd.Series(SAMPLE_DESCRIPTIONS, dtype=object))
+    check_parity(make_descriptions(20_000, n_unique))
+    print(">>> [Bench] Parity OK.")
+
+    print(f"{'rows':>10} {'apply rows/s':>14} {'vectorized rows/s':>18} {'speedup':>8}")
+    for n_rows in sizes:
+        descriptions = make_descriptions(n_rows, n_unique)
+        before = time_rows_per_sec(lambda d: d.apply(parse_description), descriptions)
+        after = time_rows_per_sec(parse_descriptions, descriptions)
+        print(f"{n_rows:>10} {before:>14,.0f} {after:>18,.0f} {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    # Optional row counts on the command line, e.g. `bench_parse_description.py 10000 1000000`
+    run_benchmark([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,160 @@
+"""
+Times and memory-profiles the Silver, Gold and loader stages on synthetic MRFs at several sizes.
+
+Each size runs `pipeline.py` in a fresh process on its own synthetic Bronze directory, so nothing
+(imports, caches, peak RSS) carries over between sizes. One line per size is appended to the results
+file, tagged with the commit it ran on. The table printed at the end compares each stage with the
+most recent result for the same size from a different commit (or --baseline), and flags drops in
+rows/s and growth in peak RSS beyond REGRESSION_THRESHOLD.
+
+The loader stage runs only when DATABASE_URL is set (or when --stages asks for it).
+
+    python etl/bench/bench_pipeline.py                       # DEFAULT_SIZES
+    python etl/bench/bench_pipeline.py 1000000 10000000 --hospitals 4 --baseline 08aa9c6
+    python etl/bench/bench_pipeline.py 1000000 --layout json      # Bronze as CMS JSON MRFs
+"""
+import os
+import sys
+import json
+import socket
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from bench.synthetic_mrf import LAYOUTS, write_bronze
+
+PIPELINE = os.path.join(os.path.dirname(BENCH_DIR), "pipeline.py")
+
+# Untracked, so results from older checkouts survive switching commits
+RESULTS_PATH = os.getenv("BENCH_RESULTS", os.path.join(BENCH_DIR, "results", "pipeline.jsonl"))
+
+# Relative slowdown (rows/s) or peak RSS growth reported as a regression
+REGRESSION_THRESHOLD = 0.10
+
+DEFAULT_SIZES = (100_000, 1_000_000, 5_000_000)
+
+
+def git_commit():
+    """(commit, dirty) of the working tree, or (None, None) outside a git checkout."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCH_DIR, capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_size(n_rows, n_hospitals, stages, work_dir, layout="tall"):
+    """Generates n_rows of Bronze, runs the pipeline on it and returns the stage entries of its run report."""
+    data_dir = os.path.join(work_dir, f"rows-{n_rows}")
+    shutil.rmtree(data_dir, ignore_errors=True)
+    print(f">>> [Bench] Generating {n_rows} rows across {n_hospitals} hospitals ({layout})...")
+    write_bronze(os.path.join(data_dir, "bronze"), n_rows, n_hospitals, layout=layout)
+
+    report_path = os.path.join(data_dir, "run_report.json")
+    # One hospital at a time in-process, so each stage's peak RSS is the pipeline's own
+    env = dict(os.environ, SILVER_WORKERS="1", SILVER_WRITE_CSV="0", GOLD_WRITE_CSV="0", ETL_FULL_REFRESH="1")
+    subprocess.run([sys.executable, PIPELINE, "--data-dir", data_dir, "--stages", *stages, "--workers", "1", "--report", report_path],
+                   env=env, stdout=subprocess.DEVNULL, check=False)
+    with open(report_path) as f:
+        report = json.load(f)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return report["stages"]
+
+
+def stage_summary(entry):
+    """The numbers tracked across commits for one stage."""
+    summary = {key: entry.get(key) for key in ("status", "wall_seconds", "cpu_seconds", "peak_rss_mb", "rows_in", "rows_out", "bytes_in", "bytes_out")}
+    if entry.get("rows_in") and entry.get("wall_seconds"):
+        summary["rows_per_second"] = round(entry["rows_in"] / entry["wall_seconds"])
+    if entry.get("error"):
+        summary["error"] = entry["error"]
+    return summary
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(results, record, baseline=None):
+    """Latest earlier result for the same size, hospital count and layout from `baseline` (default: any other commit)."""
+    for previous in reversed(results):
+        if (previous["rows"], previous["hospitals"], previous.get("layout", "tall")) != (record["rows"], record["hospitals"], record["layout"]):
+            continue
+        if previous["commit"] == baseline if baseline else previous["commit"] != record["commit"]:
+            return previous
+    return None
+
+
+def change(current, previous):
+    if not current or not previous:
+        return None
+    return current / previous - 1
+
+
+def print_comparison(record, previous):
+    against = f" vs {previous['commit']}" if previous else ""
+    print(f"\n{record['rows']:,} rows, {record['hospitals']} hospitals, {record['layout']} @ {record['commit']}{' (dirty)' if record['dirty'] else ''}{against}")
+    print(f"{'stage':>8} {'status':>8} {'wall s':>9} {'cpu s':>9} {'rows/s':>12} {'change':>8} {'peak RSS MB':>12} {'change':>8}")
+    for name, stage in record["stages"].items():
+        before = (previous or {}).get("stages", {}).get(name, {})
+        speed = change(stage.get("rows_per_second"), before.get("rows_per_second"))
+        memory = change(stage.get("peak_rss_mb"), before.get("peak_rss_mb"))
+        flag = "  <-- regression" if (speed is not None and speed < -REGRESSION_THRESHOLD) or (memory is not None and memory > REGRESSION_THRESHOLD) else ""
+        print(f"{name:>8} {stage['status']:>8} {stage.get('wall_seconds') or 0:>9.2f} {stage.get('cpu_seconds') or 0:>9.2f} "
+              f"{stage.get('rows_per_second') or 0:>12,} {'' if speed is None else f'{speed:+.0%}':>8} "
+              f"{stage.get('peak_rss_mb') or 0:>12,.0f} {'' if memory is None else f'{memory:+.0%}':>8}{flag}")
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, n_hospitals=1, stages=None, results_path=RESULTS_PATH, baseline=None, layout="tall"):
+    stages = stages or ["silver", "gold"] + (["load"] if os.getenv("DATABASE_URL") else [])
+    commit, dirty = git_commit()
+    results = load_results(results_path)
+    work_dir = tempfile.mkdtemp(prefix="bench-pipeline-")
+    records = []
+    try:
+        for n_rows in sizes:
+            record = {
+                "commit": commit,
+                "dirty": dirty,
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+                "host": socket.gethostname(),
+                "cpus": os.cpu_count(),
+                "python": platform.python_version(),
+                "rows": n_rows,
+                "hospitals": n_hospitals,
+                "layout": layout,
+                "stages": {name: stage_summary(entry) for name, entry in run_size(n_rows, n_hospitals, stages, work_dir, layout).items()},
+            }
+            records.append(record)
+            os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+            with open(results_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for record in records:
+        print_comparison(record, find_baseline(results, record, baseline))
+    print(f"\n>>> [Bench] Results appended to {results_path}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="*", type=int, help=f"Charge rows per run (default: {' '.join(map(str, DEFAULT_SIZES))})")
+    parser.add_argument("--hospitals", type=int, default=1, help="Hospitals the rows are split across")
+    parser.add_argument("--stages", nargs="+", choices=["silver", "gold", "load"])
+    parser.add_argument("--layout", choices=LAYOUTS, default="tall", help="MRF layout of the synthetic Bronze files")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON-lines file results are appended to")
+    parser.add_argument("--baseline", help="Commit to compare against (default: the latest other commit)")
+    args = parser.parse_args()
+
+    run_benchmark(args.sizes or DEFAULT_SIZES, args.hospitals, args.stages, args.results, args.baseline, args.layout)
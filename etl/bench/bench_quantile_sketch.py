@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.sketch import (
+    RELATIVE_ACCURACY, grouped_buckets, grouped_quantile, grouped_serialize, merge, quantile,
+)
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def make_values(kind, n, rng):
+    """Rate-like distributions, plus the degenerate shapes Gold sees (ties, zeros, credits)."""
+    if kind == "lognormal":
+        return rng.lognormal(mean=7, sigma=1.5, size=n)
+    if kind == "uniform":
+        return rng.uniform(1, 100_000, size=n)
+    if kind == "duplicates":
+        return rng.choice([125.0, 250.0, 1_000.0], size=n)
+    if kind == "zeros_and_negatives":
+        return np.concatenate([np.zeros(n // 4), -rng.lognormal(3, 1, size=n // 4), rng.lognormal(5, 2, size=n - n // 2)])
+    raise ValueError(kind)
+
+
+DISTRIBUTIONS = ("lognormal", "uniform", "duplicates", "zeros_and_negatives")
+
+
+def check_accuracy(values, n_groups, rng, groups=None):
+    """Every group's sketch quantiles within RELATIVE_ACCURACY of the exact (interpolated) quantile."""
+    if groups is None:
+        groups = rng.integers(0, n_groups, size=len(values))
+    order = np.argsort(groups, kind="stable")
+    groups, values = groups[order], values[order]
+    bucket_groups, ids, counts = grouped_buckets(groups, values)
+
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+    for q in QUANTILES:
+        estimates = grouped_quantile(bucket_groups, ids, counts, q, n_groups)
+        for group in range(n_groups):
+            group_values = values[bounds[group]:bounds[group + 1]]
+            if not len(group_values):
+                assert np.isnan(estimates[group])
+                continue
+            exact = np.quantile(group_values, q)
+            # Absolute slack only for exact quantiles of 0
+            if abs(estimates[group] - exact) > RELATIVE_ACCURACY * abs(exact) + 1e-9:
+                raise AssertionError(f"q={q} group {group} of {len(group_values)}: sketch {estimates[group]}, exact {exact}")
+
+
+def check_small_groups(rng):
+    """Gold groups often hold 2-4 rates, where the median sits between two values far apart."""
+    for values, expected in (([100.0, 300.0], 200.0), ([100.0, 100.0, 1000.0, 1000.0], 550.0)):
+        estimate = quantile(grouped_serialize(*grouped_buckets(np.zeros(len(values)), np.array(values)), 1)[0], 0.5)
+        if abs(estimate - expected) > RELATIVE_ACCURACY * expected:
+            raise AssertionError(f"median of {values}: sketch {estimate}, exact {expected}")
+    for size in (2, 3, 4):
+        for kind in ("lognormal", "duplicates"):
+            n_groups = 2_000
+            check_accuracy(make_values(kind, size * n_groups, rng), n_groups, rng, np.repeat(np.arange(n_groups), size))
+
+
+def check_merge(values, n_chunks):
+    """Merging per-chunk sketches gives exactly the sketch of all the values."""
+    whole = grouped_serialize(*grouped_buckets(np.zeros(len(values)), values), 1)[0]
+    chunks = [
+        grouped_serialize(*grouped_buckets(np.zeros(len(chunk)), chunk), 1)[0]
+        for chunk in np.array_split(values, n_chunks)
+    ]
+    merged = merge(chunks)
+    if merged != whole:
+        raise AssertionError("Merged chunk sketches differ from the sketch of all values")
+    for q in QUANTILES:
+        assert quantile(merged, q) == quantile(whole, q)
+
+
+def time_sketch(values, groups, n_groups):
+    start = time.perf_counter()
+    bucket_groups, ids, counts = grouped_buckets(groups, values)
+    for q in QUANTILES:
+        grouped_quantile(bucket_groups, ids, counts, q, n_groups)
+    blobs = grouped_serialize(bucket_groups, ids, counts, n_groups)
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(len(blob) for blob in blobs if blob is not None) / n_groups
+
+
+def time_exact(values, groups):
+    start = time.perf_counter()
+    pd.Series(values).groupby(groups).quantile(list(QUANTILES))
+    return time.perf_counter() - start
+
+
+DEFAULT_SIZES = (100_000, 1_000_000, 5_000_000)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, n_groups=1_000):
+    rng = np.random.default_rng(0)
+    print(f">>> [Bench] Checking p10/p50/p90 are within {RELATIVE_ACCURACY:.0%} of the exact quantiles...")
+    for kind in DISTRIBUTIONS:
+        values = make_values(kind, 50_000, rng)
+        check_accuracy(values, 50, rng)
+        check_merge(values, 7)
+    check_small_groups(rng)
+    print(">>> [Bench] Accuracy and merge OK.")
+
+    # The sketch buys mergeability and bounded size per group, not speed: at small sizes it can be slower
+    print(f"{'rows':>10} {'exact rows/s':>14} {'sketch rows/s':>14} {'exact/sketch time':>18} {'bytes/group':>12}")
+    for n_rows in sizes:
+        values = make_values("lognormal", n_rows, rng)
+        groups = rng.integers(0, n_groups, size=n_rows)
+        exact = time_exact(values, groups)
+        sketch, bytes_per_group = time_sketch(values, groups, n_groups)
+        print(f"{n_rows:>10} {n_rows / exact:>14,.0f} {n_rows / sketch:>14,.0f} {exact / sketch:>17.1f}x {bytes_per_group:>12,.0f}")
+
+
+if __name__ == "__main__":
+    # Optional row counts on the command line, e.g. `bench_quantile_sketch.py 100000 10000000`
+    run_benchmark([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES)
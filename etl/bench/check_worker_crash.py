@@ -0,0 +1,59 @@
+"""
+Checks that one Silver worker dying hard (os._exit, as an OOM kill would) fails only its own hospital:
+the others still finish and the dataset is published without it.
+
+    python etl/bench/check_worker_crash.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.synthetic_mrf import write_bronze
+from common.datasets import list_partitions
+from silver import silver_emory
+
+CRASHING_FILE = "synthetic_hospital_2_raw.csv"
+
+run_hospital = silver_emory.run_hospital
+
+
+def crashing_run_hospital(filename, *args, **kwargs):
+    """run_hospital, except the worker running CRASHING_FILE exits without cleanup."""
+    if filename == CRASHING_FILE:
+        os._exit(137)
+    return run_hospital(filename, *args, **kwargs)
+
+
+def check_worker_crash(n_hospitals, workers, work_dir):
+    bronze_dir, silver_dir = os.path.join(work_dir, "bronze"), os.path.join(work_dir, "silver")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    catalog = write_bronze(bronze_dir, 2_000 * n_hospitals, n_hospitals)
+    assert CRASHING_FILE in catalog, sorted(catalog)
+
+    # Worker processes are forked from here, so they see the patched function too
+    silver_emory.run_hospital = crashing_run_hospital
+    try:
+        report = silver_emory.process_emory(bronze_dir, silver_dir, workers=workers, full_refresh=True)
+    finally:
+        silver_emory.run_hospital = run_hospital
+
+    statuses = {key: hospital["status"] for key, hospital in report["hospitals"].items()}
+    crashed = CRASHING_FILE.replace("_raw.csv", "")
+    expected = {filename.replace("_raw.csv", ""): "failed" if filename == CRASHING_FILE else "rebuilt" for filename in catalog}
+    if statuses != expected:
+        raise AssertionError(f"{n_hospitals} hospitals, {workers} workers: statuses {statuses}, expected {expected}")
+    published = set(list_partitions(os.path.join(silver_dir, "emory_silver")))
+    if published != set(expected) - {crashed}:
+        raise AssertionError(f"{n_hospitals} hospitals, {workers} workers: published {sorted(published)}")
+
+
+if __name__ == "__main__":
+    work_dir = tempfile.mkdtemp(prefix="check-worker-crash-")
+    try:
+        for n_hospitals, workers in ((4, 4), (6, 3)):
+            check_worker_crash(n_hospitals, workers, work_dir)
+        print(">>> [Bench] A crashed worker fails only its own hospital.")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,299 @@
+"""
+Synthetic CMS-style standard-charge MRFs for benchmarking the pipeline.
+
+The tall CSV layout looks like what Silver's find_header_and_read handles in the real Emory MRFs: a
+two-row metadata preamble, the header row, one row per item and payer/plan with MS-DRG, APC, HCPCS and
+CPT codes, "Level N" descriptions in their usual spellings, and disclaimer/blank footer rows. The same
+charges can be written in the wide CSV layout (one column group per payer/plan) or as CMS JSON, and
+Silver produces the same rows from all three.
+
+    python etl/bench/synthetic_mrf.py /tmp/bench/bronze --rows 1000000 --hospitals 4 --layout json
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bronze.bronze_emory import raw_filename
+
+PREAMBLE_HEADER = [
+    "hospital_name", "last_updated_on", "version", "hospital_location", "hospital_address", "license_number|GA",
+    "To the best of its knowledge and belief, the hospital has included all applicable standard charge information "
+    "in accordance with the requirements of 45 CFR 180.50",
+]
+
+COLUMNS = [
+    "description", "code|1", "code|1|type", "code|2", "code|2|type", "billing_class", "setting",
+    "drug_unit_of_measurement", "drug_type_of_measurement", "modifiers", "standard_charge|gross",
+    "standard_charge|discounted_cash", "payer_name", "plan_name", "standard_charge|negotiated_dollar",
+    "standard_charge|negotiated_percentage", "standard_charge|negotiated_algorithm", "estimated_amount",
+    "standard_charge|methodology", "standard_charge|min", "standard_charge|max", "additional_generic_notes",
+]
+
+FOOTER_DESCRIPTIONS = [
+    "To the best of its knowledge and belief, the hospital has included all applicable standard charge information.",
+    None,
+]
+
+# Share of items per code type; Silver keeps only MS-DRG and APC
+CODE_MIX = {"MS-DRG": 0.25, "APC": 0.25, "HCPCS": 0.35, "CPT": 0.15}
+
+PAYERS = [
+    "Aetna", "Anthem Blue Cross", "Cigna", "UnitedHealthcare", "Humana", "Ambetter", "Kaiser Permanente", "Oscar",
+    "WellCare", "Amerigroup", "CareSource", "Peach State", "Alliant", "MultiPlan", "First Health", "Tricare",
+]
+PLANS = ["PPO", "HMO", "POS", "EPO", "Medicare Advantage", "Managed Medicaid", "Exchange"]
+
+DRG_NAMES = [
+    "Major Joint Replacement", "Heart Failure and Shock", "Sepsis", "Simple Pneumonia", "Kidney and Urinary Tract Infections",
+    "Cardiac Arrhythmia", "Intracranial Hemorrhage", "Esophagitis and Gastroenteritis", "Spinal Fusion", "Psychoses",
+]
+DRG_SEVERITIES = ["with MCC", "with CC", "without CC/MCC", "w/o MCC"]
+LEVELED_NAMES = [
+    "Clinic Visit", "Imaging without Contrast", "Imaging with Contrast", "Endoscopy", "Drug Administration",
+    "Cardiac Rehabilitation", "Café Visit", "Diagnostic Procedures", "Excision/Biopsy", "Nerve Procedures",
+]
+# How "Level N" shows up in real descriptions, including the separators parse_descriptions strips
+LEVEL_FORMATS = ["Level {n} {name}", "{name} - Level {n}", "level {n}: {name}", "  {name} LEVEL  {n} ,", "{name} – Level {n}"]
+ITEM_NAMES = ["Office Visit", "Injection", "Infusion", "Lab Panel", "Therapy Session", "Supply", "Ultrasound", "X-Ray"]
+
+# Per payer/plan fields of the tall layout -> their wide column suffix (None: no suffix)
+PAYER_FIELDS = {
+    "standard_charge|negotiated_dollar": "negotiated_dollar",
+    "standard_charge|negotiated_percentage": "negotiated_percentage",
+    "standard_charge|negotiated_algorithm": "negotiated_algorithm",
+    "standard_charge|methodology": "methodology",
+    "estimated_amount": None,
+}
+
+LAYOUTS = ("tall", "wide", "json")
+
+# Rows generated (and written) at a time
+CHUNK_ROWS = 250_000
+
+
+def make_items(n_items, code_mix, rng):
+    """One row per chargeable item: code, code type, description, setting and a base price."""
+    types = np.array(list(code_mix))
+    code_type = types[rng.choice(len(types), size=n_items, p=np.array(list(code_mix.values())) / sum(code_mix.values()))]
+    index = np.arange(n_items)
+
+    codes = np.empty(n_items, dtype=object)
+    descriptions = np.empty(n_items, dtype=object)
+    for kind in types:
+        mask = code_type == kind
+        i = index[mask]
+        if kind == "MS-DRG":
+            codes[mask] = [f"{1 + k % 999:03d}" for k in i]
+            descriptions[mask] = [f"{DRG_NAMES[k % len(DRG_NAMES)]} {DRG_SEVERITIES[k // len(DRG_NAMES) % len(DRG_SEVERITIES)]}" for k in i]
+        elif kind == "APC":
+            codes[mask] = [f"{5000 + k % 1000:04d}" for k in i]
+            descriptions[mask] = [
+                LEVEL_FORMATS[k % len(LEVEL_FORMATS)].format(name=LEVELED_NAMES[k // 7 % len(LEVELED_NAMES)], n=1 + k % 6)
+                if k % 4 else LEVELED_NAMES[k % len(LEVELED_NAMES)]
+                for k in i
+            ]
+        elif kind == "HCPCS":
+            codes[mask] = [f"{'JGAQ'[k % 4]}{k % 10_000:04d}" for k in i]
+            descriptions[mask] = [f"{ITEM_NAMES[k % len(ITEM_NAMES)]} {k}" for k in i]
+        else:
+            codes[mask] = [f"{10_000 + k % 90_000:05d}" for k in i]
+            descriptions[mask] = [f"{ITEM_NAMES[k % len(ITEM_NAMES)]} {k}" for k in i]
+
+    setting = np.where(code_type == "MS-DRG", "inpatient", np.where(code_type == "APC", "outpatient", "both")).astype(object)
+    price = np.where(code_type == "MS-DRG", rng.lognormal(10, 0.8, n_items), rng.lognormal(6.5, 1.3, n_items))
+    # The min/max across payers is a property of the item, repeated on each of its rows
+    min_rate = np.where(rng.random(n_items) < 0.05, np.nan, np.round(price * rng.uniform(0.3, 0.5, n_items), 2))
+    max_rate = np.round(price * rng.uniform(1.0, 1.3, n_items), 2)
+    return pd.DataFrame({"description": descriptions, "code": codes, "code_type": code_type, "setting": setting,
+                         "price": price, "min_rate": min_rate, "max_rate": max_rate})
+
+
+def payer_plans(n_payers, plans_per_payer):
+    """(payer, plan) fan-out for each item; every payer also has a row with no plan name."""
+    pairs = []
+    for p in range(n_payers):
+        payer = PAYERS[p % len(PAYERS)] + ("" if p < len(PAYERS) else f" {p // len(PAYERS) + 1}")
+        pairs.append((payer, None))
+        pairs.extend((payer, PLANS[(p + k) % len(PLANS)]) for k in range(plans_per_payer))
+    return pairs
+
+
+def make_rows(items, pairs, start, n, rng):
+    """Rows start..start+n of the item x (payer, plan) cross product, as the MRF's columns."""
+    row = np.arange(start, start + n)
+    item = items.iloc[row // len(pairs)].reset_index(drop=True)
+    payer, plan = (np.array(values, dtype=object)[row % len(pairs)] for values in zip(*pairs))
+
+    negotiated = item["price"].to_numpy() * rng.uniform(0.35, 1.1, n)
+    df = pd.DataFrame(index=range(n), columns=COLUMNS, dtype=object)
+    df["description"] = item["description"].to_numpy()
+    df["code|1"] = item["code"].to_numpy()
+    df["code|1|type"] = item["code_type"].to_numpy()
+    # Revenue code as the secondary code, per item
+    df["code|2"] = np.where(item["code_type"].to_numpy() == "MS-DRG", None, "0" + (360 + row // len(pairs) % 400).astype(str))
+    df["code|2|type"] = np.where(df["code|2"].isna(), None, "RC")
+    df["billing_class"] = np.where(row // len(pairs) % 9 == 0, "professional", "facility")
+    df["setting"] = item["setting"].to_numpy()
+    df["standard_charge|gross"] = np.round(item["price"].to_numpy() * 2.5, 2)
+    df["standard_charge|discounted_cash"] = np.round(item["price"].to_numpy() * 1.4, 2)
+    df["payer_name"] = payer
+    df["plan_name"] = plan
+    # Percentage-of-charges contracts have no dollar amount, only the estimate
+    by_percent = rng.random(n) < 0.15
+    df["standard_charge|negotiated_dollar"] = np.where(by_percent, np.nan, np.round(negotiated, 2))
+    df["standard_charge|negotiated_percentage"] = np.where(by_percent, np.round(rng.uniform(30, 80, n), 1), np.nan)
+    df["standard_charge|methodology"] = np.where(by_percent, "percent of total billed charges", "fee schedule")
+    df["estimated_amount"] = np.where(by_percent | (rng.random(n) < 0.1), np.round(negotiated, 2), np.nan)
+    df["standard_charge|min"] = item["min_rate"].to_numpy()
+    df["standard_charge|max"] = item["max_rate"].to_numpy()
+    return df
+
+
+def wide_column(field, payer, plan):
+    suffix = PAYER_FIELDS[field]
+    prefix = field.split("|")[0]
+    return f"{prefix}|{payer}|{plan or ''}" + (f"|{suffix}" if suffix else "")
+
+
+def wide_columns(pairs):
+    shared = [column for column in COLUMNS if column not in PAYER_FIELDS and column not in ("payer_name", "plan_name")]
+    return shared + [wide_column(field, payer, plan) for payer, plan in pairs for field in PAYER_FIELDS]
+
+
+def to_wide(df, pairs, start):
+    """Tall rows starting at an item boundary -> one row per item with a column group per payer/plan."""
+    position = start + np.arange(len(df))
+    item, slot = position // len(pairs), position % len(pairs)
+    wide = df.loc[slot == 0, [column for column in COLUMNS if column not in PAYER_FIELDS and column not in ("payer_name", "plan_name")]]
+    wide = wide.reset_index(drop=True)
+    payer_columns = {}
+    for j, (payer, plan) in enumerate(pairs):
+        mask = slot == j
+        for field in PAYER_FIELDS:
+            values = np.full(len(wide), None, dtype=object)
+            values[item[mask] - item[0]] = df.loc[mask, field].to_numpy()
+            payer_columns[wide_column(field, payer, plan)] = values
+    return pd.concat([wide, pd.DataFrame(payer_columns)], axis=1)
+
+
+def _present(record):
+    """Drops missing values, as JSON MRFs omit absent fields."""
+    return {key: value for key, value in record.items() if value is not None and not (isinstance(value, float) and np.isnan(value))}
+
+
+def to_json_items(df, pairs, start):
+    """Tall rows starting at an item boundary -> CMS JSON standard_charge_information items."""
+    position = start + np.arange(len(df))
+    records = df.to_dict("records")
+    for first in np.flatnonzero(position % len(pairs) == 0):
+        rows = records[first:first + len(pairs)]
+        row = rows[0]
+        codes = [{"code": row["code|1"], "type": row["code|1|type"]}]
+        if row["code|2"] is not None:
+            codes.append({"code": row["code|2"], "type": row["code|2|type"]})
+        charge = _present({
+            "setting": row["setting"],
+            "billing_class": row["billing_class"],
+            "gross_charge": row["standard_charge|gross"],
+            "discounted_cash": row["standard_charge|discounted_cash"],
+            "minimum": row["standard_charge|min"],
+            "maximum": row["standard_charge|max"],
+        })
+        charge["payers_information"] = [_present({
+            "payer_name": payer_row["payer_name"],
+            "plan_name": payer_row["plan_name"],
+            "standard_charge_dollar": payer_row["standard_charge|negotiated_dollar"],
+            "standard_charge_percentage": payer_row["standard_charge|negotiated_percentage"],
+            "estimated_amount": payer_row["estimated_amount"],
+            "methodology": payer_row["standard_charge|methodology"],
+        }) for payer_row in rows]
+        yield {"description": row["description"], "code_information": codes, "standard_charges": [charge]}
+
+
+def write_json(f, hospital_name, chunks):
+    f.write(json.dumps({
+        "hospital_name": hospital_name,
+        "last_updated_on": "2025-10-01",
+        "version": "2.0.0",
+        "hospital_location": ["Atlanta, GA"],
+        "hospital_address": ["1364 Clifton Rd NE, Atlanta, GA 30322"],
+        "license_information": {"license_number": "000123", "state": "GA"},
+        "affirmation": {"affirmation": PREAMBLE_HEADER[-1], "confirm_affirmation": True},
+    })[:-1] + ', "standard_charge_information": [\n')
+    separator = ""
+    for items in chunks:
+        for item in items:
+            f.write(separator + json.dumps(item))
+            separator = ",\n"
+    f.write('\n], "modifier_information": []}\n')
+
+
+def write_mrf(path, n_rows, hospital_name="Synthetic Hospital", seed=0, n_payers=12, plans_per_payer=3,
+              code_mix=CODE_MIX, encoding="utf-8", layout="tall", chunk_rows=CHUNK_ROWS):
+    """
+    Writes one hospital's MRF with n_rows charge rows (counted in the tall layout; plus preamble and
+    footer for CSVs) in `layout` (one of LAYOUTS). Returns the path.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = payer_plans(n_payers, plans_per_payer)
+    items = make_items(max(1, -(-n_rows // len(pairs))), code_mix, rng)
+    # Wide rows and JSON items need whole items per chunk
+    chunk_rows = max(len(pairs), chunk_rows - chunk_rows % len(pairs))
+    chunks = ((start, make_rows(items, pairs, start, min(chunk_rows, n_rows - start), rng)) for start in range(0, n_rows, chunk_rows))
+
+    with open(path, "w", newline="", encoding=encoding) as f:
+        if layout == "json":
+            write_json(f, hospital_name, (to_json_items(df, pairs, start) for start, df in chunks))
+            return path
+
+        columns = COLUMNS if layout == "tall" else wide_columns(pairs)
+        writer = csv.writer(f)
+        writer.writerow(PREAMBLE_HEADER)
+        writer.writerow([hospital_name, "2025-10-01", "2.0.0", "Atlanta, GA", "1364 Clifton Rd NE, Atlanta, GA 30322", "000123", "true"])
+        writer.writerow(columns)
+        for start, df in chunks:
+            (df if layout == "tall" else to_wide(df, pairs, start)).to_csv(f, header=False, index=False)
+        for description in FOOTER_DESCRIPTIONS:
+            writer.writerow([description] + [None] * (len(columns) - 1))
+    return path
+
+
+def write_bronze(bronze_dir, n_rows, n_hospitals=1, seed=0, **options):
+    """
+    A Bronze directory Silver can run on: n_rows split across n_hospitals *_raw.csv files plus the
+    hospital catalog. Returns {filename: hospital name}.
+    """
+    os.makedirs(bronze_dir, exist_ok=True)
+    catalog = {}
+    for h in range(n_hospitals):
+        hospital_name = f"Synthetic Hospital {h + 1}"
+        filename = raw_filename(hospital_name)
+        rows = n_rows // n_hospitals + (h < n_rows % n_hospitals)
+        write_mrf(os.path.join(bronze_dir, filename), rows, hospital_name, seed=seed + h, **options)
+        catalog[filename] = hospital_name
+    with open(os.path.join(bronze_dir, "hospital_catalog.json"), "w") as f:
+        json.dump(catalog, f, indent=4)
+    return catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bronze_dir")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Charge rows across all hospitals")
+    parser.add_argument("--hospitals", type=int, default=1)
+    parser.add_argument("--payers", type=int, default=12)
+    parser.add_argument("--plans-per-payer", type=int, default=3)
+    parser.add_argument("--encoding", default="utf-8")
+    parser.add_argument("--layout", choices=LAYOUTS, default="tall")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_bronze(args.bronze_dir, args.rows, args.hospitals, args.seed, n_payers=args.payers,
+                 plans_per_payer=args.plans_per_payer, encoding=args.encoding, layout=args.layout)
+    print(f">>> [Bench] Wrote {args.rows} rows across {args.hospitals} hospitals to {args.bronze_dir}")
@@ -2,17 +2,38 @@ import pandas as pd
 import requests
 import os
 import sys
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import json
 
-CMS_HPT_URL = "https://www.emoryhealthcare.org/cms-hpt.txt"
+# Allow running as a script (python etl/bronze/bronze_emory.py) as well as a module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.manifest import MANIFEST_FILENAME, load_manifest, save_manifest
 
-def discover_hospitals():
+# Overridable so the pipeline can run against a local stand-in server
+CMS_HPT_URL = os.getenv("EMORY_CMS_HPT_URL", "https://www.emoryhealthcare.org/cms-hpt.txt")
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Concurrent downloads (and pooled connections)
+DOWNLOAD_WORKERS = int(os.getenv("BRONZE_WORKERS", "4"))
+
+# Tries per file within a run; each retry resumes from the partial file
+DOWNLOAD_ATTEMPTS = 3
+
+CHUNK_BYTES = 1024 * 1024
+
+def discover_hospitals(session=None):
     """Fetches the CMS-HPT index and returns a list of hospitals with their URLs."""
     print(f">>> [Discovery] Fetching {CMS_HPT_URL}...")
     try:
-        response = requests.get(CMS_HPT_URL, timeout=30)
+        response = (session or requests).get(CMS_HPT_URL, timeout=30)
         response.raise_for_status()
         content = response.text
         
@@ -47,45 +68,160 @@ def discover_hospitals():
 
 import re
 
-def download_file(url, output_dir, hospital_name):
-    """Downloads the file from the URL to the output directory."""
+# Partial downloads live next to their target until complete, then are renamed into place
+PARTIAL_SUFFIX = ".part"
+
+def raw_filename(hospital_name):
+    # Standardize filename: lower, strip non-alphanumeric, collapse spaces/underscores
+    clean_name = re.sub(r'[^a-z0-9]+', '_', hospital_name.lower()).strip('_')
+    return f"{clean_name}_raw.csv"
+
+def make_session(pool_size=DOWNLOAD_WORKERS):
+    """A pooled session shared by all download workers, with retries for connection-level failures."""
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, connect=3, read=0, backoff_factor=1, status_forcelist=[502, 503, 504], allowed_methods=["GET"]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def load_partial_meta(partial_path):
+    """Validators of the response a partial file was started from, so resuming can send If-Range."""
+    meta_path = partial_path + ".json"
+    if os.path.exists(partial_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    return {}
+
+def discard_partial(partial_path):
+    for path in (partial_path, partial_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def download_file(url, output_dir, hospital_name, previous=None, session=None):
+    """
+    Downloads the file from the URL to the output directory.
+    Skips the transfer when the server reports it unchanged since `previous` (the hospital's manifest entry),
+    and resumes from a leftover partial file with an HTTP Range request when the server allows it.
+    Returns (filepath, filename, source) where source holds the validators and content hash for the manifest.
+    """
+    previous = previous or {}
+    session = session or make_session(1)
     try:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
             
-        # Standardize filename: lower, strip non-alphanumeric, collapse spaces/underscores
-        clean_name = re.sub(r'[^a-z0-9]+', '_', hospital_name.lower()).strip('_')
-        filename = f"{clean_name}_raw.csv"
+        filename = raw_filename(hospital_name)
         filepath = os.path.join(output_dir, filename)
+        partial_path = filepath + PARTIAL_SUFFIX
         
-        print(f">>> [Downloader] Downloading {hospital_name}...")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, stream=True, timeout=60)
-        response.raise_for_status()
-        
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                
-        print(f">>> [Downloader] Saved to {filepath}")
-        return filepath, filename
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            headers = {}
+
+            # Conditional GET against the copy we already have
+            if os.path.exists(filepath) and previous.get("url") == url:
+                if previous.get("etag"):
+                    headers['If-None-Match'] = previous["etag"]
+                if previous.get("last_modified"):
+                    headers['If-Modified-Since'] = previous["last_modified"]
+
+            # Resume a partial download, but only if it is still the same version on the server
+            partial_meta = load_partial_meta(partial_path)
+            offset = os.path.getsize(partial_path) if partial_meta.get("url") == url else 0
+            validator = partial_meta.get("etag") or partial_meta.get("last_modified")
+            if offset and validator:
+                headers['Range'] = f"bytes={offset}-"
+                headers['If-Range'] = validator
+            else:
+                offset = 0
+
+            print(f">>> [Downloader] Downloading {hospital_name}" + (f" (resuming at byte {offset})..." if offset else "..."))
+            with session.get(url, headers=headers, stream=True, timeout=60) as response:
+                if response.status_code == 304:
+                    discard_partial(partial_path)
+                    print(f">>> [Downloader] {hospital_name} not modified, keeping {filepath}")
+                    return filepath, filename, dict(previous, checked_at=datetime.now(timezone.utc).isoformat())
+
+                if response.status_code == 416:
+                    # Our partial is no longer a valid prefix; start over
+                    discard_partial(partial_path)
+                    continue
+
+                response.raise_for_status()
+
+                digest = hashlib.sha256()
+                if response.status_code == 206:
+                    if not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                        discard_partial(partial_path)
+                        continue
+                    # Re-hash what we already have so the manifest hash covers the whole file
+                    with open(partial_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(CHUNK_BYTES), b""):
+                            digest.update(chunk)
+                    mode = 'ab'
+                else:
+                    # Full response: either a fresh download or the file changed since the partial was started
+                    mode = 'wb'
+                    with open(partial_path + ".json", 'w') as f:
+                        json.dump({"url": url, "etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}, f)
+
+                try:
+                    with open(partial_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+                            f.write(chunk)
+                            digest.update(chunk)
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+                    # Keep the partial file; the next attempt (or run) resumes from it
+                    print(f"!!! [Downloader] {hospital_name} interrupted (attempt {attempt}/{DOWNLOAD_ATTEMPTS}): {e}")
+                    continue
+
+                partial_meta = load_partial_meta(partial_path)
+
+            # Only complete files ever appear under the *_raw.csv name
+            os.replace(partial_path, filepath)
+            os.remove(partial_path + ".json")
+
+            stat = os.stat(filepath)
+            source = {
+                "url": url,
+                "etag": partial_meta.get("etag"),
+                "last_modified": partial_meta.get("last_modified"),
+                "sha256": digest.hexdigest(),
+                "bytes": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "downloaded_at": datetime.now(timezone.utc).isoformat(),
+            }
+                    
+            print(f">>> [Downloader] Saved to {filepath}")
+            return filepath, filename, source
+
+        raise RuntimeError(f"gave up after {DOWNLOAD_ATTEMPTS} attempts")
     except Exception as e:
         print(f"!!! [Downloader] Failed for {hospital_name}: {e}")
-        return None, None
+        return None, None, None
 
-def ingest_bronze_emory():
+def timed_download(*args):
+    """download_file plus its wall time, for the run report (downloads share threads, so CPU/RSS aren't per file)."""
+    started = time.perf_counter()
+    result = download_file(*args)
+    return result, round(time.perf_counter() - started, 3)
+
+def ingest_bronze_emory(bronze_output_dir="/app/data/bronze", workers=DOWNLOAD_WORKERS):
     print(">>> [Bronze] Starting Emory Dynamic Discovery Pipeline")
 
     # 1. Define Paths
-    bronze_output_dir = "/app/data/bronze"
     catalog_path = os.path.join(bronze_output_dir, "hospital_catalog.json")
+    manifest_path = os.path.join(bronze_output_dir, MANIFEST_FILENAME)
     os.makedirs(bronze_output_dir, exist_ok=True)
+
+    session = make_session(workers)
     
     # 2. Discover
-    hospitals = discover_hospitals()
+    hospitals = discover_hospitals(session)
     if not hospitals:
         print("!!! [Bronze] No hospitals found. Exiting.")
         sys.exit(1)
@@ -95,32 +231,62 @@ def ingest_bronze_emory():
     success_count = 0
     total_count = len(hospitals)
     
-    # Track current filenames to purge orphans later
-    active_filenames = set()
-
-    # 4. Ingest each hospital
-    for hospital in hospitals:
-        raw_path, raw_filename = download_file(hospital["url"], bronze_output_dir, hospital["name"])
-        if raw_path:
-            success_count += 1
-            catalog_mapping[raw_filename] = hospital["name"]
-            active_filenames.add(raw_filename)
+    # Every listed hospital's file is kept, even if this run's download failed
+    active_filenames = {raw_filename(hospital["name"]) for hospital in hospitals}
+
+    # Per-hospital source metadata; Silver/Gold add their own sections to each entry
+    manifest = load_manifest(manifest_path)
+
+    # Per-hospital metrics for the pipeline's run report
+    report = {"hospitals": {}}
+
+    # 4. Ingest hospitals concurrently over the shared connection pool
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = []
+        for hospital in hospitals:
+            previous = manifest.get(raw_filename(hospital["name"]).replace("_raw.csv", ""))
+            futures.append(pool.submit(timed_download, hospital["url"], bronze_output_dir, hospital["name"], previous, session))
+
+        for hospital, future in zip(hospitals, futures):
+            (raw_path, filename, source), wall_seconds = future.result()
+            hospital_key = raw_filename(hospital["name"]).replace("_raw.csv", "")
+            report["hospitals"][hospital_key] = {
+                "status": "failed" if not raw_path else "not_modified" if "checked_at" in source else "downloaded",
+                "wall_seconds": wall_seconds,
+                "bytes_out": os.path.getsize(raw_path) if raw_path else 0,
+            }
+            if raw_path:
+                success_count += 1
+                manifest.setdefault(filename.replace("_raw.csv", ""), {}).update(source, hospital_name=hospital["name"])
+
+            # A failed download still has its last good file in the catalog
+            filename = raw_filename(hospital["name"])
+            if os.path.exists(os.path.join(bronze_output_dir, filename)):
+                catalog_mapping[filename] = hospital["name"]
             
     # 5. Cleanup Orphans
-    # Delete any *_raw.csv files that are NOT in the current catalog
+    # Delete any *_raw.csv files (and leftover partials) that are NOT in the current catalog
     print(">>> [Bronze] Syncing directory (Cleaning orphans)...")
     all_files = os.listdir(bronze_output_dir)
     for f in all_files:
-        if f.endswith("_raw.csv") and f not in active_filenames:
+        base = f[:-len(".json")] if f.endswith(PARTIAL_SUFFIX + ".json") else f
+        base = base[:-len(PARTIAL_SUFFIX)] if base.endswith(PARTIAL_SUFFIX) else base
+        if base.endswith("_raw.csv") and base not in active_filenames:
             os.remove(os.path.join(bronze_output_dir, f))
             print(f">>> [Bronze] Deleted orphan file: {f}")
 
     # Save the filename -> official name mapping for Silver layer
     with open(catalog_path, 'w') as f:
         json.dump(catalog_mapping, f, indent=4)
+
+    # Keep manifest entries only for files still on disk (a failed download keeps its last good file)
+    on_disk = {f.replace("_raw.csv", "") for f in os.listdir(bronze_output_dir) if f.endswith("_raw.csv")}
+    manifest = {key: entry for key, entry in manifest.items() if key in on_disk}
+    save_manifest(manifest, manifest_path)
         
     print(f">>> [Bronze] Done. Success: {success_count}/{total_count}")
     print(f">>> [Bronze] Catalog saved to {catalog_path}")
+    return report
 
 if __name__ == "__main__":
     ingest_bronze_emory()
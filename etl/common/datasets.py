@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_COMPRESSION = "zstd"
+PARTITION_KEY = "hospital_key"
+
+
+def to_table(df, schema):
+    """Converts a DataFrame to an Arrow table with the given schema (columns in schema order)."""
+    return pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False)
+
+
+def partition_path(dataset_dir, hospital_key):
+    return os.path.join(dataset_dir, f"{PARTITION_KEY}={hospital_key}", "part-0.parquet")
+
+
+def list_partitions(dataset_dir):
+    """Returns {hospital_key: parquet path} for a hospital-partitioned dataset, in key order."""
+    partitions = {}
+    if not os.path.isdir(dataset_dir):
+        return partitions
+    for name in sorted(os.listdir(dataset_dir)):
+        if name.startswith(f"{PARTITION_KEY}="):
+            path = os.path.join(dataset_dir, name, "part-0.parquet")
+            if os.path.exists(path):
+                partitions[name.split("=", 1)[1]] = path
+    return partitions
+
+
+def publish_dataset(staging_dir, dataset_dir):
+    """
+    Swaps a fully written staging directory into place.
+    Readers see either the old dataset or the new one, never a half-written mix.
+    """
+    old_dir = dataset_dir + ".old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(dataset_dir):
+        os.rename(dataset_dir, old_dir)
+    os.rename(staging_dir, dataset_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def export_csv(parquet_paths, csv_path):
+    """Optional CSV side output, streamed one row group at a time."""
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as out:
+        header = True
+        for path in parquet_paths:
+            for batch in pq.ParquetFile(path).iter_batches():
+                batch.to_pandas().to_csv(out, index=False, header=header)
+                header = False
+    os.replace(tmp_path, csv_path)
+
+
+def carry_over_partition(src_path, dst_path):
+    """Reuses an unchanged partition in a new dataset build (hard link, or a copy across filesystems)."""
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
@@ -0,0 +1,51 @@
+import os
+import json
+import hashlib
+
+# Lives next to hospital_catalog.json in the Bronze directory, keyed by hospital_key
+MANIFEST_FILENAME = "hospital_manifest.json"
+
+# Rebuild every hospital regardless of what the manifest says
+FULL_REFRESH = os.getenv("ETL_FULL_REFRESH", "0") == "1"
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """Writes the manifest atomically so a crashed run never leaves it half-written."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_sha256(path, entry):
+    """
+    Content hash of a Bronze file, reusing the one recorded in `entry` while size and mtime still match.
+    Updates `entry` in place when the file has to be re-hashed.
+    """
+    stat = os.stat(path)
+    if entry.get("sha256") and entry.get("bytes") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return entry["sha256"]
+    entry["sha256"] = file_sha256(path)
+    entry["bytes"] = stat.st_size
+    entry["mtime_ns"] = stat.st_mtime_ns
+    return entry["sha256"]
+
+
+def fingerprint(*parts):
+    """Stable hash of a stage's inputs (source hashes, names, format versions)."""
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
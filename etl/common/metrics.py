@@ -0,0 +1,85 @@
+"""
+Wall time, CPU time and peak memory of a block of work, for the pipeline's run report.
+
+Peak RSS is the kernel's high-water mark (VmHWM), reset at the start of each measured block where
+Linux allows it (/proc/self/clear_refs), so a stage's peak is its own rather than the process's so far.
+Measurements may nest or overlap (a stage and its hospitals, concurrent stages): resetting the
+mark first folds it into every measurement still running, so none of them loses its peak.
+"""
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+_active = []
+_lock = threading.Lock()
+
+
+def _high_water_mark():
+    """Peak RSS of this process in bytes since the last reset."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux and never resets
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_high_water_mark():
+    with _lock:
+        current = _high_water_mark()
+        for stats in _active:
+            stats["_peak"] = max(stats["_peak"], current)
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def cpu_seconds():
+    """User + system CPU of this process and its finished child processes."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def path_bytes(*paths):
+    """Total size of files and directory trees (missing paths count as 0)."""
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+@contextmanager
+def measure():
+    """
+    Yields a dict that, when the block exits, holds wall_seconds, cpu_seconds and peak_rss_mb.
+    Callers may add their own counts (rows, bytes) to it.
+    """
+    stats = {"_peak": 0}
+    _reset_high_water_mark()
+    with _lock:
+        _active.append(stats)
+    started_wall, started_cpu = time.perf_counter(), cpu_seconds()
+    try:
+        yield stats
+    finally:
+        with _lock:
+            # By identity: two measurements' dicts may well compare equal
+            _active[:] = [active for active in _active if active is not stats]
+            peak = max(stats.pop("_peak"), _high_water_mark())
+        stats.update(
+            wall_seconds=round(time.perf_counter() - started_wall, 3),
+            cpu_seconds=round(cpu_seconds() - started_cpu, 3),
+            peak_rss_mb=round(peak / 2**20, 1),
+        )
@@ -0,0 +1,112 @@
+"""
+Column types shared by the Silver, Gold and loader stages.
+
+Repeated text (hospital, payer, plan, setting, codes, procedure names) is dictionary-encoded in
+Parquet and read back as pandas categoricals. Categories are kept sorted, so grouping and sorting on
+the integer codes orders rows exactly like the plain strings would.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Repeated text: a Parquet dictionary on disk, a categorical in memory
+TEXT = pa.dictionary(pa.int32(), pa.string())
+
+# Dollar amounts stay float64; float32's ~7 significant digits would drop the cents above $100k
+RATE = pa.float64()
+
+SILVER_SCHEMA = pa.schema([
+    ('hospital_name', TEXT),
+    ('address', TEXT),
+    ('effective_date', pa.date32()),
+    ('billing_code_type', TEXT),
+    ('billing_code', TEXT),
+    ('description', TEXT),
+    ('billing_class', TEXT),
+    ('setting', TEXT),
+    ('payer', TEXT),
+    ('plan', TEXT),
+    ('min_negotiated_rate', RATE),
+    ('max_negotiated_rate', RATE),
+    ('estimated_amount', RATE),
+    ('level', TEXT),
+    ('procedure_type', TEXT),
+])
+
+GROUP_KEYS = ['hospital_name', 'billing_code', 'billing_code_type', 'procedure_type', 'setting', 'payer', 'plan']
+
+GOLD_SCHEMA = pa.schema(
+    [(key, TEXT) for key in GROUP_KEYS] + [
+        ('min_rate', RATE),
+        ('max_rate', RATE),
+        ('median_rate', RATE),
+        ('record_count', pa.int64()),
+    ]
+)
+
+GOLD_SKETCH_SCHEMA = pa.schema(
+    list(GOLD_SCHEMA) + [
+        ('p10_rate', RATE),
+        ('p90_rate', RATE),
+        ('rate_sketch', pa.binary()),
+    ]
+)
+
+SQL_TYPES = {
+    pa.float64(): 'DOUBLE PRECISION',
+    pa.float32(): 'REAL',
+    pa.int64(): 'BIGINT',
+    pa.int32(): 'INTEGER',
+    pa.date32(): 'DATE',
+    pa.binary(): 'BYTEA',
+}
+
+
+def is_text(arrow_type):
+    return pa.types.is_string(arrow_type) or (pa.types.is_dictionary(arrow_type) and pa.types.is_string(arrow_type.value_type))
+
+
+def sql_type(arrow_type):
+    """Postgres column type for an Arrow type; text (plain or dictionary) is TEXT."""
+    return 'TEXT' if is_text(arrow_type) else SQL_TYPES[arrow_type]
+
+
+def sort_categories(df):
+    """Sorts every categorical's categories in place (Parquet dictionaries come back in first-seen order)."""
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            categories = df[column].cat.categories
+            if not categories.is_monotonic_increasing:
+                df[column] = df[column].cat.reorder_categories(categories.sort_values())
+    return df
+
+
+def to_frame(table, schema=None):
+    """
+    Arrow table -> DataFrame with the declared types enforced: columns present in `schema` are cast to
+    it first (so files written before a column became a dictionary read the same), text comes back as
+    categoricals with sorted categories.
+    """
+    if schema is not None:
+        fields = [schema.field(name) if name in schema.names else table.schema.field(name) for name in table.column_names]
+        table = table.cast(pa.schema(fields))
+    return sort_categories(table.to_pandas())
+
+
+def read_frame(path, schema, columns=None):
+    """Reads a Parquet file into a DataFrame with `schema`'s types (see to_frame)."""
+    return to_frame(pq.read_table(path, columns=columns), schema)
+
+
+def fill_text(series, value):
+    """fillna for a text column, adding `value` as a (sorted) category when the column is categorical."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        if value not in series.cat.categories:
+            series = series.cat.set_categories(series.cat.categories.append(pd.Index([value])).sort_values())
+    return series.fillna(value)
+
+
+def constant(value, length):
+    """A column holding one value on every row, as a single-category categorical."""
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[value])
@@ -0,0 +1,130 @@
+"""
+Mergeable approximate quantiles (a DDSketch-style log-bucketed histogram), vectorized over groups.
+
+A value's bucket id depends only on the value, so sketches of disjoint row sets merge by adding the
+counts of equal bucket ids. Quantiles read back from merged counts interpolate between the two
+neighbouring ranks like percentile_cont, so they are within RELATIVE_ACCURACY of the exact quantile
+(when those two values share a sign). Sketches are kept in long form -- one (group, bucket id, count) row per
+non-empty bucket -- so building and merging them is a pandas groupby.
+"""
+import struct
+
+import numpy as np
+
+# Relative accuracy of every quantile read back (DDSketch's alpha); changing it invalidates stored buckets
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = np.log(GAMMA)
+
+# Magnitudes below this share the zero bucket
+MIN_MAGNITUDE = 1e-9
+
+# Bucket id 0 is the zero bucket; positive values map above _OFFSET and negative values below -_OFFSET,
+# so bucket ids sort in the same order as the values they hold
+_OFFSET = 1 << 20
+
+
+def bucket_ids(values):
+    """Bucket id of each (non-NaN) value."""
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    keys = np.ceil(np.log(np.maximum(magnitude, MIN_MAGNITUDE)) / _LOG_GAMMA).astype(np.int64)
+    ids = np.where(magnitude < MIN_MAGNITUDE, 0, np.sign(values).astype(np.int64) * (keys + _OFFSET))
+    return ids.astype(np.int32)
+
+
+def bucket_values(ids):
+    """The value a bucket reports: the point within RELATIVE_ACCURACY of everything in it."""
+    ids = np.asarray(ids, dtype=np.int64)
+    keys = np.abs(ids) - _OFFSET
+    with np.errstate(over="ignore", under="ignore"):
+        values = np.sign(ids) * 2 * np.power(GAMMA, keys.astype(np.float64)) / (GAMMA + 1)
+    return np.where(ids == 0, 0.0, values)
+
+
+def grouped_buckets(groups, values):
+    """Long-form buckets (groups, bucket ids, counts) of the non-NaN values, sorted by (group, bucket id)."""
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    # Pack (group, bucket id shifted to unsigned) into one int64 so a single unique() sorts and counts
+    packed = (np.asarray(groups, dtype=np.int64)[present] << 32) | (bucket_ids(values[present]).astype(np.int64) + (1 << 31))
+    packed, counts = np.unique(packed, return_counts=True)
+    return packed >> 32, ((packed & 0xFFFFFFFF) - (1 << 31)).astype(np.int32), counts
+
+
+def grouped_quantile(groups, ids, counts, q, n_groups):
+    """
+    q-quantile of each group from long-form buckets sorted by (group, bucket id), interpolated between
+    the values at ranks floor and ceil of q * (n - 1) like percentile_cont / Series.quantile.
+    groups are integer codes in [0, n_groups); groups without any count come back NaN.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    result = np.full(n_groups, np.nan)
+    if not len(groups):
+        return result
+
+    totals = np.bincount(groups, weights=counts, minlength=n_groups).astype(np.int64)
+    before = np.cumsum(totals) - totals
+    running = np.cumsum(counts)
+    present = np.flatnonzero(totals)
+
+    # The value at rank k of a group is in the first of its buckets whose running count passes k
+    rank = q * (totals[present] - 1)
+    lower, upper = np.floor(rank).astype(np.int64), np.ceil(rank).astype(np.int64)
+    ids = np.asarray(ids)
+    low = bucket_values(ids[np.searchsorted(running, before[present] + lower, side="right")])
+    high = bucket_values(ids[np.searchsorted(running, before[present] + upper, side="right")])
+    result[present] = low + (rank - lower) * (high - low)
+    return result
+
+
+# Serialized form: version, accuracy and bucket count, then bucket ids (int32) and counts (uint32)
+_HEADER = struct.Struct("<BfI")
+_FORMAT_VERSION = 1
+
+
+def serialize(ids, counts):
+    """One sketch's buckets (ids ascending) as bytes, for storing in a binary column."""
+    ids = np.asarray(ids, dtype=np.int32)
+    return _HEADER.pack(_FORMAT_VERSION, RELATIVE_ACCURACY, len(ids)) + ids.tobytes() + np.asarray(counts, dtype=np.uint32).tobytes()
+
+
+def deserialize(blob):
+    """(bucket ids, counts) from serialize()."""
+    version, accuracy, n = _HEADER.unpack_from(blob)
+    if version != _FORMAT_VERSION or not np.isclose(accuracy, RELATIVE_ACCURACY):
+        raise ValueError(f"Sketch was written with format {version} / accuracy {accuracy}, expected {_FORMAT_VERSION} / {RELATIVE_ACCURACY}")
+    ids = np.frombuffer(blob, dtype=np.int32, count=n, offset=_HEADER.size)
+    counts = np.frombuffer(blob, dtype=np.uint32, count=n, offset=_HEADER.size + 4 * n)
+    return ids, counts.astype(np.int64)
+
+
+def grouped_serialize(groups, ids, counts, n_groups):
+    """serialize() per group from long-form buckets sorted by (group, bucket id); empty groups get None."""
+    groups = np.asarray(groups, dtype=np.int64)
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+    ids = np.asarray(ids, dtype=np.int32)
+    counts = np.asarray(counts, dtype=np.uint32)
+    return [
+        serialize(ids[start:end], counts[start:end]) if end > start else None
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())
+    ]
+
+
+def merge(blobs):
+    """Merges serialized sketches (None entries are skipped) into one."""
+    parts = [deserialize(blob) for blob in blobs if blob is not None]
+    if not parts:
+        return None
+    ids, inverse = np.unique(np.concatenate([part[0] for part in parts]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([part[1] for part in parts])).astype(np.int64)
+    return serialize(ids, counts)
+
+
+def quantile(blob, q):
+    """q-quantile of a serialized sketch (NaN for None)."""
+    if blob is None:
+        return np.nan
+    ids, counts = deserialize(blob)
+    return grouped_quantile(np.zeros(len(ids), dtype=np.int64), ids, counts, q, 1)[0]
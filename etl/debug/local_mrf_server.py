@@ -0,0 +1,114 @@
+"""
+Local stand-in for a health system's MRF host, for exercising the Bronze downloader offline.
+
+Serves every *.csv in a directory plus a generated cms-hpt.txt index, with ETag/Last-Modified,
+conditional GETs and Range/If-Range support. --fail-after N drops the first response for each
+file after N bytes so resumption can be tested.
+
+    python etl/debug/local_mrf_server.py /path/to/mrfs --port 8765 --fail-after 100000
+    EMORY_CMS_HPT_URL=http://localhost:8765/cms-hpt.txt python etl/bronze/bronze_emory.py
+"""
+import os
+import argparse
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def make_handler(root, fail_after):
+    failed_once = set()
+
+    class MRFHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = self.path.lstrip("/")
+            if name == "cms-hpt.txt":
+                return self.send_index()
+
+            path = os.path.join(root, os.path.basename(name))
+            if not os.path.isfile(path):
+                return self.send_error(404)
+
+            stat = os.stat(path)
+            etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+            last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+            if self.not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            start = 0
+            range_header = self.headers.get("Range")
+            if_range = self.headers.get("If-Range")
+            if range_header and range_header.startswith("bytes=") and if_range in (None, etag, last_modified):
+                start = int(range_header[len("bytes="):].split("-")[0])
+                if start >= stat.st_size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                    self.end_headers()
+                    return
+
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Length", str(stat.st_size - start))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Accept-Ranges", "bytes")
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{stat.st_size - 1}/{stat.st_size}")
+            self.end_headers()
+
+            with open(path, 'rb') as f:
+                f.seek(start)
+                limit = None
+                if fail_after and path not in failed_once:
+                    failed_once.add(path)
+                    limit = fail_after
+                sent = 0
+                for chunk in iter(lambda: f.read(64 * 1024), b""):
+                    if limit is not None and sent + len(chunk) > limit:
+                        self.wfile.write(chunk[:limit - sent])
+                        self.close_connection = True
+                        return
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+
+        def not_modified(self, etag, mtime):
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None:
+                return if_none_match == etag
+            if_modified_since = self.headers.get("If-Modified-Since")
+            if if_modified_since:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            return False
+
+        def send_index(self):
+            host = self.headers.get("Host")
+            lines = []
+            for name in sorted(os.listdir(root)):
+                if name.endswith(".csv"):
+                    lines.append(f"location-name: {os.path.splitext(name)[0].replace('_', ' ').title()}")
+                    lines.append(f"mrf-url: http://{host}/{name}")
+                    lines.append("")
+            body = "\n".join(lines).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MRFHandler
+
+
+def serve(root, port=8765, fail_after=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(root, fail_after))
+    print(f">>> [Stand-in] Serving {root} at http://127.0.0.1:{server.server_port}/cms-hpt.txt")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="Directory of MRF CSVs to serve")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-after", type=int, default=0, help="Drop each file's first response after this many bytes")
+    args = parser.parse_args()
+    serve(args.root, args.port, args.fail_after)
@@ -1,52 +1,386 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
 import sys
+import json
+import shutil
+import tempfile
+import numpy as np
+import pyarrow.dataset as ds
 
-def create_gold_layer():
+# Allow running as a script (python etl/gold/gold_emory.py) as well as a module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.datasets import PARQUET_COMPRESSION, to_table, partition_path, list_partitions, publish_dataset, export_csv, carry_over_partition
+from common.manifest import FULL_REFRESH, load_manifest, save_manifest, file_sha256, fingerprint
+from common.sketch import RELATIVE_ACCURACY, bucket_ids, grouped_buckets, grouped_quantile, grouped_serialize
+from common.metrics import measure, path_bytes
+from common.schema import TEXT, GROUP_KEYS, SILVER_SCHEMA, GOLD_SCHEMA, GOLD_SKETCH_SCHEMA, to_frame, read_frame, fill_text
+
+# Also write the combined emory_gold.csv next to the Parquet dataset
+WRITE_CSV = os.getenv("GOLD_WRITE_CSV", "0") == "1"
+
+# Bump when aggregate_silver's output changes so incremental runs rebuild every hospital
+GOLD_FORMAT_VERSION = "2"
+
+# Memory a hospital's aggregation may use. Larger Silver partitions are range-partitioned on their
+# leading group keys into spill files on disk and aggregated one spill partition at a time.
+MEMORY_BUDGET_MB = int(os.getenv("GOLD_MEMORY_BUDGET_MB", "2048"))
+
+# Peak memory of aggregating a DataFrame, as a multiple of the DataFrame's own size
+AGGREGATE_OVERHEAD = 6
+
+# Where spill partitions are written (default: a temporary directory inside the Gold output directory)
+SPILL_DIR = os.getenv("GOLD_SPILL_DIR")
+
+# Upper bound on spill partitions (each holds an open Parquet writer while spilling)
+MAX_SPILL_PARTITIONS = 256
+
+# Spill files are written once and read once, so favour speed over size
+SPILL_COMPRESSION = "lz4"
+
+# Store a mergeable quantile sketch of estimated_amount per Gold group (rate_sketch) and derive
+# median_rate, p10_rate and p90_rate from it, instead of the exact median
+SKETCH = os.getenv("GOLD_SKETCH", "0") == "1"
+
+# Quantile columns derived from a sketch
+SKETCH_QUANTILES = {'p10_rate': 0.1, 'median_rate': 0.5, 'p90_rate': 0.9}
+
+# Only the Silver columns the aggregation touches are read back
+SILVER_COLUMNS = GROUP_KEYS + ['min_negotiated_rate', 'max_negotiated_rate', 'estimated_amount']
+
+SPILL_SCHEMA = pa.schema([SILVER_SCHEMA.field(column) for column in SILVER_COLUMNS])
+
+# Grouping sets pre-aggregated into the rollup cube: name -> key columns (a subset of GROUP_KEYS).
+# Override with GOLD_ROLLUPS='{"name": ["column", ...], ...}'; {} turns the cube off.
+DEFAULT_ROLLUPS = {
+    "code_setting": ['billing_code', 'setting'],
+    "code_setting_payer": ['billing_code', 'setting', 'payer'],
+    "code_setting_hospital": ['billing_code', 'setting', 'hospital_name'],
+    "procedure_hospital": ['procedure_type', 'hospital_name'],
+}
+ROLLUPS = json.loads(os.getenv("GOLD_ROLLUPS") or "null")
+if ROLLUPS is None:
+    ROLLUPS = DEFAULT_ROLLUPS
+
+
+def aggregate_silver(df, sketch=SKETCH):
+    """
+    Aggregates Silver rows to the Gold grain. Returns (summary, rows dropped for having no rate data).
+    With `sketch`, quantiles come from a per-group sketch (see GOLD_SKETCH_SCHEMA) instead of an exact median.
+    """
+    # 2. Fill Payer for Grouping
+    df['payer'] = fill_text(df['payer'], "Self-Pay / Not Specified")
+    df['plan'] = fill_text(df['plan'], "Standard")
+    df['billing_code_type'] = fill_text(df['billing_code_type'], "Unknown")
+
+    # 3. Aggregation
+    # We group by Hospital, Code, and Payer/Plan to see the range for each insurance
+    grouped = df.groupby(GROUP_KEYS, observed=True)
+    aggregations = dict(
+        min_rate=('min_negotiated_rate', 'min'),
+        max_rate=('max_negotiated_rate', 'max'),
+        record_count=('billing_code', 'count')
+    )
+    if not sketch:
+        aggregations['median_rate'] = ('estimated_amount', 'median')
+    summary = grouped.agg(**aggregations).reset_index()
+
+    if sketch:
+        # ngroup numbers groups in summary's (sorted) row order; rows with a null key are NaN and dropped
+        groups = grouped.ngroup().to_numpy()
+        keyed = ~np.isnan(groups)
+        bucket_groups, ids, counts = grouped_buckets(groups[keyed].astype(np.int64), df['estimated_amount'].to_numpy(dtype=np.float64)[keyed])
+        for column, q in SKETCH_QUANTILES.items():
+            summary[column] = grouped_quantile(bucket_groups, ids, counts, q, len(summary))
+        summary['rate_sketch'] = grouped_serialize(bucket_groups, ids, counts, len(summary))
+
+    # 4. Filter out rows where we have absolutely no negotiated data
+    initial_len = len(summary)
+    summary = summary.dropna(subset=['min_rate', 'max_rate', 'median_rate'], how='all')
+    return summary, initial_len - len(summary)
+
+
+def rollup_schema(keys, partial):
+    """
+    Partial (per-hospital) rollups are long-form: a stats row per group (bucket null) carrying the record
+    count and min/max, then one row per non-empty rate sketch bucket carrying its count.
+    Merged rollups are one row per group.
+    """
+    fields = [(key, TEXT) for key in keys]
+    if partial:
+        fields += [('bucket', pa.int32()), ('count', pa.int64()), ('min_rate', pa.float64()), ('max_rate', pa.float64())]
+    else:
+        fields += [('record_count', pa.int64()), ('min_rate', pa.float64()), ('max_rate', pa.float64())]
+        fields += [(column, pa.float64()) for column in SKETCH_QUANTILES]
+    return pa.schema(fields)
+
+
+def partial_rollup(df, keys):
+    """One hospital's contribution to a rollup, from its filled Silver rows (see rollup_schema)."""
+    grouped = df.groupby(keys, observed=True)
+    stats = grouped.agg(
+        count=('billing_code', 'count'),
+        min_rate=('min_negotiated_rate', 'min'),
+        max_rate=('max_negotiated_rate', 'max'),
+    ).reset_index()
+    stats['bucket'] = pd.array([pd.NA] * len(stats), dtype='Int32')
+
+    # The rate sketch covers the same values as Gold's median_rate
+    rated = df.loc[df['estimated_amount'].notna(), keys]
+    rated['bucket'] = bucket_ids(df.loc[rated.index, 'estimated_amount'])
+    buckets = rated.groupby(keys + ['bucket'], observed=True).size().rename('count').reset_index()
+    return pd.concat([stats, buckets], ignore_index=True)
+
+
+def range_keys(df):
+    """
+    Spill partitioning key: hospital_name then billing_code, the leading group keys. Partitioning on a
+    prefix of the sort order keeps every group in one partition and the partitions themselves in order.
+    """
+    return (df['hospital_name'].astype(object).fillna('') + '\0' + df['billing_code'].astype(object).fillna('')).to_numpy(dtype=object)
+
+
+def spill_boundaries(parquet_file, n_partitions, batch_rows):
+    """First range key of each spill partition after the first, splitting the rows as evenly as whole keys allow."""
+    counts = None
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=['hospital_name', 'billing_code']):
+        batch_counts = pd.Series(range_keys(to_frame(pa.Table.from_batches([batch])))).value_counts()
+        counts = batch_counts if counts is None else counts.add(batch_counts, fill_value=0)
+    counts = counts.sort_index()
+    cumulative = counts.cumsum().to_numpy()
+    targets = cumulative[-1] * np.arange(1, n_partitions) / n_partitions
+    return np.unique(counts.index.to_numpy(dtype=object)[np.minimum(np.searchsorted(cumulative, targets, side='right'), len(counts) - 1)])
+
+
+def spill_partitions(parquet_file, boundaries, spill_dir, batch_rows):
+    """
+    Streams a Silver partition into one spill file per key range. Returns the non-empty spill files' paths
+    in key order.
+    """
+    paths = [os.path.join(spill_dir, f"spill-{i}.parquet") for i in range(len(boundaries) + 1)]
+    writers = {}
+    try:
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=SILVER_COLUMNS):
+            df = to_frame(pa.Table.from_batches([batch]), SPILL_SCHEMA)
+            targets = np.searchsorted(boundaries, range_keys(df), side='right')
+            order = np.argsort(targets, kind='stable')
+            bounds = np.searchsorted(targets[order], np.arange(len(paths) + 1))
+            for i in np.flatnonzero(np.diff(bounds)).tolist():
+                if i not in writers:
+                    writers[i] = pq.ParquetWriter(paths[i], SPILL_SCHEMA, compression=SPILL_COMPRESSION)
+                writers[i].write_table(to_table(df.iloc[order[bounds[i]:bounds[i + 1]]], SPILL_SCHEMA))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [path for i, path in enumerate(paths) if i in writers]
+
+
+def remove_outputs(paths):
+    for path in paths:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+def aggregate_partition(silver_path, part_path, partial_paths, rollups, gold_schema, sketch=SKETCH,
+                        memory_budget_mb=MEMORY_BUDGET_MB, spill_dir=None):
+    """
+    Aggregates one hospital's Silver partition into its Gold part and partial rollups (`partial_paths`,
+    by rollup name). Returns (rows read, summary rows written, summary rows filtered); nothing is written
+    when no summary rows are produced.
+
+    A partition whose estimated aggregation footprint exceeds the memory budget is range-partitioned on
+    its leading group keys into spill files, which are aggregated and written one at a time. Each Gold
+    group falls whole in one spill partition and the partitions come out in key order, so the Gold part
+    is identical to aggregating in one go; the partial rollups may list a group once per spill partition,
+    which merge_rollup adds up like any other partials.
+    """
+    parquet_file = pq.ParquetFile(silver_path)
+    n_rows = parquet_file.metadata.num_rows
+    sample = next(parquet_file.iter_batches(batch_size=10_000, columns=SILVER_COLUMNS), None)
+    row_bytes = to_frame(pa.Table.from_batches([sample]), SPILL_SCHEMA).memory_usage(deep=True).sum() / sample.num_rows if sample is not None and sample.num_rows else 0
+    budget_rows = max(int(memory_budget_mb * 2**20 / (row_bytes * AGGREGATE_OVERHEAD)), 1_000) if row_bytes else n_rows
+    n_partitions = min(-(-n_rows // budget_rows), MAX_SPILL_PARTITIONS) if memory_budget_mb > 0 else 1
+
+    work_dir = None
+    if n_partitions > 1:
+        print(f">>> [Gold] {n_rows} rows exceed the {memory_budget_mb} MB budget; aggregating in {n_partitions} spilled partitions")
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix="gold-spill-", dir=spill_dir)
+
+    writers = {}
+    summary_rows = filtered = 0
+    try:
+        if work_dir is None:
+            chunks = [silver_path]
+        else:
+            boundaries = spill_boundaries(parquet_file, n_partitions, budget_rows)
+            chunks = spill_partitions(parquet_file, boundaries, work_dir, budget_rows)
+
+        for chunk_path in chunks:
+            df = read_frame(chunk_path, SPILL_SCHEMA, columns=SILVER_COLUMNS)
+            if work_dir is not None:
+                os.remove(chunk_path)
+            summary, dropped = aggregate_silver(df, sketch)
+            filtered += dropped
+            outputs = {part_path: to_table(summary, gold_schema)} if not summary.empty else {}
+            # aggregate_silver filled the key columns in place, so rollups group exactly like Gold
+            for name, keys in rollups.items():
+                outputs[partial_paths[name]] = to_table(partial_rollup(df, keys), rollup_schema(keys, partial=True))
+            for path, output in outputs.items():
+                if path not in writers:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writers[path] = pq.ParquetWriter(path, output.schema, compression=PARQUET_COMPRESSION)
+                writers[path].write_table(output)
+            summary_rows += len(summary)
+            del df, summary, outputs
+    except Exception:
+        for writer in writers.values():
+            writer.close()
+        remove_outputs(writers)
+        raise
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for writer in writers.values():
+        writer.close()
+    if not summary_rows:
+        # Hospitals without Gold rows contribute no partials either
+        remove_outputs(writers)
+    return n_rows, summary_rows, filtered
+
+
+def merge_rollup(partials_dir, keys):
+    """Merges every hospital's partial rollup: counts add, min/max combine, sketch bucket counts add."""
+    df = to_frame(ds.dataset(partials_dir, format="parquet", partitioning="hive").to_table(
+        columns=keys + ['bucket', 'count', 'min_rate', 'max_rate']), rollup_schema(keys, partial=True))
+    is_stats = df['bucket'].isna()
+
+    summary = df[is_stats].groupby(keys, observed=True).agg(
+        record_count=('count', 'sum'),
+        min_rate=('min_rate', 'min'),
+        max_rate=('max_rate', 'max'),
+    ).reset_index()
+
+    buckets = df[~is_stats].groupby(keys + ['bucket'], observed=True)['count'].sum().reset_index()
+    # Both sides are sorted by the keys, so these codes ascend as grouped_quantile needs
+    codes = pd.MultiIndex.from_frame(summary[keys]).get_indexer(pd.MultiIndex.from_frame(buckets[keys]))
+    for column, q in SKETCH_QUANTILES.items():
+        summary[column] = grouped_quantile(codes, buckets['bucket'].to_numpy(), buckets['count'].to_numpy(), q, len(summary))
+
+    # Same rule as Gold: drop groups with no rate data at all
+    return summary.dropna(subset=['min_rate', 'max_rate', 'median_rate'], how='all')
+
+
+def create_gold_layer(silver_dataset_dir="/app/data/silver/emory_silver", gold_output_dir="/app/data/gold", write_csv=WRITE_CSV,
+                      manifest_path="/app/data/bronze/hospital_manifest.json", full_refresh=FULL_REFRESH, rollups=ROLLUPS,
+                      sketch=SKETCH, memory_budget_mb=MEMORY_BUDGET_MB, spill_dir=SPILL_DIR):
     print(">>> [Gold] Starting Gold Layer Aggregation...")
-    
-    silver_path = "/app/data/silver/emory_all_cleaned.csv"
-    gold_output_dir = "/app/data/gold"
-    gold_output_file = os.path.join(gold_output_dir, "emory_gold.csv")
-    
+
+    gold_dataset_dir = os.path.join(gold_output_dir, "emory_gold")
+    gold_csv_file = os.path.join(gold_output_dir, "emory_gold.csv")
+    staging_dir = gold_dataset_dir + ".tmp"
+    # Per-hospital partial rollups (carried over like Gold partitions) and the merged cube the loader reads
+    partials_dir = os.path.join(gold_output_dir, "emory_rollup_partials")
+    partials_staging_dir = partials_dir + ".tmp"
+    rollups_dir = os.path.join(gold_output_dir, "emory_rollups")
+    rollups_staging_dir = rollups_dir + ".tmp"
+    spill_dir = spill_dir or os.path.join(gold_output_dir, "spill")
+
     os.makedirs(gold_output_dir, exist_ok=True)
-    
+
     try:
         # 1. Read Silver Data
-        if not os.path.exists(silver_path):
-            print(f"!!! [Gold] Silver file not found: {silver_path}")
+        partitions = list_partitions(silver_dataset_dir)
+        if not partitions:
+            print(f"!!! [Gold] Silver dataset not found: {silver_dataset_dir}")
             return
 
-        df = pd.read_csv(silver_path, low_memory=False)
-        print(f">>> [Gold] Read {len(df)} rows from {silver_path}")
-        
-        # 2. Fill Payer for Grouping
-        df['payer'] = df['payer'].fillna("Self-Pay / Not Specified")
-        df['plan'] = df['plan'].fillna("Standard")
-        if 'billing_code_type' not in df.columns:
-            df['billing_code_type'] = 'Unknown'
-        else:
-            df['billing_code_type'] = df['billing_code_type'].fillna("Unknown")
-
-        # 3. Aggregation
-        # We group by Hospital, Code, and Payer/Plan to see the range for each insurance
-        summary = df.groupby(['hospital_name', 'billing_code', 'billing_code_type', 'procedure_type', 'setting', 'payer', 'plan']).agg(
-            min_rate=('min_negotiated_rate', 'min'),
-            max_rate=('max_negotiated_rate', 'max'),
-            median_rate=('estimated_amount', 'median'),
-            record_count=('billing_code', 'count')
-        ).reset_index()
-
-        # 4. Filter out rows where we have absolutely no negotiated data
-        initial_len = len(summary)
-        summary = summary.dropna(subset=['min_rate', 'max_rate', 'median_rate'], how='all')
-        print(f">>> [Gold] Filtered out {initial_len - len(summary)} summary rows with zero rate data.")
+        for name, keys in rollups.items():
+            if not keys or not set(keys) <= set(GROUP_KEYS):
+                raise ValueError(f"Rollup {name} must group by a subset of {GROUP_KEYS}, got {keys}")
+
+        for path in (staging_dir, partials_staging_dir, rollups_staging_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+        manifest = load_manifest(manifest_path)
+        existing_partitions = list_partitions(gold_dataset_dir)
+        existing_partials = {name: list_partitions(os.path.join(partials_dir, name)) for name in rollups}
+        # Changing the grouping sets or the sketch accuracy rebuilds every hospital
+        rollups_fingerprint = fingerprint(json.dumps(rollups, sort_keys=True), str(RELATIVE_ACCURACY))
+        gold_schema = GOLD_SKETCH_SCHEMA if sketch else GOLD_SCHEMA
+
+        # Every group key includes hospital_name, so each hospital partition aggregates on its own
+        rebuilt = 0
+        total_rows = total_summary = total_filtered = 0
+        # Per-hospital metrics for the pipeline's run report
+        report = {"rows_in": 0, "rows_out": 0, "hospitals": {}}
+        for hospital_key, silver_path in partitions.items():
+            part_path = partition_path(staging_dir, hospital_key)
+
+            # Skip hospitals whose Silver partition hasn't changed since the last Gold build
+            entry = manifest.setdefault(hospital_key, {})
+            silver_fingerprint = entry.get("silver", {}).get("fingerprint") or file_sha256(silver_path)
+            gold_fingerprint = fingerprint(silver_fingerprint, GOLD_FORMAT_VERSION, rollups_fingerprint, sketch)
+            previous = entry.get("gold", {})
+            outputs_exist = hospital_key in existing_partitions and all(hospital_key in existing_partials[name] for name in rollups)
+            if not full_refresh and previous.get("fingerprint") == gold_fingerprint and (outputs_exist or not previous.get("rows")):
+                if previous.get("rows"):
+                    carry_over_partition(existing_partitions[hospital_key], part_path)
+                    for name in rollups:
+                        carry_over_partition(existing_partials[name][hospital_key],
+                                             partition_path(os.path.join(partials_staging_dir, name), hospital_key))
+                    total_summary += previous["rows"]
+                report["hospitals"][hospital_key] = {"status": "reused", "rows_out": previous.get("rows", 0)}
+                continue
+
+            rebuilt += 1
+            partial_paths = {name: partition_path(os.path.join(partials_staging_dir, name), hospital_key) for name in rollups}
+            with measure() as metrics:
+                rows, summary_rows, filtered = aggregate_partition(silver_path, part_path, partial_paths, rollups, gold_schema,
+                                                                   sketch, memory_budget_mb, spill_dir)
+            report["hospitals"][hospital_key] = dict(metrics, status="rebuilt", rows_in=rows, rows_out=summary_rows,
+                                                     bytes_in=path_bytes(silver_path), bytes_out=path_bytes(part_path, *partial_paths.values()))
+            total_rows += rows
+            total_filtered += filtered
+            total_summary += summary_rows
+            entry["gold"] = {"fingerprint": gold_fingerprint, "rows": summary_rows}
+
+        print(f">>> [Gold] Rebuilt {rebuilt} of {len(partitions)} hospitals; read {total_rows} rows from {silver_dataset_dir}")
+        print(f">>> [Gold] Filtered out {total_filtered} summary rows with zero rate data.")
+        report.update(rows_in=total_rows, rows_out=total_summary)
 
         # 5. Output
-        print(f">>> [Gold] Writing {len(summary)} summary rows to {gold_output_file}")
-        summary.to_csv(gold_output_file, index=False)
+        if not total_summary:
+            for path in (staging_dir, partials_staging_dir):
+                shutil.rmtree(path, ignore_errors=True)
+            print("!!! [Gold] No summary rows produced.")
+            return report
+
+        # Merge every hospital's partials into one table per grouping set
+        os.makedirs(rollups_staging_dir)
+        for name, keys in rollups.items():
+            merged = merge_rollup(os.path.join(partials_staging_dir, name), keys)
+            pq.write_table(to_table(merged, rollup_schema(keys, partial=False)),
+                           os.path.join(rollups_staging_dir, f"{name}.parquet"), compression=PARQUET_COMPRESSION)
+            print(f">>> [Gold] Rollup {name} ({', '.join(keys)}): {len(merged)} groups")
+
+        print(f">>> [Gold] Writing {total_summary} summary rows to {gold_dataset_dir}")
+        publish_dataset(staging_dir, gold_dataset_dir)
+        os.makedirs(partials_staging_dir, exist_ok=True)
+        publish_dataset(partials_staging_dir, partials_dir)
+        publish_dataset(rollups_staging_dir, rollups_dir)
+        if os.path.exists(manifest_path):
+            save_manifest(manifest, manifest_path)
+        if write_csv:
+            print(f">>> [Gold] Writing Combined CSV to {gold_csv_file}")
+            export_csv(list_partitions(gold_dataset_dir).values(), gold_csv_file)
         print(">>> [Gold] Done.")
-        
+        return report
+
     except Exception as e:
         print(f"!!! Error in Gold Processing: {e}")
         sys.exit(1)
@@ -0,0 +1,157 @@
+"""
+Runs the ETL stages as a DAG and writes a JSON run report.
+
+Each stage starts as soon as the stages it depends on have succeeded, so stages with no path between
+them (e.g. the optional CSV exports and the next layer) run concurrently. A failed stage skips
+everything downstream of it. The report records, for every stage and every hospital, wall time,
+CPU time, peak RSS, and rows and bytes in and out. While stages overlap, CPU time and peak RSS are
+the whole process's.
+
+    python etl/pipeline.py --data-dir /app/data --report run_report.json
+    python etl/pipeline.py --stages gold load      # reuse the Bronze/Silver already on disk
+"""
+import os
+import sys
+import json
+import argparse
+import resource
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Allow running as a script (python etl/pipeline.py) as well as a module
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common.datasets import export_csv, list_partitions
+from common.manifest import MANIFEST_FILENAME
+from common.metrics import measure, path_bytes
+from bronze.bronze_emory import ingest_bronze_emory
+from silver.silver_emory import WRITE_CSV as SILVER_WRITE_CSV, process_emory
+from gold.gold_emory import WRITE_CSV as GOLD_WRITE_CSV, create_gold_layer
+from scripts.db_loader import load_gold_to_db
+
+DATA_DIR = os.getenv("ETL_DATA_DIR", "/app/data")
+
+# Stages allowed to run at the same time
+WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+
+
+def run_bronze(data_dir):
+    return ingest_bronze_emory(os.path.join(data_dir, "bronze"))
+
+
+def run_silver(data_dir):
+    # The combined CSV is its own stage so it can overlap with Gold
+    return process_emory(os.path.join(data_dir, "bronze"), os.path.join(data_dir, "silver"), write_csv=False)
+
+
+def run_silver_csv(data_dir):
+    export_csv(list_partitions(os.path.join(data_dir, "silver", "emory_silver")).values(),
+               os.path.join(data_dir, "silver", "emory_all_cleaned.csv"))
+
+
+def run_gold(data_dir):
+    return create_gold_layer(os.path.join(data_dir, "silver", "emory_silver"), os.path.join(data_dir, "gold"), write_csv=False,
+                             manifest_path=os.path.join(data_dir, "bronze", MANIFEST_FILENAME))
+
+
+def run_gold_csv(data_dir):
+    export_csv(list_partitions(os.path.join(data_dir, "gold", "emory_gold")).values(), os.path.join(data_dir, "gold", "emory_gold.csv"))
+
+
+def run_load(data_dir):
+    return load_gold_to_db(os.path.join(data_dir, "gold", "emory_gold"))
+
+
+# name -> run(data_dir), the stages it waits for, and the paths (under data_dir) it reads and writes
+STAGES = {
+    "bronze": {"run": run_bronze, "after": [], "reads": [], "writes": ["bronze"]},
+    "silver": {"run": run_silver, "after": ["bronze"], "reads": ["bronze"], "writes": ["silver/emory_silver"]},
+    "silver_csv": {"run": run_silver_csv, "after": ["silver"], "reads": ["silver/emory_silver"], "writes": ["silver/emory_all_cleaned.csv"]},
+    "gold": {"run": run_gold, "after": ["silver"], "reads": ["silver/emory_silver"], "writes": ["gold/emory_gold", "gold/emory_rollups"]},
+    "gold_csv": {"run": run_gold_csv, "after": ["gold"], "reads": ["gold/emory_gold"], "writes": ["gold/emory_gold.csv"]},
+    "load": {"run": run_load, "after": ["gold"], "reads": ["gold/emory_gold", "gold/emory_rollups"], "writes": []},
+}
+
+# The CSV exports only run when their layer's *_WRITE_CSV flag is set (or they're asked for by name)
+DEFAULT_STAGES = [name for name in STAGES if name not in ("silver_csv", "gold_csv")
+                  ] + (["silver_csv"] if SILVER_WRITE_CSV else []) + (["gold_csv"] if GOLD_WRITE_CSV else [])
+
+
+def run_stage(name, data_dir):
+    """Runs one stage and returns its report entry; failures are reported, not raised."""
+    stage = STAGES[name]
+    print(f"\n>>> [Pipeline] Starting {name}")
+    bytes_in = path_bytes(*(os.path.join(data_dir, path) for path in stage["reads"]))
+    result, error = None, None
+    with measure() as metrics:
+        try:
+            result = stage["run"](data_dir)
+        except SystemExit as e:
+            # The stage scripts report their own errors and sys.exit(1)
+            error = f"exited with status {e.code}"
+        except Exception as e:
+            error = str(e)
+
+    entry = {"status": "failed" if error else "ok"}
+    if error:
+        entry["error"] = error
+    entry.update(metrics, bytes_in=bytes_in, bytes_out=path_bytes(*(os.path.join(data_dir, path) for path in stage["writes"])))
+    entry.update(result or {})
+    print(f">>> [Pipeline] {name} {entry['status']} in {entry['wall_seconds']}s "
+          f"(cpu {entry['cpu_seconds']}s, peak RSS {entry['peak_rss_mb']} MB)")
+    return entry
+
+
+def run_pipeline(data_dir=DATA_DIR, stages=None, workers=WORKERS, report_path=None):
+    """
+    Runs `stages` (default: DEFAULT_STAGES) in dependency order; dependencies outside `stages` are
+    assumed to be on disk already. Writes the run report to `report_path` (default:
+    <data_dir>/run_reports/run-<timestamp>.json) and returns it.
+    """
+    selected = [name for name in STAGES if name in (stages or DEFAULT_STAGES)]
+    started_at = datetime.now(timezone.utc)
+    report = {"started_at": started_at.isoformat(), "data_dir": data_dir, "stages": {}}
+
+    pending, running = list(selected), {}
+    with measure() as totals, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while pending or running:
+            for name in list(pending):
+                upstream = [report["stages"].get(dep, {}).get("status") for dep in STAGES[name]["after"] if dep in selected]
+                if any(status in ("failed", "skipped") for status in upstream):
+                    report["stages"][name] = {"status": "skipped", "error": "an upstream stage did not succeed"}
+                    pending.remove(name)
+                elif all(status == "ok" for status in upstream):
+                    running[pool.submit(run_stage, name, data_dir)] = name
+                    pending.remove(name)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                report["stages"][running.pop(future)] = future.result()
+
+    report["stages"] = {name: report["stages"][name] for name in selected}
+    report.update(
+        finished_at=datetime.now(timezone.utc).isoformat(),
+        status="ok" if all(entry["status"] == "ok" for entry in report["stages"].values()) else "failed",
+        # ru_maxrss of the largest child process (e.g. a Silver worker); KiB on Linux
+        children_peak_rss_mb=round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        **totals,
+    )
+
+    report_path = report_path or os.path.join(data_dir, "run_reports", f"run-{started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"\n>>> [Pipeline] {report['status']} in {report['wall_seconds']}s; run report written to {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help=f"Default: {' '.join(DEFAULT_STAGES)}")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Stages allowed to run at the same time")
+    parser.add_argument("--report", help="Where to write the JSON run report")
+    args = parser.parse_args()
+
+    report = run_pipeline(args.data_dir, args.stages, args.workers, args.report)
+    sys.exit(0 if report["status"] == "ok" else 1)
@@ -1,49 +1,255 @@
-import pandas as pd
+import io
 import os
-from sqlalchemy import create_engine, text
 import sys
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+
+# Allow running as a script (python etl/scripts/db_loader.py) as well as a module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.schema import GOLD_SCHEMA, GOLD_SKETCH_SCHEMA, is_text, sql_type, to_frame
+
+TABLE_NAME = "emory_negotiated_rates"
+
+# One row per successful load; the API watches max(version) to know when to reload
+VERSION_TABLE = "etl_data_version"
+
+# Columns the API serves; anything else in Gold (e.g. rate_sketch) is left on disk
+GOLD_COLUMNS = GOLD_SCHEMA.names
+
+# name -> index definition, created on the staging table before it goes live
+INDEXES = {
+    "idx_billing_code": "(billing_code)",
+    "idx_hospital_name": "(hospital_name)",
+    "idx_setting": "(setting)",
+    # GIN Trigram index for fast ILIKE '%search%' queries
+    "idx_procedure_trgm": "USING gin (procedure_type gin_trgm_ops)",
+}
+
+# Materialized rollups for /rates/compare: name -> column compared across.
+# Each holds median_rate stats per (billing_code, setting, that column) and is rebuilt with every load.
+ROLLUPS = {
+    "rate_compare_by_hospital": "hospital_name",
+    "rate_compare_by_payer": "payer",
+}
+
+# Facets behind /procedures, /hospitals, /payers and /plans: name -> (key columns, stat columns).
+# The distinct keys (with rate ranges) are a small fraction of the table, so those endpoints read these
+# instead of running DISTINCT over it. Built on the staging table and swapped in with it like ROLLUPS;
+# the unique index on the keys also lets one be refreshed in place with REFRESH ... CONCURRENTLY.
+FACETS = {
+    "facet_procedures": (["procedure_type", "hospital_name", "setting", "payer", "plan"],
+                         "MIN(min_rate) AS min_rate, MAX(max_rate) AS max_rate, SUM(record_count) AS record_count"),
+    "facet_hospitals": (["hospital_name"], "COUNT(*) AS rate_count"),
+    "facet_payers": (["payer"], "COUNT(*) AS rate_count"),
+    "facet_plans": (["payer", "plan"], "COUNT(*) AS rate_count"),
+}
+
+# Further facet indexes: facet name -> {index suffix: definition}
+FACET_INDEXES = {
+    # /procedures?search= is an ILIKE '%search%' like on the main table
+    "facet_procedures": {"trgm": "USING gin (procedure_type gin_trgm_ops)"},
+}
+
+# Gold's rollup cube (gold/emory_rollups/<name>.parquet) is loaded as one table per grouping set,
+# keyed by its string columns with a unique index, so coarse questions are key lookups
+ROLLUP_TABLE_PREFIX = "emory_rollup_"
+
+# Rows per COPY batch; bounds loader memory regardless of Gold size
+COPY_BATCH_ROWS = 100_000
+
+# How long the swap may wait for in-flight API queries before giving up
+SWAP_LOCK_TIMEOUT = os.getenv("DB_LOADER_LOCK_TIMEOUT", "30s")
+
+
+def copy_gold(cursor, gold_path, table_name, columns=GOLD_COLUMNS, with_id=True):
+    """Streams a Parquet dataset into `table_name` with COPY, one record batch at a time. Returns rows copied."""
+    copy_columns = (["id"] if with_id else []) + columns
+    copy_sql = f"COPY {table_name} ({', '.join(copy_columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N', ENCODING 'UTF8')"
+    dataset = ds.dataset(gold_path, format="parquet", partitioning="hive")
+
+    rows = 0
+    for batch in dataset.to_batches(columns=columns, batch_size=COPY_BATCH_ROWS):
+        df = to_frame(pa.Table.from_batches([batch]), GOLD_SKETCH_SCHEMA)
+        if with_id:
+            # We'll use the running row number as our 'id' column
+            df.insert(0, "id", range(rows, rows + len(df)))
+        buf = io.BytesIO(df.to_csv(index=False, header=False, na_rep="\\N").encode("utf-8"))
+        cursor.copy_expert(copy_sql, buf)
+        rows += len(df)
+    return rows
+
+
+def build_staging_table(cursor, gold_path, staging_name):
+    """Creates, fills and indexes the staging table. Nothing here is visible to the API."""
+    column_defs = ", ".join(f"{col} {sql_type(GOLD_SCHEMA.field(col).type)}" for col in GOLD_COLUMNS)
+    # CASCADE takes any rollups left on a staging table from a failed run with it
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_name} CASCADE")
+    cursor.execute(f"CREATE TABLE {staging_name} (id BIGINT NOT NULL, {column_defs})")
+
+    rows = copy_gold(cursor, gold_path, staging_name)
+    print(f">>> [DB Loader] Copied {rows} rows into {staging_name}.")
+
+    # Build the primary key and indexes after the bulk load, while nobody is reading
+    cursor.execute(f"ALTER TABLE {staging_name} ADD CONSTRAINT {staging_name}_pkey PRIMARY KEY (id)")
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for index_name, definition in INDEXES.items():
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}_staging")
+        cursor.execute(f"CREATE INDEX {index_name}_staging ON {staging_name} {definition}")
+    cursor.execute(f"ANALYZE {staging_name}")
+
+    # Rollups are built against the staging table; they follow it through the rename
+    for rollup_name, group_column in ROLLUPS.items():
+        build_rollup(cursor, staging_name, f"{rollup_name}_staging", group_column)
+    for facet_name, (keys, stats) in FACETS.items():
+        build_facet(cursor, staging_name, facet_name, keys, stats)
+    return rows
+
+
+def build_rollup(cursor, source_name, rollup_name, group_column):
+    """median_rate statistics per (billing_code, setting, group_column), as an indexed materialized view."""
+    cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {rollup_name}")
+    cursor.execute(
+        f"CREATE MATERIALIZED VIEW {rollup_name} AS "
+        f"SELECT billing_code, setting, {group_column} AS group_value, "
+        "MIN(median_rate) AS min_median_rate, MAX(median_rate) AS max_median_rate, "
+        "percentile_cont(0.5) WITHIN GROUP (ORDER BY median_rate) AS median_rate, "
+        "COUNT(*) AS rate_count "
+        f"FROM {source_name} WHERE median_rate IS NOT NULL "
+        f"GROUP BY billing_code, setting, {group_column}"
+    )
+    cursor.execute(f"CREATE UNIQUE INDEX {rollup_name}_key ON {rollup_name} (billing_code, setting, group_value)")
+
+
+def build_facet(cursor, source_name, facet_name, keys, stats):
+    """Distinct `keys` of the source with their `stats`, as `{facet_name}_staging` with a unique index on the keys."""
+    staging_name = f"{facet_name}_staging"
+    cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {staging_name}")
+    cursor.execute(
+        f"CREATE MATERIALIZED VIEW {staging_name} AS "
+        f"SELECT {', '.join(keys)}, {stats} FROM {source_name} GROUP BY {', '.join(keys)}"
+    )
+    cursor.execute(f"CREATE UNIQUE INDEX {staging_name}_key ON {staging_name} ({', '.join(keys)})")
+    for suffix, definition in FACET_INDEXES.get(facet_name, {}).items():
+        cursor.execute(f"CREATE INDEX {staging_name}_{suffix} ON {staging_name} {definition}")
+    cursor.execute(f"ANALYZE {staging_name}")
+
+
+def build_rollup_tables(cursor, rollups_path):
+    """Loads each rollup Parquet into a `{table}_staging` table with a unique index on its keys. Returns the table names."""
+    tables = []
+    if not os.path.isdir(rollups_path):
+        return tables
+    for filename in sorted(os.listdir(rollups_path)):
+        if not filename.endswith(".parquet"):
+            continue
+        table_name = ROLLUP_TABLE_PREFIX + filename[:-len(".parquet")]
+        staging_name = f"{table_name}_staging"
+        schema = pq.read_schema(os.path.join(rollups_path, filename))
+        columns = schema.names
+        keys = [field.name for field in schema if is_text(field.type)]
+
+        column_defs = ", ".join(f"{field.name} {sql_type(field.type)}" for field in schema)
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_name}")
+        cursor.execute(f"CREATE TABLE {staging_name} ({column_defs})")
+        rows = copy_gold(cursor, os.path.join(rollups_path, filename), staging_name, columns, with_id=False)
+        cursor.execute(f"CREATE UNIQUE INDEX {staging_name}_key ON {staging_name} ({', '.join(keys)})")
+        cursor.execute(f"ANALYZE {staging_name}")
+        print(f">>> [DB Loader] Copied {rows} rows into {staging_name} (keyed by {', '.join(keys)}).")
+        tables.append(table_name)
+    return tables
+
+
+def swap_in_rollup_tables(cursor, tables):
+    """Swaps in freshly built rollup tables and drops rollups Gold no longer produces. Runs inside the main swap."""
+    cursor.execute(
+        "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s",
+        (ROLLUP_TABLE_PREFIX.replace("_", "\\_") + "%",),
+    )
+    for (existing,) in cursor.fetchall():
+        if existing not in tables and not existing.endswith("_staging"):
+            cursor.execute(f"DROP TABLE {existing}")
+    for table_name in tables:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        cursor.execute(f"ALTER TABLE {table_name}_staging RENAME TO {table_name}")
+        cursor.execute(f"ALTER INDEX {table_name}_staging_key RENAME TO {table_name}_key")
+
+
+def swap_in_staging_table(cursor, staging_name, table_name, rows, rollup_tables=()):
+    """
+    Replaces the live table with the staging table in one transaction; readers see old or new, never neither.
+    Publishes a new data version in the same transaction. Returns the version number.
+    """
+    cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+    # The old rollups and facets depend on the live table, so they go first
+    for view_name in list(ROLLUPS) + list(FACETS):
+        cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {view_name}")
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cursor.execute(f"ALTER TABLE {staging_name} RENAME TO {table_name}")
+    cursor.execute(f"ALTER INDEX {staging_name}_pkey RENAME TO {table_name}_pkey")
+    for index_name in INDEXES:
+        cursor.execute(f"ALTER INDEX {index_name}_staging RENAME TO {index_name}")
+    for rollup_name in ROLLUPS:
+        cursor.execute(f"ALTER MATERIALIZED VIEW {rollup_name}_staging RENAME TO {rollup_name}")
+        cursor.execute(f"ALTER INDEX {rollup_name}_staging_key RENAME TO {rollup_name}_key")
+    for facet_name in FACETS:
+        cursor.execute(f"ALTER MATERIALIZED VIEW {facet_name}_staging RENAME TO {facet_name}")
+        for suffix in ["key", *FACET_INDEXES.get(facet_name, {})]:
+            cursor.execute(f"ALTER INDEX {facet_name}_staging_{suffix} RENAME TO {facet_name}_{suffix}")
+    swap_in_rollup_tables(cursor, rollup_tables)
+
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        "version BIGINT PRIMARY KEY, table_name TEXT NOT NULL, row_count BIGINT NOT NULL, "
+        "loaded_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    )
+    cursor.execute(
+        f"INSERT INTO {VERSION_TABLE} (version, table_name, row_count) "
+        f"SELECT COALESCE(MAX(version), 0) + 1, %s, %s FROM {VERSION_TABLE} RETURNING version",
+        (table_name, rows),
+    )
+    return cursor.fetchone()[0]
+
+
+def load_gold_to_db(gold_path="/app/data/gold/emory_gold", rollups_path=None):
+    print(">>> [DB Loader] Starting sync from Gold Parquet to Postgres...")
 
-def load_gold_to_db():
-    print(">>> [DB Loader] Starting sync from Gold CSV to Postgres...")
-    
     # 1. Configuration
-    csv_path = "/app/data/gold/emory_gold.csv"
     db_url = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/honest_healthcare")
-    table_name = "emory_negotiated_rates"
-    
+    table_name = TABLE_NAME
+    staging_name = f"{table_name}_staging"
+    rollups_path = rollups_path or os.path.join(os.path.dirname(gold_path), "emory_rollups")
+
     # 2. Check source
-    if not os.path.exists(csv_path):
-        print(f"!!! [DB Loader] Source file not found: {csv_path}")
+    if not os.path.exists(gold_path):
+        print(f"!!! [DB Loader] Source dataset not found: {gold_path}")
         return
 
     try:
-        # 3. Read Data
-        df = pd.read_csv(csv_path)
-        print(f">>> [DB Loader] Loaded {len(df)} rows from CSV.")
-        
-        # 4. Connect to DB
-        engine = create_engine(db_url)
-        
-        # 5. Write to DB (Replace existing table for fresh sync)
-        # We'll use the DataFrame index as our 'id' column
-        df.index.name = 'id'
-        df.to_sql(table_name, engine, if_exists='replace', index=True)
-        print(f">>> [DB Loader] Successfully synced to table: {table_name}")
-        
-        # 6. Add primary key constraint and indexes
-        with engine.connect() as conn:
-            conn.execute(text(f"ALTER TABLE {table_name} ADD PRIMARY KEY (id)"))
-            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_billing_code ON {table_name} (billing_code)"))
-            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_hospital_name ON {table_name} (hospital_name)"))
-            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_setting ON {table_name} (setting)"))
-            
-            # GIN Trigram index for fast ILIKE '%search%' queries
-            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
-            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_procedure_trgm ON {table_name} USING gin (procedure_type gin_trgm_ops)"))
-            
+        # 3. Connect to DB (COPY below uses the psycopg2 cursor API)
+        engine = create_engine(db_url.replace("postgresql://", "postgresql+psycopg2://", 1))
+        conn = engine.raw_connection()
+        try:
+            # 4. Bulk load and index a staging copy while the API keeps serving the live table
+            with conn.cursor() as cursor:
+                rows = build_staging_table(cursor, gold_path, staging_name)
+                rollup_tables = build_rollup_tables(cursor, rollups_path)
+            conn.commit()
+            print(f">>> [DB Loader] Built primary key and performance indexes (including Trigram) on {staging_name}.")
+
+            # 5. Atomic swap
+            with conn.cursor() as cursor:
+                version = swap_in_staging_table(cursor, staging_name, table_name, rows, rollup_tables)
             conn.commit()
-            print(">>> [DB Loader] Created primary key and performance indexes (including Trigram).")
-            
+            print(f">>> [DB Loader] Successfully synced to table: {table_name} (data version {version})")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return {"rows_in": rows, "rows_out": rows, "rollup_tables": rollup_tables, "data_version": version}
+
     except Exception as e:
         print(f"!!! [DB Loader] Sync failed: {e}")
         sys.exit(1)
@@ -0,0 +1,370 @@
+"""
+Bronze MRF readers. Each one streams a file as raw DataFrame chunks in the CMS tall CSV layout
+(description, code|1, code|1|type, setting, payer_name, plan_name, standard_charge|min, ...), which is
+what Silver's clean_chunk maps onto the Silver schema. Whatever the source format, no more than about
+one chunk of rows is held at a time.
+
+The reader is chosen by sniffing the start of the file rather than trusting its name (Bronze saves
+every MRF as *_raw.csv): READERS is tried in order and the first layout whose sniff recognizes the
+prefix wins, with the tall CSV layout as the fallback.
+"""
+import re
+import csv
+import json
+import codecs
+
+import numpy as np
+import pandas as pd
+
+ENCODINGS = ['utf-8', 'cp1252', 'latin1', 'iso-8859-1']
+
+# We look for a row that has both 'description' and 'code|1' or 'payer_name'
+HEADER_KEYWORDS = ["description", "code|1", "payer_name", "standard_charge"]
+
+# Header/encoding detection only looks at the start (and, for the encoding, the end) of the file
+SNIFF_BYTES = 1024 * 1024
+
+# Bytes decoded at a time when a whole file has to be checked against an encoding
+VALIDATE_BLOCK_BYTES = 8 * 1024 * 1024
+
+# Line breaks as the CSV parser sees them (str.splitlines also splits on \x1c, \x85, \u2028, ...)
+LINE_BREAK = re.compile(r"\r\n?|\n")
+
+# Characters read from a JSON MRF at a time
+JSON_BLOCK_CHARS = 1024 * 1024
+
+# Payer-specific columns of the wide CSV layout, e.g. standard_charge|Aetna|PPO|negotiated_dollar or
+# estimated_amount|Aetna|PPO; the tall layout has the same fields once, with payer_name/plan_name columns
+WIDE_COLUMN = re.compile(r"^(standard_charge|estimated_amount|additional_payer_notes)\|([^|]+)\|([^|]*?)(?:\|(\w+))?$")
+
+
+def skip_cut_character(data):
+    """Drops the up to 3 UTF-8 continuation bytes (0x80-0xBF) left of a character cut at the start of `data`."""
+    start = 0
+    while start < min(3, len(data)) and 0x80 <= data[start] <= 0xBF:
+        start += 1
+    return data[start:]
+
+
+def read_prefix(filepath, encodings=ENCODINGS, sniff_bytes=SNIFF_BYTES):
+    """
+    Decodes a bounded prefix of the file with the first encoding that also decodes a bounded suffix.
+    Stray bytes tend to sit in the data rows or the footer, not the preamble, so the suffix catches
+    most of what the prefix alone would miss without reading the middle; process_hospital validates
+    the whole file only if a byte in between still fails. Returns (encoding, prefix text).
+    """
+    with open(filepath, 'rb') as f:
+        prefix = f.read(sniff_bytes)
+        truncated = bool(f.read(1))
+        suffix = b""
+        cut = False
+        if truncated:
+            f.seek(max(f.seek(0, 2) - sniff_bytes, sniff_bytes))
+            suffix = f.read()
+            # Start on a line boundary rather than part-way through a character
+            if b"\n" in suffix:
+                suffix = suffix[suffix.find(b"\n") + 1:]
+            else:
+                # Minified JSON has no line to align to, so the seek may have landed inside a character
+                cut = True
+
+    # Don't let a multi-byte character cut in half at the boundary fail the decode
+    if truncated and b"\n" in prefix:
+        prefix = prefix[:prefix.rfind(b"\n") + 1]
+
+    for encoding in encodings:
+        try:
+            # Incremental, so a minified JSON prefix with no newline to cut at decodes too
+            text = codecs.getincrementaldecoder(encoding)().decode(prefix, final=not truncated)
+            (skip_cut_character(suffix) if cut and codecs.lookup(encoding).name == "utf-8" else suffix).decode(encoding)
+            return encoding, text
+        except UnicodeDecodeError:
+            continue
+
+    raise ValueError(f"Could not read {filepath} with supported encodings.")
+
+
+def validate_encoding(filepath, encodings=ENCODINGS, block_bytes=VALIDATE_BLOCK_BYTES):
+    """First of `encodings` that decodes the whole file, checked block by block without keeping any text."""
+    for encoding in encodings:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(filepath, 'rb') as f:
+                for block in iter(lambda: f.read(block_bytes), b""):
+                    decoder.decode(block)
+            decoder.decode(b"", final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"Could not read {filepath} with supported encodings.")
+
+
+def find_header_row(text):
+    """Index of the first of the first 50 lines that looks like a CSV header, or None."""
+    for i, line in enumerate(LINE_BREAK.split(text)[:50]):
+        lower_line = line.lower()
+        # Skip rows that are clearly metadata
+        if lower_line.startswith("hospital_name") or lower_line.startswith("license_number"):
+            continue
+
+        match_count = sum(1 for k in HEADER_KEYWORDS if k in lower_line)
+        if match_count >= 2:
+            return i
+    return None
+
+
+def detect_header(filepath, encodings=ENCODINGS, sniff_bytes=SNIFF_BYTES):
+    """
+    Detects encoding and the header row index from a bounded prefix of the file.
+    Returns (encoding, header_index).
+    """
+    used_encoding, text = read_prefix(filepath, encodings, sniff_bytes)
+    header_index = find_header_row(text)
+    if header_index is None:
+        print(">>> [Silver] Warning: No clear header found, assuming index 0.")
+        return used_encoding, 0
+    print(f">>> [Silver] Found header row at index {header_index} (line {header_index+1})")
+    return used_encoding, header_index
+
+
+def drop_disclaimer_rows(df):
+    """
+    Strip trailing empty/metadata rows.
+    Often hospitals have footers. We'll drop rows where description is missing.
+    Emory often has a "To the best of its knowledge..." disclaimer at the top/bottom.
+    """
+    if "description" in df.columns:
+        df = df[df["description"].notnull()]
+        df = df[~df["description"].str.contains("To the best of its knowledge", case=False, na=False)]
+    return df
+
+
+# --- Tall CSV: one row per item and payer/plan (Emory's layout) ---
+
+def sniff_tall_csv(text):
+    index = find_header_row(text)
+    return 0 if index is None else index
+
+
+def read_bronze_chunks(filepath, encoding, header_index, chunk_size):
+    """Yields raw DataFrame chunks (all columns as strings) with disclaimer rows removed."""
+    read_kwargs = dict(encoding=encoding, skiprows=header_index, dtype=str)
+    if not chunk_size:
+        yield drop_disclaimer_rows(pd.read_csv(filepath, low_memory=False, **read_kwargs))
+        return
+
+    with pd.read_csv(filepath, chunksize=chunk_size, **read_kwargs) as reader:
+        for chunk in reader:
+            yield drop_disclaimer_rows(chunk)
+
+
+# --- Wide CSV: one row per item, one group of columns per payer/plan ---
+
+def wide_layout(columns):
+    """{(payer, plan): {tall field: wide column}} for the payer-specific columns of a wide header."""
+    layout = {}
+    for column in columns:
+        match = WIDE_COLUMN.match(column.strip())
+        if match:
+            prefix, payer, plan, suffix = match.groups()
+            field = f"{prefix}|{suffix}" if prefix == "standard_charge" else prefix
+            layout.setdefault((payer, plan or None), {})[field] = column
+    return layout
+
+
+def sniff_wide_csv(text):
+    index = find_header_row(text)
+    if index is None:
+        return None
+    header = next(csv.reader([LINE_BREAK.split(text)[index]]), [])
+    if "payer_name" in (column.strip().lower() for column in header) or not wide_layout(header):
+        return None
+    return index
+
+
+def unpivot_wide(chunk, layout):
+    """Wide rows -> tall rows, item-major in header payer order; payers with no values for an item are dropped."""
+    payer_columns = {column for fields in layout.values() for column in fields.values()}
+    base = chunk[[column for column in chunk.columns if column not in payer_columns]]
+    pairs = list(layout)
+    n = len(chunk)
+
+    rows = base.iloc[np.repeat(np.arange(n), len(pairs))].reset_index(drop=True)
+    rows["payer_name"] = np.tile(np.array([payer for payer, _ in pairs], dtype=object), n)
+    rows["plan_name"] = np.tile(np.array([plan for _, plan in pairs], dtype=object), n)
+    fields = sorted({field for columns in layout.values() for field in columns})
+    for field in fields:
+        rows[field] = np.column_stack([
+            chunk[columns[field]].to_numpy(dtype=object) if field in columns else np.full(n, None, dtype=object)
+            for columns in layout.values()
+        ]).ravel()
+    return rows[rows[fields].notna().any(axis=1)]
+
+
+def read_wide_csv(filepath, encoding, header_index, chunk_size):
+    header = pd.read_csv(filepath, encoding=encoding, skiprows=header_index, nrows=0).columns
+    layout = wide_layout(header)
+    # Each wide row fans out to one row per payer/plan; keep the unpivoted chunk near chunk_size rows
+    rows_per_read = max(1, chunk_size // len(layout)) if chunk_size else 0
+    for chunk in read_bronze_chunks(filepath, encoding, header_index, rows_per_read):
+        yield unpivot_wide(chunk, layout)
+
+
+# --- CMS JSON: standard_charge_information items with nested charges and payers ---
+
+_JSON_SKIP = re.compile(r"\s*")
+_JSON_DECODER = json.JSONDecoder()
+
+
+class JsonStream:
+    """
+    Just enough of an incremental JSON reader to walk a top-level object and its arrays one element at
+    a time: each value is decoded with raw_decode once it's fully in the buffer, and the buffer only
+    ever holds the unread tail plus the next block.
+    """
+
+    def __init__(self, f, block_chars=JSON_BLOCK_CHARS):
+        self.f = f
+        self.block_chars = block_chars
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        # Growing reads keep a value that spans many blocks linear to decode
+        more = self.f.read(max(self.block_chars, len(self.buffer)))
+        self.eof = not more
+        self.buffer += more
+
+    def peek(self):
+        """The next non-whitespace character ("" at the end of the file)."""
+        while True:
+            self.pos = _JSON_SKIP.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def take(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON MRF: expected {char!r}, found {self.buffer[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _JSON_DECODER.raw_decode(self.buffer, self.pos)
+                # A number (or the buffer) ending exactly at the boundary may continue in the next block
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self, key):
+        """Yields the elements of the top-level object's `key` array; everything else is skipped element by element."""
+        self.take("{")
+        while self.peek() not in ("}", ""):
+            name = self.value()
+            self.take(":")
+            if self.peek() == "[":
+                self.take("[")
+                while self.peek() not in ("]", ""):
+                    element = self.value()
+                    if name == key:
+                        yield element
+                    if self.peek() == ",":
+                        self.take(",")
+                self.take("]")
+            else:
+                self.value()
+            if self.peek() == ",":
+                self.take(",")
+
+
+def sniff_cms_json(text):
+    return 0 if text.lstrip("\ufeff \t\r\n").startswith("{") else None
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def charge_rows(item):
+    """One CMS JSON standard_charge_information item -> tall rows (dicts), one per charge and payer/plan."""
+    codes = {}
+    for i, code in enumerate(item.get("code_information") or [], start=1):
+        codes[f"code|{i}"] = _text(code.get("code"))
+        codes[f"code|{i}|type"] = _text(code.get("type"))
+
+    for charge in item.get("standard_charges") or []:
+        shared = dict(
+            codes,
+            description=_text(item.get("description")),
+            setting=charge.get("setting"),
+            billing_class=charge.get("billing_class"),
+            **{
+                "standard_charge|gross": charge.get("gross_charge"),
+                "standard_charge|discounted_cash": charge.get("discounted_cash"),
+                "standard_charge|min": charge.get("minimum"),
+                "standard_charge|max": charge.get("maximum"),
+            },
+        )
+        # A charge with no payer-specific rates is still one row, like a payer-less row in the CSV
+        for payer in charge.get("payers_information") or [{}]:
+            yield dict(
+                shared,
+                # Some files put billing_class on the payer rather than the charge
+                billing_class=payer.get("billing_class") or shared["billing_class"],
+                payer_name=payer.get("payer_name"),
+                plan_name=payer.get("plan_name"),
+                estimated_amount=payer.get("estimated_amount"),
+                **{
+                    "standard_charge|negotiated_dollar": payer.get("standard_charge_dollar"),
+                    "standard_charge|negotiated_percentage": payer.get("standard_charge_percentage"),
+                    "standard_charge|negotiated_algorithm": payer.get("standard_charge_algorithm"),
+                    "standard_charge|methodology": payer.get("methodology"),
+                },
+            )
+
+
+def read_cms_json(filepath, encoding, header_index, chunk_size):
+    # utf-8-sig so a byte-order mark doesn't get in front of the opening brace
+    with open(filepath, encoding="utf-8-sig" if encoding == "utf-8" else encoding) as f:
+        rows = []
+        for item in JsonStream(f).items("standard_charge_information"):
+            rows.extend(charge_rows(item))
+            if chunk_size and len(rows) >= chunk_size:
+                yield drop_disclaimer_rows(pd.DataFrame.from_records(rows))
+                rows = []
+        if rows:
+            yield drop_disclaimer_rows(pd.DataFrame.from_records(rows))
+
+
+# Tried in order; each sniff gets the decoded prefix and returns the header row index, or None if the
+# layout doesn't match. read(filepath, encoding, header_index, chunk_size) yields tall chunks.
+READERS = {
+    "cms_json": {"sniff": sniff_cms_json, "read": read_cms_json},
+    "wide_csv": {"sniff": sniff_wide_csv, "read": read_wide_csv},
+    "tall_csv": {"sniff": sniff_tall_csv, "read": read_bronze_chunks},
+}
+
+
+def sniff_reader(filepath, encodings=ENCODINGS, sniff_bytes=SNIFF_BYTES):
+    """
+    Picks the reader for a Bronze file from its prefix (and the encoding from its prefix and suffix).
+    Returns (reader name, encoding, header_index).
+    """
+    encoding, text = read_prefix(filepath, encodings, sniff_bytes)
+    for name, reader in READERS.items():
+        header_index = reader["sniff"](text)
+        if header_index is not None:
+            print(f">>> [Silver] {filepath}: {name} layout, header row at index {header_index}")
+            return name, encoding, header_index
@@ -1,83 +1,261 @@
 import pandas as pd
+import pyarrow.parquet as pq
+import datetime
 import os
+import re
 import sys
 import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Allow running as a script (python etl/silver/silver_emory.py) as well as a module
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.datasets import PARQUET_COMPRESSION, to_table, partition_path, list_partitions, publish_dataset, export_csv, carry_over_partition
+from common.manifest import MANIFEST_FILENAME, FULL_REFRESH, load_manifest, save_manifest, source_sha256, fingerprint
+from common.schema import SILVER_SCHEMA, constant
+from common.metrics import measure, path_bytes
+from silver.readers import ENCODINGS, READERS, detect_header, read_bronze_chunks, sniff_reader, validate_encoding
+
+# Rows per chunk when streaming a Bronze file. 0 reads each file in one go.
+CHUNK_SIZE = int(os.getenv("SILVER_CHUNK_SIZE", "200000"))
+
+# Hospitals processed concurrently, one worker process each
+WORKERS = int(os.getenv("SILVER_WORKERS", "1"))
+
+# Also write the combined emory_all_cleaned.csv next to the Parquet dataset
+WRITE_CSV = os.getenv("SILVER_WRITE_CSV", "0") == "1"
+
+EFFECTIVE_DATE = datetime.date(2025, 10, 1)
+
+# Bump when clean_chunk's output changes so incremental runs rebuild every hospital
+SILVER_FORMAT_VERSION = "2"
+
+COLUMN_MAP = {
+    "hospital_name": "hospital_name",
+    "hospital_address": "address",
+    "effective_date": "effective_date",
+    "code|1|type": "billing_code_type",
+    "code|1": "billing_code",
+    "description": "description",
+    "billing_class": "billing_class",
+    "setting": "setting",
+    "payer_name": "payer",
+    "plan_name": "plan",
+    "standard_charge|min": "min_negotiated_rate",
+    "standard_charge|max": "max_negotiated_rate",
+    "estimated_amount": "estimated_amount"
+}
+
+SILVER_COLUMNS = SILVER_SCHEMA.names
+RATE_COLUMNS = ["min_negotiated_rate", "max_negotiated_rate", "estimated_amount"]
+
 
 def find_header_and_read(filepath):
     """
     Detects encoding and finds the header row index.
     Returns a cleaned DataFrame.
     """
-    encodings = ['utf-8', 'cp1252', 'latin1', 'iso-8859-1']
-    lines = []
-    used_encoding = None
-    
-    # 1. Detect Encoding
-    for encoding in encodings:
+    encoding, header_index = detect_header(filepath)
+    return next(read_bronze_chunks(filepath, encoding, header_index, chunk_size=0))
+
+
+LEVEL_PATTERN = r"Level\s+(\d+)"
+LEVEL_STRIP_PATTERN = r"Level\s+\d+"
+SEPARATOR_PATTERN = r"^[\s\-\–:|,]+|[\s\-\–:|,]+$"
+
+
+def parse_description(desc):
+    """Row-at-a-time reference for parse_descriptions, kept for parity checks."""
+    level = None
+    proc_type = desc
+    match = re.search(r"Level\s+(\d+)", desc, re.IGNORECASE)
+    if match:
+        level = match.group(1)
+        # Remove "Level X" and any leading/trailing separators
+        clean_name = re.sub(r"Level\s+\d+", "", desc, flags=re.IGNORECASE).strip()
+        clean_name = re.sub(r"^[\s\-\–:|,]+|[\s\-\–:|,]+$", "", clean_name).strip()
+        proc_type = f"{clean_name} Level {level}"
+
+    return pd.Series([level or "1", proc_type])
+
+
+def parse_descriptions(descriptions):
+    """
+    Vectorized parse_description over a whole column.
+    Regexes run once per distinct description, then results are broadcast back to rows.
+    Returns (level, procedure_type) Series aligned with `descriptions`.
+    """
+    codes, uniques = pd.factorize(descriptions)
+    # Object dtype keeps Python `re` semantics for \s and \d (Arrow-backed strings would use RE2)
+    uniques = pd.Series(uniques, dtype=object)
+
+    levels = uniques.str.extract(LEVEL_PATTERN, flags=re.IGNORECASE, expand=False)
+    clean_names = uniques.str.replace(LEVEL_STRIP_PATTERN, "", flags=re.IGNORECASE, regex=True).str.strip()
+    clean_names = clean_names.str.replace(SEPARATOR_PATTERN, "", regex=True).str.strip()
+    proc_types = uniques.where(levels.isna(), clean_names + " Level " + levels)
+
+    level = pd.Series(levels.fillna("1").to_numpy()[codes], index=descriptions.index)
+    procedure_type = pd.Series(proc_types.to_numpy()[codes], index=descriptions.index)
+    return level, procedure_type
+
+
+def clean_chunk(df, hospital_name):
+    """Maps a raw Bronze chunk onto the Silver schema. Returns an empty frame if nothing survives."""
+    # Normalize column names
+    df.columns = [c.strip().lower() for c in df.columns]
+
+    # Filter down to codes with inpatient/outpatient insurance information
+    if 'code|1|type' in df.columns:
+        df = df[df['code|1|type'].isin(['MS-DRG', 'APC'])]
+    elif 'code_1_type' in df.columns:
+        df = df[df['code_1_type'].isin(['MS-DRG', 'APC'])]
+
+    if df.empty:
+        return pd.DataFrame(columns=SILVER_COLUMNS)
+
+    # COLUMN SELECTION & RENAMING
+    cleaned_df = pd.DataFrame(index=df.index)
+    for src, dst in COLUMN_MAP.items():
+        if src in df.columns:
+            cleaned_df[dst] = df[src]
+        else:
+            # Try fallback for 'code|1' vs 'code_1'
+            alt_src = src.replace("|", "_")
+            if alt_src in df.columns:
+                cleaned_df[dst] = df[alt_src]
+
+    # Inject Facility Information (one category each rather than a string per row)
+    cleaned_df["hospital_name"] = constant(hospital_name, len(cleaned_df))
+    cleaned_df["address"] = constant("", len(cleaned_df))  # Leave empty for now
+    cleaned_df["effective_date"] = EFFECTIVE_DATE
+
+    for col in RATE_COLUMNS:
+        if col in cleaned_df.columns:
+            cleaned_df[col] = pd.to_numeric(cleaned_df[col], errors="coerce")
+
+    # Extract Level and Procedure Type
+    if "description" in cleaned_df.columns:
+        cleaned_df["description"] = cleaned_df["description"].fillna("").astype(str)
+        cleaned_df["level"], cleaned_df["procedure_type"] = parse_descriptions(cleaned_df["description"])
+
+    return cleaned_df.reindex(columns=SILVER_COLUMNS)
+
+
+def process_hospital(bronze_path, hospital_name, part_path, chunk_size=CHUNK_SIZE, detected=None):
+    """
+    Streams one Bronze file (any layout in READERS) into its own Silver Parquet part, one row group per chunk.
+    If the file fails part-way, the part is removed so no partial hospital is left behind.
+    `detected` is what an earlier run found for this same file ({"reader", "encoding", "header_index"});
+    passing it skips sniffing.
+    Returns (Bronze rows read, Silver rows written, detected).
+    """
+    if detected:
+        print(f">>> [Silver] {hospital_name}: reusing detected {detected['reader']} layout")
+    else:
+        reader, encoding, header_index = sniff_reader(bronze_path)
+        detected = {"reader": reader, "encoding": encoding, "header_index": header_index}
+    writer = None
+    try:
+        while True:
+            print(f">>> [Silver] {hospital_name} encoding: {detected['encoding']}")
+            rows_read = rows = 0
+            try:
+                for chunk in READERS[detected["reader"]]["read"](bronze_path, detected["encoding"], detected["header_index"], chunk_size):
+                    rows_read += len(chunk)
+                    cleaned_df = clean_chunk(chunk, hospital_name)
+                    if cleaned_df.empty:
+                        continue
+                    if writer is None:
+                        writer = pq.ParquetWriter(part_path, SILVER_SCHEMA, compression=PARQUET_COMPRESSION)
+                    writer.write_table(to_table(cleaned_df, SILVER_SCHEMA))
+                    rows += len(cleaned_df)
+                break
+            except UnicodeDecodeError:
+                # A byte between the sniffed prefix and suffix didn't decode: check the whole file (once,
+                # block by block) for the next encoding that does, and read it again with that
+                if writer is not None:
+                    writer.close()
+                    writer = None
+                print(f"!!! [Silver] {hospital_name} is not valid {detected['encoding']} past the sniffed prefix and suffix, validating the whole file.")
+                encoding = detected["encoding"]
+                remaining = ENCODINGS[ENCODINGS.index(encoding) + 1:] if encoding in ENCODINGS else ENCODINGS
+                detected = dict(detected, encoding=validate_encoding(bronze_path, remaining))
+    except Exception:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    if writer is not None:
+        writer.close()
+    return rows_read, rows, detected
+
+
+def run_hospital(filename, hospital_name, bronze_path, part_path, chunk_size=CHUNK_SIZE, detected=None):
+    """
+    Per-hospital unit of work, safe to run in a worker process.
+    Errors are caught and reported back so one bad file never takes down the others.
+    """
+    print(f"\n>>> [Silver] Processing {hospital_name} ({filename})...")
+    rows_read = rows = 0
+    error = None
+    with measure() as metrics:
+        try:
+            rows_read, rows, detected = process_hospital(bronze_path, hospital_name, part_path, chunk_size, detected)
+        except Exception as e:
+            error = str(e)
+    metrics.update(rows_in=rows_read, rows_out=rows, bytes_in=path_bytes(bronze_path), bytes_out=path_bytes(part_path))
+    return {"hospital_name": hospital_name, "part_path": part_path, "rows": rows, "error": error, "metrics": metrics, "detected": detected}
+
+
+def failed_result(task, error):
+    return {"hospital_name": task[1], "part_path": task[3], "rows": 0, "error": error}
+
+
+def run_hospital_isolated(task):
+    """Runs one hospital in a worker process of its own, so a hard crash (e.g. an OOM kill) fails only that hospital."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
         try:
-            with open(filepath, 'r', encoding=encoding) as f:
-                lines = f.readlines()
-            used_encoding = encoding
-            break
-        except UnicodeDecodeError:
-            continue
-            
-    if not lines:
-        raise ValueError(f"Could not read {filepath} with supported encodings.")
-
-    # 2. Find Header Row
-    # We look for a row that has both 'description' and 'code|1' or 'payer_name'
-    header_keywords = ["description", "code|1", "payer_name", "standard_charge"]
-    header_index = 0
-    found_header = False
-    
-    # Check first 50 rows for header
-    for i, line in enumerate(lines[:50]):
-        lower_line = line.lower()
-        # Skip rows that are clearly metadata
-        if lower_line.startswith("hospital_name") or lower_line.startswith("license_number"):
-            continue
-            
-        match_count = sum(1 for k in header_keywords if k in lower_line)
-        if match_count >= 2: 
-            header_index = i
-            found_header = True
-            print(f">>> [Silver] Found header row at index {i} (line {i+1})")
-            break
-            
-    if not found_header:
-        print(">>> [Silver] Warning: No clear header found, assuming index 0.")
-
-    # 3. Read CSV starting from header row
-    df = pd.read_csv(filepath, encoding=used_encoding, skiprows=header_index, low_memory=False)
-    
-    # 4. Strip trailing empty/metadata rows
-    # Often hospitals have footers. We'll drop rows where description or code is missing.
-    # Emory often has a "To the best of its knowledge..." disclaimer at the top/bottom.
-    initial_count = len(df)
-    
-    # We look for rows where 'description' is null or looks like a disclaimer
-    if "description" in df.columns:
-        df = df[df["description"].notnull()]
-        df = df[~df["description"].str.contains("To the best of its knowledge", case=False, na=False)]
-        
-    if len(df) < initial_count:
-        print(f">>> [Silver] Dropped {initial_count - len(df)} trailing/empty/disclaimer rows.")
-            
-    return df
-
-def process_emory():
+            return pool.submit(run_hospital, *task).result()
+        except BrokenProcessPool as e:
+            return failed_result(task, f"Worker process died: {e}")
+
+
+def run_hospitals_parallel(tasks, workers):
+    """
+    run_hospital for each task across `workers` processes, keyed by hospital. A worker dying hard breaks the
+    whole pool; hospitals that finished keep their results and the unfinished ones rerun one per process.
+    """
+    results = {}
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_hospital, *task) for task in tasks]
+        for task, future in zip(tasks, futures):
+            try:
+                results[task[0].replace("_raw.csv", "")] = future.result()
+            except BrokenProcessPool:
+                unfinished.append(task)
+            except Exception as e:
+                results[task[0].replace("_raw.csv", "")] = failed_result(task, str(e))
+    if unfinished:
+        print(f"!!! [Silver] A worker process died; rerunning {len(unfinished)} unfinished hospitals one process each")
+        for task in unfinished:
+            results[task[0].replace("_raw.csv", "")] = run_hospital_isolated(task)
+    return results
+
+
+def process_emory(bronze_dir="/app/data/bronze", silver_output_dir="/app/data/silver", chunk_size=CHUNK_SIZE, workers=WORKERS, write_csv=WRITE_CSV, full_refresh=FULL_REFRESH):
     print(">>> [Silver] Starting Emory Multi-Hospital Processing (Raw -> Clean Mode)")
 
     # 1. Define Paths
-    bronze_dir = "/app/data/bronze"
     catalog_path = os.path.join(bronze_dir, "hospital_catalog.json")
-    silver_output_dir = "/app/data/silver"
-    silver_output_file = os.path.join(silver_output_dir, "emory_all_cleaned.csv")
-    
-    # Ensure output dir exists
-    os.makedirs(silver_output_dir, exist_ok=True)
-    
+    manifest_path = os.path.join(bronze_dir, MANIFEST_FILENAME)
+    silver_dataset_dir = os.path.join(silver_output_dir, "emory_silver")
+    silver_csv_file = os.path.join(silver_output_dir, "emory_all_cleaned.csv")
+    staging_dir = silver_dataset_dir + ".tmp"
+
     # 1.5 Load Catalog
     if not os.path.exists(catalog_path):
         print(f"!!! [Silver] Hospital catalog not found: {catalog_path}. Run Bronze first.")
@@ -86,108 +264,109 @@ def process_emory():
     with open(catalog_path, 'r') as f:
         hospital_mapping = json.load(f)
 
-    all_dfs = []
-
     # Get all raw files
     if not os.path.exists(bronze_dir):
         print(f"!!! [Silver] Bronze directory not found: {bronze_dir}")
         return
 
     raw_files = [f for f in os.listdir(bronze_dir) if f.endswith("_raw.csv")]
-    
+
     try:
+        # Ensure output dirs exist
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        os.makedirs(staging_dir)
+
+        manifest = load_manifest(manifest_path)
+        existing_partitions = list_partitions(silver_dataset_dir)
+
+        tasks = []
+        results = {}
+        fingerprints = {}
+        sources = {}
         for filename in sorted(raw_files):
             hospital_key = filename.replace("_raw.csv", "")
             hospital_name = hospital_mapping.get(hospital_key, hospital_key.replace("_", " ").title())
             bronze_path = os.path.join(bronze_dir, filename)
-            
-            print(f"\n>>> [Silver] Processing {hospital_name} ({filename})...")
-            
-            try:
-                # 2. Read Bronze (Dynamic Header Detection)
-                df = find_header_and_read(bronze_path)        
-                print(f">>> [Silver] {hospital_name} Init Shape: {df.shape}")
-                
-                # Normalize column names
-                df.columns = [c.strip().lower() for c in df.columns]
-                
-                # Inject Facility Information
-                df["hospital_name"] = hospital_name
-                df["hospital_address"] = "" # Leave empty for now
-                df["effective_date"] = "2025-10-01"
-
-                # COLUMN SELECTION & RENAMING
-                column_map = {
-                    "hospital_name": "hospital_name",
-                    "hospital_address": "address",
-                    "effective_date": "effective_date",
-                    "code|1|type": "billing_code_type",
-                    "code|1": "billing_code",
-                    "description": "description",
-                    "billing_class": "billing_class",
-                    "setting": "setting",
-                    "payer_name": "payer",
-                    "plan_name": "plan",
-                    "standard_charge|min": "min_negotiated_rate",
-                    "standard_charge|max": "max_negotiated_rate",
-                    "estimated_amount": "estimated_amount"
-                }
-
-                # Filter down to codes with inpatient/outpatient insurance information
-                if 'code|1|type' in df.columns:
-                    df = df[df['code|1|type'].isin(['MS-DRG', 'APC'])]
-                elif 'code_1_type' in df.columns:
-                    df = df[df['code_1_type'].isin(['MS-DRG', 'APC'])]
-
-                cleaned_df = pd.DataFrame()
-                for src, dst in column_map.items():
-                    if src in df.columns:
-                        cleaned_df[dst] = df[src]
-                    else:
-                        # Try fallback for 'code|1' vs 'code_1'
-                        alt_src = src.replace("|", "_")
-                        if alt_src in df.columns:
-                            cleaned_df[dst] = df[alt_src]
-
-                # Basic cleanup
-                if not cleaned_df.empty and "description" in cleaned_df.columns:
-                    cleaned_df["description"] = cleaned_df["description"].fillna("").astype(str)
-                    
-                    # Extract Level and Procedure Type
-                    import re
-                    def parse_description(desc):
-                        level = None
-                        proc_type = desc
-                        match = re.search(r"Level\s+(\d+)", desc, re.IGNORECASE)
-                        if match:
-                            level = match.group(1)
-                            # Remove "Level X" and any leading/trailing separators
-                            clean_name = re.sub(r"Level\s+\d+", "", desc, flags=re.IGNORECASE).strip()
-                            clean_name = re.sub(r"^[\s\-\–:|,]+|[\s\-\–:|,]+$", "", clean_name).strip()
-                            proc_type = f"{clean_name} Level {level}"
-                        
-                        return pd.Series([level or "1", proc_type])
-
-                    cleaned_df[["level", "procedure_type"]] = cleaned_df["description"].apply(parse_description)
-                
-                if not cleaned_df.empty:
-                    all_dfs.append(cleaned_df)
-                    print(f">>> [Silver] Finished {hospital_name}. Cleaned rows: {len(cleaned_df)}")
-                else:
-                    print(f">>> [Silver] Warning: {hospital_name} produced zero cleaned rows.")
+            part_path = partition_path(staging_dir, hospital_key)
 
-            except Exception as e:
-                print(f"!!! [Silver] Error processing {hospital_name}: {e}")
+            # Skip hospitals whose Bronze file hasn't changed since the last successful build
+            entry = manifest.setdefault(hospital_key, {})
+            sources[hospital_key] = source_sha256(bronze_path, entry)
+            fingerprints[hospital_key] = fingerprint(sources[hospital_key], hospital_name, SILVER_FORMAT_VERSION)
+            previous = entry.get("silver", {})
+            if not full_refresh and previous.get("fingerprint") == fingerprints[hospital_key] and (
+                    hospital_key in existing_partitions or not previous.get("rows")):
+                if previous.get("rows"):
+                    carry_over_partition(existing_partitions[hospital_key], part_path)
+                results[hospital_key] = {"hospital_name": hospital_name, "part_path": part_path, "rows": previous["rows"], "error": None, "reused": True}
+                continue
+
+            # Layout, encoding and header row found for this exact file last time, if any
+            detected = entry.get("detected", {})
+            detected = {key: detected[key] for key in ("reader", "encoding", "header_index")} if detected.get("sha256") == sources[hospital_key] else None
 
-        # 4. Write Combined Output
-        if all_dfs:
-            final_df = pd.concat(all_dfs, ignore_index=True)
-            print(f"\n>>> [Silver] Writing Combined CSV ({len(final_df)} rows) to {silver_output_file}")
-            final_df.to_csv(silver_output_file, index=False)
+            os.makedirs(os.path.dirname(part_path))
+            tasks.append((filename, hospital_name, bronze_path, part_path, chunk_size, detected))
+
+        print(f">>> [Silver] {len(tasks)} hospitals changed, {len(results)} unchanged.")
+
+        # 2. Clean each changed hospital into its own partition, in parallel if configured
+        workers = max(1, min(workers, len(tasks)))
+        if workers > 1:
+            print(f">>> [Silver] Processing {len(tasks)} hospitals with {workers} worker processes")
+            results.update(run_hospitals_parallel(tasks, workers))
+        else:
+            for task in tasks:
+                results[task[0].replace("_raw.csv", "")] = run_hospital(*task)
+
+        # 3. Report in catalog order regardless of which worker finished first
+        total_rows = 0
+        # Per-hospital metrics for the pipeline's run report
+        report = {"rows_in": 0, "rows_out": 0, "hospitals": {}}
+        for hospital_key in sorted(results):
+            result = results[hospital_key]
+            hospital_name = result["hospital_name"]
+            entry = manifest[hospital_key]
+            metrics = result.get("metrics", {})
+            report["rows_in"] += metrics.get("rows_in", 0)
+            report["hospitals"][hospital_key] = dict(
+                metrics, rows_out=result["rows"], status="failed" if result["error"] else "reused" if result.get("reused") else "rebuilt")
+            if not result["rows"]:
+                shutil.rmtree(os.path.dirname(result["part_path"]), ignore_errors=True)
+            if result["error"]:
+                entry.pop("silver", None)
+                entry.pop("detected", None)
+                print(f"!!! [Silver] Error processing {hospital_name}: {result['error']}")
+                continue
+
+            total_rows += result["rows"]
+            if result.get("reused"):
+                print(f">>> [Silver] Unchanged {hospital_name}, reused {result['rows']} rows.")
+                continue
+
+            entry["silver"] = {"fingerprint": fingerprints[hospital_key], "rows": result["rows"]}
+            entry["detected"] = dict(result["detected"], sha256=sources[hospital_key])
+            if result["rows"]:
+                print(f">>> [Silver] Finished {hospital_name}. Cleaned rows: {result['rows']}")
+            else:
+                print(f">>> [Silver] Warning: {hospital_name} produced zero cleaned rows.")
+
+        # 4. Publish Partitioned Output
+        report["rows_out"] = total_rows
+        if total_rows:
+            print(f"\n>>> [Silver] Publishing Parquet dataset ({total_rows} rows) to {silver_dataset_dir}")
+            publish_dataset(staging_dir, silver_dataset_dir)
+            save_manifest(manifest, manifest_path)
+            if write_csv:
+                print(f">>> [Silver] Writing Combined CSV to {silver_csv_file}")
+                export_csv(list_partitions(silver_dataset_dir).values(), silver_csv_file)
             print(">>> [Silver] Done.")
         else:
+            shutil.rmtree(staging_dir)
             print("!!! [Silver] No data was processed.")
-        
+        return report
+
     except Exception as e:
         print(f"!!! Error in Silver Processing: {e}")
         sys.exit(1)
@@ -20,6 +20,26 @@ export const getRates = (search, hospital, setting, payer, plan) => {
     return api.get('/rates', { params });
 };
 
+// One round trip for many exact-match filter sets. `filters` is a list of { key?, code, hospital, setting, payer, plan };
+// `cross` takes lists (codes, hospitals, settings, payers, plans) whose cross product is added, e.g. { codes, payers }.
+// Returns [{ key, filters, rates, has_more }] in request order
+export const getRatesBatch = (filters = [], cross = {}, limit) => {
+    const body = { filters, ...cross };
+    if (limit) body.limit = limit;
+    return api.post('/rates/batch', body);
+};
+
+// by: 'hospital' | 'payer'. Returns per-group median_rate stats (min/max/median, spread, rank) instead of raw rows
+export const getRateComparison = (by, search, hospital, setting, payer, plan) => {
+    const params = { by };
+    if (search) params.search = search;
+    if (hospital) params.hospital = hospital;
+    if (setting) params.setting = setting;
+    if (payer) params.payer = payer;
+    if (plan) params.plan = plan;
+    return api.get('/rates/compare', { params });
+};
+
 export const getProcedures = (search, hospital, setting, payer, plan) => {
     const params = {};
     if (search) params.search = search;